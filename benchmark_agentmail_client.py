@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark AgentmailClient connection pooling against a local HTTP stand-in.
+
+Compares one-off requests.get calls (new TCP connection per call, as the
+client used to do) with the pooled keep-alive session, and checks that
+429 responses are retried with Retry-After honoured.
+
+The stand-in is plain HTTP on localhost, so the numbers only show TCP
+setup savings; against the real API each avoided call also skips a TLS
+handshake.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from poc_monitor import AgentmailClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Minimal Agentmail stand-in: list messages and send"""
+    
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    throttle_remaining = 0  # number of upcoming requests to answer with 429
+    connections = 0
+    
+    def setup(self):
+        super().setup()
+        StandInHandler.connections += 1
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _reply(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _maybe_throttle(self) -> bool:
+        if StandInHandler.throttle_remaining > 0:
+            StandInHandler.throttle_remaining -= 1
+            self._reply(429, {"error": "rate limited"}, {"Retry-After": "0.05"})
+            return True
+        return False
+    
+    def do_GET(self):
+        if self._maybe_throttle():
+            return
+        self._reply(200, {"messages": [{"message_id": "m1", "subject": "AC broken"}]})
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self._maybe_throttle():
+            return
+        self._reply(200, {"message_id": "sent_1"})
+
+
+def benchmark(calls: int = 500):
+    """Run the pooling and retry benchmarks"""
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    url = f"{base_url}/inboxes/test/messages"
+    
+    print("Benchmarking AgentmailClient connection pooling")
+    print("=" * 60)
+    print(f"Stand-in: {base_url}, {calls} calls each")
+    print()
+    
+    # Baseline: module-level requests.get, new connection per call
+    StandInHandler.connections = 0
+    start = time.perf_counter()
+    for _ in range(calls):
+        requests.get(url, params={"limit": 5}).raise_for_status()
+    baseline = time.perf_counter() - start
+    print(f"requests.get:  {baseline:.3f}s  ({baseline / calls * 1000:.2f} ms/call, {StandInHandler.connections} connections)")
+    
+    # Pooled session
+    client = AgentmailClient("test-key", "test", base_url=base_url)
+    StandInHandler.connections = 0
+    start = time.perf_counter()
+    for _ in range(calls):
+        client.get_messages(limit=5)
+    pooled = time.perf_counter() - start
+    print(f"pooled client: {pooled:.3f}s  ({pooled / calls * 1000:.2f} ms/call, {StandInHandler.connections} connections)")
+    print(f"Speedup: {baseline / pooled:.1f}x")
+    print()
+    
+    # Retry: two 429s with Retry-After, then success
+    StandInHandler.throttle_remaining = 2
+    start = time.perf_counter()
+    result = client.send_reply("customer@example.com", "Re: AC broken", "Thanks!")
+    elapsed = time.perf_counter() - start
+    assert result == {"message_id": "sent_1"}, result
+    assert elapsed >= 0.1, "Retry-After was not honoured"
+    print(f"✅ send_reply retried through 2x 429 in {elapsed:.3f}s")
+    
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    benchmark()
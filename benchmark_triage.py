@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Offline triage benchmark and accuracy harness.
+
+Runs a triage backend over a labeled JSONL corpus and reports throughput
+(messages/sec), per-message latency (p50/p95/p99/max), peak memory and
+accuracy plus a confusion matrix for intent, service_type and urgency,
+so a speed-up can be checked against a quality regression in one run.
+
+Corpus lines are JSON objects:
+    {"id": "c01", "from": "...", "subject": "...", "text": "...",
+     "expected": {"intent": "urgent", "service_type": "hvac_repair", "urgency": "emergency"}}
+
+Labels may also sit at the top level, and "title"/"body" are accepted in
+place of subject/text, so request-style JSONL loads as-is. Fields without
+a label are not scored. triage_corpus.jsonl is a small hand-labeled
+starter set.
+
+Backends:
+    openclaw      OpenClawTriage rule engine on its own
+    rules         MessageTriage in rules mode (what the monitor runs)
+    tiered        MessageTriage in tiered mode (needs ANTHROPIC_API_KEY)
+    claude        ClaudeTriage, one request per message
+    claude-async  AsyncClaudeTriage.triage_many (--batch-size sets messages per call)
+    module:attr   any class or factory returning an object with triage_message()
+
+Usage:
+    python3 benchmark_triage.py
+    python3 benchmark_triage.py --backend claude --workers 4 --repeat 1
+    python3 benchmark_triage.py --json report.json
+    python3 benchmark_triage.py --baseline report.json   # exit 1 if accuracy dropped
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+FIELDS = ["intent", "service_type", "urgency"]
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "triage_corpus.jsonl")
+
+
+def load_corpus(path: str) -> List[Dict]:
+    """
+    Load labeled messages from a JSONL file.
+    
+    Returns:
+        Dicts with "message" (what the triage engine sees) and "expected"
+        (field -> label, only for labeled fields)
+    """
+    corpus = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            labels = dict(row.get("expected") or {})
+            for field in FIELDS:
+                if field in row and field not in labels:
+                    labels[field] = row[field]
+            message = {
+                "message_id": str(row.get("id") or row.get("message_id") or row.get("request_id") or line_number),
+                "from": row.get("from", "customer@example.com"),
+                "subject": row.get("subject") or row.get("title", ""),
+                "text": row.get("text") or row.get("body", "")
+            }
+            corpus.append({"message": message, "expected": {k: v for k, v in labels.items() if k in FIELDS and v}})
+    return corpus
+
+
+def build_backend(name: str):
+    """Instantiate a triage backend by name (see module docstring)"""
+    if name == "openclaw":
+        from openclaw_triage import OpenClawTriage
+        return OpenClawTriage()
+    if name in ("rules", "tiered"):
+        from poc_monitor import MessageTriage
+        return MessageTriage(mode=name)
+    if name == "claude":
+        from claude_triage import ClaudeTriage
+        return ClaudeTriage()
+    if name == "claude-async":
+        from claude_triage import AsyncClaudeTriage
+        return AsyncClaudeTriage()
+    if ":" in name:
+        module_name, attr = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), attr)()
+    raise ValueError(f"Unknown backend: {name}")
+
+
+def _batch_method(backend) -> Optional[Callable[[List[Dict]], List[Dict]]]:
+    # triage_many is the async-native entry point; triage_batch may wrap it
+    return getattr(backend, "triage_many", None) or getattr(backend, "triage_batch", None)
+
+
+def _is_error(result: Dict) -> bool:
+    """True for a failed triage: an exception here, or the backend's fallback stand-in"""
+    return "error" in result or bool(result.get("fallback"))
+
+
+def run_pass(backend, messages: List[Dict], workers: int = 1, batch_size: int = 1):
+    """
+    Triage every message once.
+    
+    With batch_size > 1 the backend's triage_many/triage_batch is called per
+    chunk and each message is charged the chunk's time divided evenly.
+    Backends with triage_many (async) always go through it, one message
+    per call when batch_size is 1; AsyncClaudeTriage runs every call from
+    every worker on its one event loop, so its rate limits hold across
+    --workers.
+    
+    Returns:
+        (results in corpus order, per-message latencies in seconds, wall time)
+    """
+    def one(message):
+        start = time.perf_counter()
+        try:
+            result = backend.triage_message(message)
+        except Exception as e:
+            result = {"error": str(e)}
+        return result, time.perf_counter() - start
+    
+    def chunk(batch):
+        start = time.perf_counter()
+        try:
+            results = batch_method(batch)
+        except Exception as e:
+            results = [{"error": str(e)}] * len(batch)
+        share = (time.perf_counter() - start) / len(batch)
+        return [(result, share) for result in results]
+    
+    batch_method = _batch_method(backend) if batch_size > 1 else getattr(backend, "triage_many", None)
+    if batch_size > 1 and batch_method is None:
+        raise ValueError("--batch-size needs a backend with triage_batch() or triage_many()")
+    
+    start = time.perf_counter()
+    if batch_method is not None:
+        chunks = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            timed = [pair for pairs in pool.map(chunk, chunks) for pair in pairs]
+    elif workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            timed = list(pool.map(one, messages))
+    else:
+        timed = [one(message) for message in messages]
+    wall = time.perf_counter() - start
+    
+    return [result for result, _ in timed], [latency for _, latency in timed], wall
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values), max(1, math.ceil(q * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def score(corpus: List[Dict], results: List[Dict]) -> Dict:
+    """
+    Accuracy and confusion matrix per field.
+    
+    Returns:
+        field -> {"labeled", "correct", "accuracy", "confusion": {expected: {predicted: n}}}
+    """
+    scores = {}
+    for field in FIELDS:
+        labeled = correct = 0
+        confusion: Dict[str, Dict[str, int]] = {}
+        for item, result in zip(corpus, results):
+            expected = item["expected"].get(field)
+            if expected is None:
+                continue
+            predicted = "(error)" if _is_error(result) else str(result.get(field, "(missing)"))
+            labeled += 1
+            correct += predicted == expected
+            row = confusion.setdefault(expected, {})
+            row[predicted] = row.get(predicted, 0) + 1
+        scores[field] = {
+            "labeled": labeled,
+            "correct": correct,
+            "accuracy": correct / labeled if labeled else None,
+            "confusion": confusion
+        }
+    return scores
+
+
+def benchmark(
+    backend,
+    corpus: List[Dict],
+    repeat: int = 3,
+    workers: int = 1,
+    batch_size: int = 1,
+    warmup: bool = True
+) -> Dict:
+    """
+    Run the backend over the corpus and build a report.
+    
+    The warm-up pass runs under tracemalloc to measure peak Python memory;
+    the timed passes run without it so tracing doesn't inflate latency.
+    Accuracy is scored on the last timed pass.
+    """
+    messages = [item["message"] for item in corpus]
+    report = {"messages": len(messages), "repeat": repeat, "workers": workers, "batch_size": batch_size}
+    
+    if warmup:
+        tracemalloc.start()
+        run_pass(backend, messages, workers, batch_size)
+        report["peak_traced_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    
+    latencies: List[float] = []
+    wall = 0.0
+    results: List[Dict] = []
+    for _ in range(max(1, repeat)):
+        results, pass_latencies, pass_wall = run_pass(backend, messages, workers, batch_size)
+        latencies.extend(pass_latencies)
+        wall += pass_wall
+    
+    latencies.sort()
+    report["messages_per_sec"] = round(len(latencies) / wall, 1) if wall else None
+    report["latency_ms"] = {
+        "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99": round(percentile(latencies, 0.99) * 1000, 3),
+        "max": round(latencies[-1] * 1000, 3) if latencies else 0.0
+    }
+    report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KB on Linux
+    report["errors"] = sum(1 for result in results if _is_error(result))
+    report["accuracy"] = score(corpus, results)
+    report["mismatches"] = [
+        {
+            "id": item["message"]["message_id"],
+            "subject": item["message"]["subject"],
+            **{field: {"expected": item["expected"][field], "predicted": result.get(field)}
+               for field in FIELDS if field in item["expected"] and result.get(field) != item["expected"][field]}
+        }
+        for item, result in zip(corpus, results)
+        if any(field in item["expected"] and result.get(field) != item["expected"][field] for field in FIELDS)
+    ]
+    return report
+
+
+def print_report(report: Dict, show_mismatches: bool = False):
+    """Human-readable summary with one confusion matrix per field"""
+    latency = report["latency_ms"]
+    print(f"Throughput: {report['messages_per_sec']} messages/sec "
+          f"({report['messages']} messages x {report['repeat']} passes, workers: {report['workers']})")
+    print(f"Latency:    p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, max {latency['max']} ms")
+    memory = f"max RSS {report['max_rss_mb']} MB"
+    if "peak_traced_kb" in report:
+        memory = f"peak traced {report['peak_traced_kb']} KB, " + memory
+    print(f"Memory:     {memory}")
+    if report["errors"]:
+        print(f"Errors:     {report['errors']} messages failed")
+    print()
+    
+    for field, result in report["accuracy"].items():
+        if not result["labeled"]:
+            continue
+        print(f"{field}: {result['correct']}/{result['labeled']} correct ({result['accuracy']:.1%})")
+        
+        confusion = result["confusion"]
+        labels = sorted(set(confusion) | {p for row in confusion.values() for p in row})
+        width = max(len(label) for label in labels) + 2
+        cells = [max(5, len(label) + 2) for label in labels]
+        print(" " * width + "".join(label.rjust(cell) for label, cell in zip(labels, cells)) + "   <- predicted")
+        for expected in labels:
+            if expected not in confusion:
+                continue
+            row = confusion[expected]
+            print(expected.ljust(width) + "".join(str(row.get(label, "")).rjust(cell) for label, cell in zip(labels, cells)))
+        print()
+    
+    if show_mismatches and report["mismatches"]:
+        print("Mismatches:")
+        for mismatch in report["mismatches"]:
+            details = ", ".join(
+                f"{field} {value['expected']} -> {value['predicted']}"
+                for field, value in mismatch.items() if field in FIELDS
+            )
+            print(f"  [{mismatch['id']}] {mismatch['subject']}: {details}")
+        print()
+
+
+def compare_to_baseline(report: Dict, baseline: Dict, tolerance: float = 0.0) -> List[str]:
+    """Fields whose accuracy fell more than `tolerance` below the baseline report's"""
+    regressions = []
+    for field in FIELDS:
+        before = baseline.get("accuracy", {}).get(field, {}).get("accuracy")
+        after = report["accuracy"][field]["accuracy"]
+        if before is not None and after is not None and after < before - tolerance:
+            regressions.append(f"{field}: {before:.1%} -> {after:.1%}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark a triage backend against a labeled corpus")
+    parser.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS, help="labeled JSONL corpus (default: triage_corpus.jsonl)")
+    parser.add_argument("--backend", default="rules", help="openclaw, rules, tiered, claude, claude-async or module:attr")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the corpus")
+    parser.add_argument("--workers", type=int, default=1, help="messages (or batches) triaged concurrently")
+    parser.add_argument("--batch-size", type=int, default=1, help="messages per triage_batch/triage_many call")
+    parser.add_argument("--no-warmup", action="store_true", help="skip the warm-up pass (and the peak memory measurement)")
+    parser.add_argument("--mismatches", action="store_true", help="list every misclassified message")
+    parser.add_argument("--json", metavar="FILE", help="also write the full report as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="JSON report to compare accuracy against")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="accuracy drop allowed vs. the baseline (0.02 = 2 points)")
+    args = parser.parse_args(argv)
+    
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    
+    corpus = load_corpus(args.corpus)
+    try:
+        backend = build_backend(args.backend)
+    except (ValueError, ImportError, AttributeError) as e:
+        parser.error(f"--backend {args.backend}: {e}")
+    if args.batch_size > 1 and _batch_method(backend) is None:
+        parser.error(f"--batch-size needs a backend with triage_batch() or triage_many(); {args.backend} has neither")
+    
+    print("Benchmarking triage")
+    print("=" * 60)
+    print(f"Backend: {args.backend}, corpus: {args.corpus} ({len(corpus)} messages)")
+    print()
+    
+    try:
+        report = benchmark(
+            backend, corpus,
+            repeat=args.repeat,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            warmup=not args.no_warmup
+        )
+    finally:
+        # Stops AsyncClaudeTriage's event loop and ClaudeTriage's stream pool
+        if hasattr(backend, "close"):
+            backend.close()
+    report["backend"] = args.backend
+    report["corpus"] = args.corpus
+    print_report(report, show_mismatches=args.mismatches)
+    
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"❌ Accuracy regressed: {'; '.join(regressions)}")
+            return 1
+        print("✅ No accuracy regression against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -7,8 +7,42 @@ Production version would use actual Google Calendar API with OAuth.
 """
 
 import json
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import random
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Availability bitmaps: one bit per 15-minute block, 96 per day
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+
+
+def _free_run_starts(busy: int, width: int, length: int) -> int:
+    """
+    Bitmask of positions where `length` consecutive blocks are free.
+    
+    Args:
+        busy: Busy bitmap (bit i set = block i booked)
+        width: Number of blocks the bitmap covers
+        length: Blocks needed
+    
+    Bit q of the result is set iff blocks q .. q+length-1 are all free.
+    Uses O(log length) shift-and-AND steps on the whole bitmap at once.
+    """
+    runs = ~busy & ((1 << width) - 1)
+    span = 1
+    while span < length:
+        step = min(span, length - span)
+        runs &= runs >> step
+        span += step
+    return runs
+
 
 class CalendarManager:
     """
@@ -18,12 +52,14 @@ class CalendarManager:
     Production: Will use Google Calendar API.
     """
     
-    def __init__(self, calendar_id: Optional[str] = None):
+    def __init__(self, calendar_id: Optional[str] = None, reservations_path: Optional[str] = None):
         """
         Initialize calendar manager.
         
         Args:
             calendar_id: Google Calendar ID (for production)
+            reservations_path: Optional SQLite file shared by every process
+                that books into this calendar; makes booking process-safe
         """
         self.calendar_id = calendar_id
         
@@ -34,8 +70,224 @@ class CalendarManager:
             "working_days": [0, 1, 2, 3, 4]  # Monday-Friday
         }
         
-        # Mock existing bookings (in production, fetched from Google Calendar)
-        self.mock_bookings = []
+        # Mock existing bookings (in production, fetched from Google Calendar).
+        # Private: add_booking/remove_booking/load_bookings keep the index
+        # below in step with it.
+        self._bookings: List[Dict] = []
+        
+        # Interval index over the bookings: (starts, ends, max_end) lists
+        # sorted by start, with a running max of end times so "does anything
+        # overlap [start, end)?" is a single bisect + lookup. Writers build a
+        # new tuple and swap it in, so readers always see a consistent
+        # snapshot without locking.
+        self._booking_index: Tuple[List[datetime], List[datetime], List[datetime]] = ([], [], [])
+        self._index_lock = threading.Lock()
+        
+        # Per-day busy bitmaps (SLOTS_PER_DAY bits, one int per day with
+        # bookings) kept in step with the index; availability scans use these
+        self._busy_days: Dict[date, int] = {}
+        
+        # Booking is check-then-insert under a lock per calendar day, so
+        # bookings on different days never wait for each other
+        self._day_locks: Dict[date, threading.Lock] = {}
+        self._day_locks_guard = threading.Lock()
+        
+        self._reservations = None
+        self._reservations_lock = threading.Lock()
+        if reservations_path:
+            self._open_reservations(reservations_path)
+    
+    @property
+    def mock_bookings(self) -> List[Dict]:
+        """Copy of the current bookings (change them with add_booking/remove_booking/load_bookings)"""
+        with self._index_lock:
+            return list(self._bookings)
+    
+    def load_bookings(self, bookings: List[Dict]):
+        """Replace every booking at once (one index rebuild, e.g. a calendar sync)"""
+        with self._index_lock:
+            self._bookings = list(bookings)
+            self._rebuild_index()
+    
+    def add_booking(self, booking: Dict):
+        """Record a booking (dict with start/end datetimes) and insert it into the interval index"""
+        with self._index_lock:
+            starts, ends, max_end = self._booking_index
+            
+            end = booking["end"]
+            i = bisect_right(starts, booking["start"])
+            starts = starts[:i] + [booking["start"]] + starts[i:]
+            ends = ends[:i] + [end] + ends[i:]
+            max_end = max_end[:i] + [end if i == 0 or max_end[i - 1] < end else max_end[i - 1]] + max_end[i:]
+            
+            # Later running maxima only change while they are below the new end
+            for j in range(i + 1, len(max_end)):
+                if max_end[j] >= end:
+                    break
+                max_end[j] = end
+            
+            self._bookings.append(booking)
+            self._booking_index = (starts, ends, max_end)
+            self._mark_busy(booking["start"], end)
+    
+    @staticmethod
+    def _day_blocks(day: date, start: datetime, end: datetime) -> int:
+        """Bits of `day` touched by [start, end), rounded outward to whole blocks"""
+        day_start = datetime.combine(day, datetime.min.time())
+        first = (start - day_start) // timedelta(minutes=SLOT_MINUTES)
+        last = -((day_start - end) // timedelta(minutes=SLOT_MINUTES))  # ceil
+        first, last = max(first, 0), min(last, SLOTS_PER_DAY)
+        return ((1 << (last - first)) - 1) << first if last > first else 0
+    
+    def _mark_busy(self, start: datetime, end: datetime):
+        """Set the bitmap blocks of a new booking (caller holds _index_lock)"""
+        day = start.date()
+        while day <= end.date():
+            blocks = self._day_blocks(day, start, end)
+            if blocks:
+                self._busy_days[day] = self._busy_days.get(day, 0) | blocks
+            day += timedelta(days=1)
+    
+    def _rebuild_busy_day(self, day: date):
+        """Recompute one day's bitmap from the index (caller holds _index_lock)"""
+        starts, ends, max_end = self._booking_index
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        
+        # Walk back from the last booking starting before midnight while
+        # some earlier booking could still reach into the day
+        busy = 0
+        j = bisect_left(starts, day_end) - 1
+        while j >= 0 and max_end[j] > day_start:
+            if ends[j] > day_start:
+                busy |= self._day_blocks(day, starts[j], ends[j])
+            j -= 1
+        
+        if busy:
+            self._busy_days[day] = busy
+        else:
+            self._busy_days.pop(day, None)
+    
+    def remove_booking(self, booking: Dict):
+        """
+        Drop a booking from the bookings, the index and the bitmaps of its days.
+        
+        Raises:
+            ValueError: the booking is not in the calendar
+        """
+        with self._index_lock:
+            self._bookings.remove(booking)
+            starts, ends, max_end = self._booking_index
+            
+            i = bisect_left(starts, booking["start"])
+            while ends[i] != booking["end"]:
+                i += 1
+            starts = starts[:i] + starts[i + 1:]
+            ends = ends[:i] + ends[i + 1:]
+            max_end = max_end[:i]
+            for end in ends[i:]:
+                max_end.append(end if not max_end or end > max_end[-1] else max_end[-1])
+            
+            self._booking_index = (starts, ends, max_end)
+            
+            day = booking["start"].date()
+            while day <= booking["end"].date():
+                self._rebuild_busy_day(day)
+                day += timedelta(days=1)
+    
+    def _rebuild_index(self):
+        """Rebuild the index and bitmaps from the bookings (caller holds _index_lock)"""
+        ordered = sorted(self._bookings, key=lambda b: b["start"])
+        starts = [b["start"] for b in ordered]
+        ends = [b["end"] for b in ordered]
+        max_end = []
+        for end in ends:
+            running = max_end[-1] if max_end else end
+            max_end.append(end if end > running else running)
+        self._booking_index = (starts, ends, max_end)
+        
+        self._busy_days = {}
+        for start, end in zip(starts, ends):
+            self._mark_busy(start, end)
+    
+    @contextmanager
+    def _lock_days(self, start: datetime, end: datetime):
+        """Hold the booking locks of every day [start, end) touches (in date order)"""
+        days = []
+        day = start.date()
+        while day <= end.date():
+            days.append(day)
+            day += timedelta(days=1)
+        
+        with self._day_locks_guard:
+            locks = [self._day_locks.setdefault(day, threading.Lock()) for day in days]
+        with ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+    
+    def _open_reservations(self, path: str):
+        """Open the shared reservations table and load its bookings into the index"""
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reservations (
+                booking_id TEXT PRIMARY KEY,
+                day TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_day ON reservations(day, start)")
+        self._reservations = conn
+        
+        self.load_bookings([
+            {"booking_id": booking_id, "start": datetime.fromisoformat(start), "end": datetime.fromisoformat(end)}
+            for booking_id, start, end in conn.execute("SELECT booking_id, start, end FROM reservations")
+        ])
+    
+    def _reserve(self, booking_id: str, start: datetime, end: datetime) -> bool:
+        """
+        Atomically claim [start, end) in the shared reservations table.
+        
+        BEGIN IMMEDIATE takes SQLite's write lock, so the overlap check and
+        insert cannot interleave with another process's. Bookings are
+        assumed shorter than a day, so only the days around them are checked.
+        
+        Returns:
+            False if another process already holds an overlapping booking
+        """
+        days = [(start.date() - timedelta(days=1)).isoformat(), start.date().isoformat(), end.date().isoformat()]
+        with self._reservations_lock:
+            conn = self._reservations
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                clash = conn.execute(
+                    "SELECT booking_id, start, end FROM reservations WHERE day IN (?, ?, ?) AND start < ? AND end > ?",
+                    (*days, end.isoformat(), start.isoformat())
+                ).fetchone()
+                if clash is None:
+                    conn.execute(
+                        "INSERT INTO reservations (booking_id, day, start, end) VALUES (?, ?, ?, ?)",
+                        (booking_id, start.date().isoformat(), start.isoformat(), end.isoformat())
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        
+        if clash is not None:
+            # Learn about the other process's booking so availability skips it (and it can be cancelled here)
+            booking_id, clash_start, clash_end = clash
+            self.add_booking({
+                "booking_id": booking_id,
+                "start": datetime.fromisoformat(clash_start),
+                "end": datetime.fromisoformat(clash_end)
+            })
+            return False
+        return True
     
     def get_availability(self, date_range_days: int = 7, service_duration_minutes: int = 60) -> List[Dict]:
         """
@@ -44,13 +296,39 @@ class CalendarManager:
         Args:
             date_range_days: Number of days to check
             service_duration_minutes: Duration of service appointment
-            
+        
         Returns:
             List of available slots: [{"start": datetime, "end": datetime}, ...]
         """
-        available_slots = []
+        return list(self.iter_availability(date_range_days, service_duration_minutes))
+    
+    def iter_availability(self, date_range_days: int = 7, service_duration_minutes: int = 60) -> Iterator[Dict]:
+        """
+        Lazily yield available time slots for the next N days, earliest first.
         
-        start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        Each day is one bitmap lookup plus a few shift-and-AND steps, and
+        datetimes are only built for free slots. Work is done only as slots
+        are consumed, so callers that need the first few slots stop as soon
+        as they have them. Bookings made while the generator is suspended
+        may or may not be reflected (book_appointment re-checks anyway).
+        
+        Args:
+            date_range_days: Number of days to check
+            service_duration_minutes: Duration of service appointment
+        
+        Yields:
+            Available slots: {"start": datetime, "end": datetime, "duration_minutes": int}
+        """
+        now = datetime.now()
+        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        busy_days = self._busy_days
+        
+        # A slot needs this many whole blocks free; late slots may run into
+        # the next day(s), so each day is scanned with its successors attached
+        length = -(-service_duration_minutes // SLOT_MINUTES)
+        span_days = 1 + (self.business_hours["end_hour"] * 60 + service_duration_minutes - 1) // (24 * 60)
+        blocks_per_hour = 60 // SLOT_MINUTES
         
         for day_offset in range(date_range_days):
             check_date = start_date + timedelta(days=day_offset)
@@ -59,43 +337,37 @@ class CalendarManager:
             if check_date.weekday() not in self.business_hours["working_days"]:
                 continue
             
-            # Generate slots for this day
-            current_hour = self.business_hours["start_hour"]
-            while current_hour < self.business_hours["end_hour"]:
-                slot_start = check_date.replace(hour=current_hour, minute=0)
-                slot_end = slot_start + timedelta(minutes=service_duration_minutes)
-                
-                # Check if slot is in the future
-                if slot_start > datetime.now():
-                    # In production: check against actual Google Calendar bookings
-                    if not self._is_slot_booked(slot_start, slot_end):
-                        available_slots.append({
-                            "start": slot_start,
-                            "end": slot_end,
-                            "duration_minutes": service_duration_minutes
-                        })
-                
-                # Move to next slot (assuming 1-hour slots)
-                current_hour += 1
-        
-        return available_slots
+            # In production: fill the bitmaps from Google Calendar free/busy
+            busy = 0
+            for i in range(span_days):
+                busy |= busy_days.get((check_date + timedelta(days=i)).date(), 0) << (SLOTS_PER_DAY * i)
+            free = _free_run_starts(busy, SLOTS_PER_DAY * span_days, length)
+            
+            # Hourly slots during business hours; datetimes only for free ones
+            for hour in range(self.business_hours["start_hour"], self.business_hours["end_hour"]):
+                if not (free >> (hour * blocks_per_hour)) & 1:
+                    continue
+                slot_start = check_date.replace(hour=hour)
+                if slot_start > now:
+                    yield {
+                        "start": slot_start,
+                        "end": slot_start + timedelta(minutes=service_duration_minutes),
+                        "duration_minutes": service_duration_minutes
+                    }
     
     def _is_slot_booked(self, start: datetime, end: datetime) -> bool:
         """
         Check if a time slot is already booked.
         
         In production: query Google Calendar API.
-        MVP: check mock bookings list.
+        MVP: O(log n) lookup in the mock booking index.
         """
-        for booking in self.mock_bookings:
-            booking_start = booking["start"]
-            booking_end = booking["end"]
-            
-            # Check for overlap
-            if (start < booking_end) and (end > booking_start):
-                return True
+        starts, _, max_end = self._booking_index
         
-        return False
+        # Bookings starting before `end` are [0, i); one of them overlaps
+        # iff the latest end among them is after `start`
+        i = bisect_left(starts, end)
+        return i > 0 and max_end[i - 1] > start
     
     def book_appointment(
         self,
@@ -114,19 +386,16 @@ class CalendarManager:
             customer_name: Customer's name
             customer_email: Customer's email
             service_type: Type of service being booked
-            
+        
         Returns:
             Booking confirmation dict
         """
         end_time = start_time + timedelta(minutes=duration_minutes)
-        
-        # Check if slot is available
-        if self._is_slot_booked(start_time, end_time):
-            return {
-                "success": False,
-                "error": "Time slot is no longer available",
-                "booking_id": None
-            }
+        unavailable = {
+            "success": False,
+            "error": "Time slot is no longer available",
+            "booking_id": None
+        }
         
         # Create booking
         booking = {
@@ -140,8 +409,16 @@ class CalendarManager:
             "created_at": datetime.now()
         }
         
-        # In production: create Google Calendar event
-        self.mock_bookings.append(booking)
+        # Check and insert atomically: two workers (or, with a reservations
+        # file, two processes) can never both get the same slot
+        with self._lock_days(start_time, end_time):
+            if self._is_slot_booked(start_time, end_time):
+                return unavailable
+            if self._reservations is not None and not self._reserve(booking["booking_id"], start_time, end_time):
+                return unavailable
+            
+            # In production: create Google Calendar event
+            self.add_booking(booking)
         
         return {
             "success": True,
@@ -151,6 +428,39 @@ class CalendarManager:
             "confirmation_sent": True
         }
     
+    def cancel_appointment(self, booking_id: str) -> Dict:
+        """
+        Cancel a booking and free its slot.
+        
+        Args:
+            booking_id: ID returned by book_appointment
+        
+        Returns:
+            Dict with success and, on failure, error ("Booking not found",
+            also for a booking already cancelled)
+        """
+        not_found = {"success": False, "error": "Booking not found"}
+        booking = self._find_booking(booking_id)
+        if booking is None:
+            return not_found
+        
+        with self._lock_days(booking["start"], booking["end"]):
+            # Look again under the lock: a concurrent cancel may have won
+            if self._find_booking(booking_id) is not booking:
+                return not_found
+            if self._reservations is not None:
+                with self._reservations_lock:
+                    self._reservations.execute("DELETE FROM reservations WHERE booking_id = ?", (booking_id,))
+            
+            # In production: delete the Google Calendar event
+            self.remove_booking(booking)
+        
+        return {"success": True, "booking_id": booking_id}
+    
+    def _find_booking(self, booking_id: str) -> Optional[Dict]:
+        with self._index_lock:
+            return next((b for b in self._bookings if b.get("booking_id") == booking_id), None)
+    
     def get_next_available_slots(self, count: int = 5, urgency: str = "flexible") -> List[Dict]:
         """
         Get the next N available slots, adjusted for urgency.
@@ -158,24 +468,25 @@ class CalendarManager:
         Args:
             count: Number of slots to return
             urgency: "emergency", "today", "this_week", or "flexible"
-            
+        
         Returns:
             List of next available slots
         """
         if urgency == "emergency":
             # Check next 24 hours
-            slots = self.get_availability(date_range_days=1)
+            slots = self.iter_availability(date_range_days=1)
         elif urgency == "today":
             # Check today only
-            slots = self.get_availability(date_range_days=1)
+            slots = self.iter_availability(date_range_days=1)
         elif urgency == "this_week":
             # Check next 7 days
-            slots = self.get_availability(date_range_days=7)
+            slots = self.iter_availability(date_range_days=7)
         else:  # flexible
             # Check next 2 weeks
-            slots = self.get_availability(date_range_days=14)
+            slots = self.iter_availability(date_range_days=14)
         
-        return slots[:count]
+        # Stop scanning as soon as `count` free slots are found
+        return list(islice(slots, count))
     
     def format_slot_for_customer(self, slot: Dict) -> str:
         """
@@ -183,7 +494,7 @@ class CalendarManager:
         
         Args:
             slot: Slot dict with start/end datetime
-            
+        
         Returns:
             Formatted string like "Wednesday, Feb 12 at 10:00 AM"
         """
@@ -245,5 +556,218 @@ def test_calendar():
     print("✅ All tests complete")
 
 
+def _random_bookings(count: int, spread_days: int = 20, seed: int = 42) -> List[Dict]:
+    """Generate `count` 30-90 minute bookings within +/- spread_days of now (may overlap)"""
+    rng = random.Random(seed)
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    quarters = spread_days * 24 * 4
+    bookings = []
+    for _ in range(count):
+        start = base + timedelta(minutes=15 * rng.randrange(-quarters, quarters))
+        bookings.append({"start": start, "end": start + timedelta(minutes=rng.choice([30, 60, 90]))})
+    return bookings
+
+
+def test_booking_index():
+    """Check the interval index and availability bitmaps against a linear overlap scan"""
+    
+    print("Testing booking index")
+    print("=" * 60)
+    
+    calendar = CalendarManager()
+    for booking in _random_bookings(300):
+        calendar.add_booking(booking)
+    
+    def linear(start, end):
+        return any(start < b["end"] and end > b["start"] for b in calendar.mock_bookings)
+    
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    for offset in range(-2000, 2000, 7):
+        start = base + timedelta(minutes=15 * offset)
+        for minutes in (15, 60, 120):
+            end = start + timedelta(minutes=minutes)
+            assert calendar._is_slot_booked(start, end) == linear(start, end), (start, end)
+    
+    def check_availability():
+        for minutes in (15, 45, 60, 120):
+            every_slot = CalendarManager().get_availability(14, minutes)
+            expected = [slot for slot in every_slot if not linear(slot["start"], slot["end"])]
+            assert calendar.get_availability(14, minutes) == expected, minutes
+    
+    check_availability()
+    free_slots = calendar.get_availability(date_range_days=14)
+    assert calendar.get_next_available_slots(count=4) == free_slots[:4]
+    
+    # Cancelling updates the index and only the affected days' bitmaps
+    booked = calendar.book_appointment(free_slots[0]["start"], 60, "A", "a@example.com", "hvac")
+    assert calendar.get_availability(date_range_days=14)[0] != free_slots[0]
+    assert calendar.cancel_appointment(booked["booking_id"])["success"]
+    assert calendar.get_availability(date_range_days=14) == free_slots
+    for booking in calendar.mock_bookings[::3]:
+        calendar.remove_booking(booking)
+    check_availability()
+    start = base + timedelta(days=2)
+    assert calendar._is_slot_booked(start, start + timedelta(hours=3)) == linear(start, start + timedelta(hours=3))
+    
+    # A bulk reload rebuilds the index; the mock_bookings copy can't put it out of step
+    calendar.load_bookings(calendar.mock_bookings[:100])
+    start = base + timedelta(days=3)
+    assert calendar._is_slot_booked(start, start + timedelta(hours=1)) == linear(start, start + timedelta(hours=1))
+    free = calendar.get_availability(date_range_days=14)[0]
+    calendar.mock_bookings[0] = {"start": free["start"], "end": free["end"]}
+    calendar.mock_bookings.clear()
+    assert len(calendar.mock_bookings) == 100 and not calendar._is_slot_booked(free["start"], free["end"])
+    
+    print(f"✅ Index and bitmaps match linear scan ({len(free_slots)} free slots over 14 days), also after cancels")
+    print()
+
+
+def benchmark_booking_index(booking_count: int = 10000):
+    """Time 14-day availability with the bitmaps vs a linear scan per slot"""
+    
+    print(f"Benchmarking availability with {booking_count} bookings")
+    print("=" * 60)
+    
+    # Spread over ~3 years so the next two weeks stay partly free
+    calendar = CalendarManager()
+    calendar.load_bookings(_random_bookings(booking_count, spread_days=540))  # bulk load, one index rebuild
+    
+    start = time.perf_counter()
+    indexed = calendar.get_availability(date_range_days=14)
+    indexed_time = time.perf_counter() - start
+    
+    # Previous behaviour: every slot scans every booking
+    start = time.perf_counter()
+    linear = [
+        slot for slot in (
+            {"start": s["start"], "end": s["end"]}
+            for s in CalendarManager().get_availability(date_range_days=14)
+        )
+        if not any(slot["start"] < b["end"] and slot["end"] > b["start"] for b in calendar.mock_bookings)
+    ]
+    linear_time = time.perf_counter() - start
+    
+    assert [s["start"] for s in indexed] == [s["start"] for s in linear]
+    print(f"Bitmap scan:   {indexed_time * 1000:.2f} ms ({len(indexed)} free slots)")
+    print(f"Linear scan:   {linear_time * 1000:.2f} ms")
+    print(f"Speedup: {linear_time / indexed_time:.0f}x")
+    print()
+
+
+
+def _book_slots_in_process(args):
+    """Stress-test worker: try to book every candidate slot through a shared reservations file"""
+    path, starts, seed = args
+    calendar = CalendarManager(reservations_path=path)
+    order = list(starts)
+    random.Random(seed).shuffle(order)
+    booked = []
+    for start in order:
+        result = calendar.book_appointment(start, 60, "P", "p@example.com", "hvac")
+        if result["success"]:
+            booked.append(start)
+    return booked
+
+
+def test_concurrent_booking(threads: int = 16, attempts_per_thread: int = 400):
+    """Hammer book_appointment from many threads and processes; no slot may be booked twice"""
+    import os
+    import sys
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    
+    print("Stress testing concurrent booking")
+    print("=" * 60)
+    
+    base = (datetime.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+    # 30 days x 8 one-hour slots, plus half-hour-offset starts that overlap them
+    candidates = [base + timedelta(days=d, minutes=30 * q) for d in range(30) for q in range(16)]
+    
+    def overlapping(bookings):
+        ordered = sorted(bookings, key=lambda b: b["start"])
+        return sum(1 for a, b in zip(ordered, ordered[1:]) if b["start"] < a["end"])
+    
+    calendar = CalendarManager()
+    
+    def worker(seed):
+        rng = random.Random(seed)
+        booked = 0
+        for _ in range(attempts_per_thread):
+            start = rng.choice(candidates)
+            if calendar.book_appointment(start, 60, "T", "t@example.com", "hvac")["success"]:
+                booked += 1
+        return booked
+    
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        booked = sum(pool.map(worker, range(threads)))
+    elapsed = time.perf_counter() - start_time
+    
+    assert booked == len(calendar.mock_bookings)
+    assert overlapping(calendar.mock_bookings) == 0, "double booking!"
+    print(f"✅ {threads} threads, {threads * attempts_per_thread} attempts: {booked} bookings, none overlapping "
+          f"({threads * attempts_per_thread / elapsed:.0f} attempts/s)")
+    
+    # Head-to-head: all threads released at once onto the same slot
+    rounds = 200
+    barrier = threading.Barrier(threads)
+    
+    def race(calendar):
+        barrier.wait()
+        return calendar.book_appointment(base, 60, "R", "r@example.com", "hvac")["success"]
+    
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in range(rounds):
+            calendar = CalendarManager()
+            winners = sum(pool.map(race, [calendar] * threads))
+            assert winners == 1, f"{winners} threads booked the same slot"
+    print(f"✅ {rounds} rounds of {threads} threads racing for one slot: exactly one winner each")
+    
+    def cancel_race(args):
+        calendar, booking_id = args
+        barrier.wait()
+        return calendar.cancel_appointment(booking_id)
+    
+    # Switch threads very often so the losers look the booking up before the winner removes it
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in range(rounds):
+            calendar = CalendarManager()
+            booking_id = calendar.book_appointment(base, 60, "R", "r@example.com", "hvac")["booking_id"]
+            results = list(pool.map(cancel_race, [(calendar, booking_id)] * threads))
+            assert sum(result["success"] for result in results) == 1, results
+            assert all(result["success"] or result["error"] == "Booking not found" for result in results)
+    sys.setswitchinterval(switch_interval)
+    print(f"✅ {rounds} rounds of {threads} threads cancelling one booking: one success, the rest not found")
+    
+    # Separate processes sharing one reservations file
+    path = os.path.join(tempfile.mkdtemp(), "reservations.db")
+    CalendarManager(reservations_path=path)  # create the schema before workers race for it
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(_book_slots_in_process, [(path, candidates[:64], seed) for seed in range(4)]))
+    all_booked = [start for booked in results for start in booked]
+    bookings = [{"start": s, "end": s + timedelta(minutes=60)} for s in all_booked]
+    assert overlapping(bookings) == 0, "double booking across processes!"
+    assert len(CalendarManager(reservations_path=path).mock_bookings) == len(all_booked)
+    print(f"✅ 4 processes competing for 64 overlapping starts: {len(all_booked)} bookings, none overlapping")
+    
+    # Bookings reloaded after a restart, or learned from a clash, keep their ids and can be cancelled
+    restarted = CalendarManager(reservations_path=path)
+    first = min(all_booked)
+    booking_id = next(b["booking_id"] for b in restarted.mock_bookings if b["start"] == first)
+    assert restarted.cancel_appointment(booking_id)["success"]
+    other = CalendarManager(reservations_path=path)
+    rebooked = restarted.book_appointment(first, 60, "Q", "q@example.com", "hvac")
+    assert rebooked["success"] and not other.book_appointment(first, 60, "Q", "q@example.com", "hvac")["success"]
+    assert other.cancel_appointment(rebooked["booking_id"])["success"]
+    assert other.book_appointment(first, 60, "Q", "q@example.com", "hvac")["success"]
+    print("✅ Reloaded and clash-learned bookings keep their booking_id and can be cancelled")
+    print()
+
+
 if __name__ == "__main__":
     test_calendar()
+    test_booking_index()
+    test_concurrent_booking()
+    benchmark_booking_index()
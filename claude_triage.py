@@ -6,9 +6,18 @@ Uses Anthropic's Claude API to analyze customer messages and extract structured
 
 import os
 import json
-from typing import Dict, Optional
+import asyncio
+import contextlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 import anthropic
 
+from structured_log import ERROR, WARNING, log_event
+
 class ClaudeTriage:
     """Claude-powered message triage for customer communication"""
     
@@ -17,7 +26,7 @@ class ClaudeTriage:
 Your job is to analyze incoming customer messages and extract structured information to help route them appropriately.
 
 Always respond with valid JSON only, no other text."""
-
+    
     TRIAGE_PROMPT_TEMPLATE = """Analyze this customer message and extract structured information:
 
 FROM: {sender}
@@ -25,11 +34,11 @@ SUBJECT: {subject}
 MESSAGE:
 {body}
 
-Extract and return ONLY valid JSON with these fields:
+Extract and return ONLY valid JSON with these fields, in this order:
 {{
   "intent": "booking|question|complaint|urgent|spam|other",
-  "service_type": "hvac_repair|hvac_maintenance|plumbing_repair|plumbing_maintenance|electrical_repair|electrical_maintenance|cleaning|landscaping|other",
   "urgency": "emergency|today|this_week|flexible|unknown",
+  "service_type": "hvac_repair|hvac_maintenance|plumbing_repair|plumbing_maintenance|electrical_repair|electrical_maintenance|cleaning|landscaping|other",
   "preferred_times": ["list of any mentioned time preferences as strings"],
   "customer_name": "name if mentioned, else null",
   "customer_phone": "phone if mentioned, else null",
@@ -50,105 +59,746 @@ Guidelines:
 - For spam/marketing emails, mark as "spam"
 
 Respond ONLY with the JSON object, no markdown formatting."""
+    
+    BATCH_PROMPT_TEMPLATE = """Analyze each of the following customer messages independently. Each message starts with a line "=== MESSAGE <id> ===".
+
+{messages}
 
-    def __init__(self, api_key: Optional[str] = None):
+Return ONLY a JSON array with one object per message, in any order. Each object must have an "id" field (the message id, as a string) plus these fields:
+{{
+  "id": "message id",
+  "intent": "booking|question|complaint|urgent|spam|other",
+  "service_type": "hvac_repair|hvac_maintenance|plumbing_repair|plumbing_maintenance|electrical_repair|electrical_maintenance|cleaning|landscaping|other",
+  "urgency": "emergency|today|this_week|flexible|unknown",
+  "preferred_times": ["list of any mentioned time preferences as strings"],
+  "customer_name": "name if mentioned, else null",
+  "customer_phone": "phone if mentioned, else null",
+  "customer_address": "address if mentioned, else null",
+  "confidence": "high|medium|low - your confidence in this classification",
+  "summary": "1-2 sentence summary of the request",
+  "reasoning": "brief explanation of why you chose this classification"
+}}
+
+Guidelines:
+- intent "urgent": Use for emergencies, ASAP requests, or situations causing immediate problems
+- intent "booking": Customer wants to schedule service
+- intent "question": Asking about pricing, availability, or general info
+- intent "complaint": Expressing dissatisfaction or problems with service
+- urgency "emergency": Immediate danger or critical failure (no heat in winter, flooding, etc)
+- urgency "today": Wants service today but not critical
+- If unsure, mark confidence as "low" and escalate via intent "other"
+- For spam/marketing emails, mark as "spam"
+
+Respond ONLY with the JSON array, no markdown formatting."""
+    
+    BATCH_MESSAGE_TEMPLATE = """=== MESSAGE {id} ===
+FROM: {sender}
+SUBJECT: {subject}
+MESSAGE:
+{body}"""
+    
+    MODEL = "claude-3-5-sonnet-20241022"  # Latest Sonnet model
+    
+    # Output budget per message in a batched request
+    BATCH_TOKENS_PER_MESSAGE = 400
+    
+    # Streaming: fields the router needs before it can act on an emergency
+    EARLY_FIELDS = ("intent", "urgency")
+    
+    # Streams read in the background at once (triage_message_early)
+    STREAM_WORKERS = 4
+    
+    # Seconds triage_message_early waits for the early fields
+    EARLY_TIMEOUT = 20.0
+    
+    def __init__(self, api_key: Optional[str] = None, client=None):
         """
         Initialize Claude client.
         
         Args:
             api_key: Anthropic API key. If None, reads from ANTHROPIC_API_KEY env var.
+            client: Pre-built client exposing messages.create (e.g. a test stub).
+                If given, no API key is required.
         """
+        self._stream_executor: Optional[ThreadPoolExecutor] = None
+        self._stream_lock = threading.Lock()
+        
+        if client is not None:
+            self.api_key = api_key
+            self.client = client
+            return
+        
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
         if not self.api_key:
             raise ValueError("ANTHROPIC_API_KEY must be set in environment or passed to constructor")
         
         self.client = anthropic.Anthropic(api_key=self.api_key)
     
-    def triage_message(self, message: Dict) -> Dict:
-        """
-        Analyze a message and extract structured triage information.
-        
-        Args:
-            message: Dict with keys: from, subject, body/preview
-            
-        Returns:
-            Dict with triage fields (intent, service_type, urgency, etc)
-        """
-        # Extract message fields
+    @staticmethod
+    def _message_fields(message: Dict):
+        """Return (sender, subject, body) as used in the prompts"""
         sender = message.get("from", "Unknown")
         subject = message.get("subject", "(no subject)")
         body = message.get("text") or message.get("preview", "")
+        return sender, subject, body
+    
+    @staticmethod
+    def _strip_markdown(response_text: str) -> str:
+        """Remove ```json fences if the model added them"""
+        response_text = response_text.strip()
+        if response_text.startswith("```json"):
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif response_text.startswith("```"):
+            response_text = response_text.split("```")[1].split("```")[0].strip()
+        return response_text
+    
+    @staticmethod
+    def _fill_required(triage_result: Dict) -> Dict:
+        """Validate required fields, defaulting missing ones to "unknown" """
+        required_fields = ["intent", "service_type", "urgency", "summary"]
+        for field in required_fields:
+            if field not in triage_result:
+                triage_result[field] = "unknown"
+        return triage_result
+    
+    @staticmethod
+    def _complete_array_items(response_text: str) -> List:
+        """Recover the complete leading elements of a truncated/corrupt JSON array"""
+        decoder = json.JSONDecoder()
+        items = []
+        position = response_text.find("[") + 1
+        if position == 0:
+            return items
         
-        # Build prompt
+        while True:
+            while position < len(response_text) and response_text[position] in " \t\r\n,":
+                position += 1
+            try:
+                item, position = decoder.raw_decode(response_text, position)
+            except json.JSONDecodeError:
+                return items
+            items.append(item)
+    
+    @staticmethod
+    def _partial_object(response_text: str) -> Dict:
+        """Recover the complete leading fields of a truncated/corrupt JSON object"""
+        parser = IncrementalJSONObject()
+        parser.feed(response_text)
+        return parser.fields
+    
+    @staticmethod
+    def _fallback_result(subject: str, reasoning: str) -> Dict:
+        """Low-confidence "other" result used when Claude can't be used (marked "fallback")"""
+        return {
+            "intent": "other",
+            "service_type": "other",
+            "urgency": "unknown",
+            "confidence": "low",
+            "summary": subject[:100],
+            "reasoning": reasoning,
+            "preferred_times": [],
+            "customer_name": None,
+            "customer_phone": None,
+            "customer_address": None,
+            "fallback": True
+        }
+    
+    @classmethod
+    def _partial_result(cls, subject: str, reasoning: str, recovered: Dict) -> Dict:
+        """Fields recovered from a broken answer over the fallback defaults (marked "partial")"""
+        triage_result = cls._fallback_result(subject, reasoning)
+        del triage_result["fallback"]
+        triage_result.update(recovered)
+        triage_result["partial"] = True
+        return triage_result
+    
+    def _parse_response(self, response_text: str, subject: str) -> Dict:
+        """
+        Turn a completion into a triage dict.
+        
+        Well-formed JSON is used as is. Otherwise every complete field
+        before the damage is kept on top of the fallback result, so a
+        response cut off after "intent" and "urgency" still routes.
+        """
+        # Extract JSON from response (removing markdown formatting if present)
+        response_text = self._strip_markdown(response_text)
+        try:
+            triage_result = json.loads(response_text)
+            if isinstance(triage_result, dict):
+                return self._fill_required(triage_result)
+            error = f"expected a JSON object, got {type(triage_result).__name__}"
+        except json.JSONDecodeError as e:
+            error = str(e)
+        
+        recovered = self._partial_object(response_text)
+        if "intent" not in recovered:
+            log_event("claude_bad_json", level=WARNING, error=error, response=response_text[:200])
+            return self._fallback_result(subject, f"JSON parse error: {error}")
+        
+        log_event("claude_partial_json", level=WARNING, error=error, recovered=sorted(recovered))
+        return self._partial_result(subject, f"Partial JSON ({error})", recovered)
+    
+    def _triage_request(self, message: Dict) -> Dict:
+        """Keyword arguments for a single-message messages.create/stream call"""
+        sender, subject, body = self._message_fields(message)
         prompt = self.TRIAGE_PROMPT_TEMPLATE.format(
             sender=sender,
             subject=subject,
             body=body[:2000]  # Truncate very long messages
         )
+        return {
+            "model": self.MODEL,
+            "max_tokens": 1024,
+            "system": self.SYSTEM_PROMPT,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ]
+        }
+    
+    def triage_message(self, message: Dict) -> Dict:
+        """
+        Analyze a message and extract structured triage information.
         
+        Args:
+            message: Dict with keys: from, subject, body/preview
+        
+        Returns:
+            Dict with triage fields (intent, service_type, urgency, etc)
+        """
+        subject = self._message_fields(message)[1]
         try:
             # Call Claude API
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",  # Latest Sonnet model
-                max_tokens=1024,
-                system=self.SYSTEM_PROMPT,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            # Extract JSON from response
-            response_text = response.content[0].text.strip()
-            
-            # Remove markdown formatting if present
-            if response_text.startswith("```json"):
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif response_text.startswith("```"):
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            triage_result = json.loads(response_text)
-            
-            # Validate required fields
-            required_fields = ["intent", "service_type", "urgency", "summary"]
-            for field in required_fields:
-                if field not in triage_result:
-                    triage_result[field] = "unknown"
-            
-            return triage_result
-            
-        except json.JSONDecodeError as e:
-            print(f"Warning: Failed to parse Claude response as JSON: {e}")
-            print(f"Response was: {response_text[:200]}")
-            
-            # Fallback to basic extraction
-            return {
-                "intent": "other",
-                "service_type": "other",
-                "urgency": "unknown",
-                "confidence": "low",
-                "summary": subject[:100],
-                "reasoning": f"JSON parse error: {str(e)}",
-                "preferred_times": [],
-                "customer_name": None,
-                "customer_phone": None,
-                "customer_address": None
-            }
-            
+            response = self.client.messages.create(**self._triage_request(message))
+            response_text = response.content[0].text
         except Exception as e:
-            print(f"Error calling Claude API: {e}")
+            log_event("claude_api_error", level=ERROR, error=str(e))
             # Return fallback result
-            return {
-                "intent": "other",
-                "service_type": "other",
-                "urgency": "unknown",
-                "confidence": "low",
-                "summary": subject[:100],
-                "reasoning": f"API error: {str(e)}",
-                "preferred_times": [],
-                "customer_name": None,
-                "customer_phone": None,
-                "customer_address": None
-            }
+            return self._fallback_result(subject, f"API error: {str(e)}")
+        
+        return self._parse_response(response_text, subject)
+    
+    def triage_message_streaming(self, message: Dict, on_fields: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Triage from the streamed completion, parsing fields as they arrive.
+        
+        Args:
+            message: Dict with keys: from, subject, body/preview
+            on_fields: Called with the fields parsed so far each time the
+                stream completes another one
+        
+        Returns:
+            The same dict triage_message() would return. If the stream
+            breaks off, the fields already received are kept.
+        """
+        subject = self._message_fields(message)[1]
+        parser = IncrementalJSONObject()
+        try:
+            with self.client.messages.stream(**self._triage_request(message)) as stream:
+                for text in stream.text_stream:
+                    if parser.feed(text) and on_fields is not None:
+                        on_fields(dict(parser.fields))
+        except Exception as e:
+            return self._streamed_result(parser, subject, e)
+        return self._streamed_result(parser, subject)
+    
+    def _streamed_result(self, parser: "IncrementalJSONObject", subject: str, error: Optional[Exception] = None) -> Dict:
+        """Triage dict from a finished stream, keeping received fields if it broke off with `error`"""
+        if error is not None:
+            log_event("claude_api_error", level=ERROR, error=str(error), received=sorted(parser.fields))
+            if "intent" not in parser.fields:
+                return self._fallback_result(subject, f"API error: {str(error)}")
+            return self._partial_result(subject, f"Stream interrupted: {str(error)}", parser.fields)
+        
+        if parser.complete:
+            return self._fill_required(dict(parser.fields))
+        return self._parse_response(parser.text, subject)
+    
+    def triage_message_early(
+        self,
+        message: Dict,
+        early_fields: Sequence[str] = EARLY_FIELDS,
+        timeout: Optional[float] = None
+    ) -> Tuple[Dict, "Future[Dict]"]:
+        """
+        Stream a triage and return as soon as `early_fields` are known.
+        
+        The rest of the completion is read in the background (here on a
+        pool of STREAM_WORKERS threads); close() waits for it.
+        
+        Args:
+            timeout: Seconds to wait for the early fields (EARLY_TIMEOUT if None)
+        
+        Returns:
+            (early, future): the fields parsed so far (at least early_fields,
+            unless the stream ended first - then the final result), and a
+            future for the full triage_message_streaming() result. early is
+            empty if nothing arrived within the timeout.
+        """
+        ready = threading.Event()
+        early: Dict = {}
+        
+        def on_fields(fields: Dict):
+            if not ready.is_set() and all(field in fields for field in early_fields):
+                early.update(fields)
+                ready.set()
+        
+        future = self._start_stream(message, on_fields)
+        future.add_done_callback(lambda _: ready.set())
+        if not ready.wait(self.EARLY_TIMEOUT if timeout is None else timeout):
+            log_event("claude_early_timeout", level=WARNING, subject=self._message_fields(message)[1])
+            return {}, future
+        if not early:
+            return future.result(), future
+        return early, future
+    
+    def _start_stream(self, message: Dict, on_fields: Callable[[Dict], None]) -> "Future[Dict]":
+        """Run triage_message_streaming in the background"""
+        return self._stream_pool().submit(self.triage_message_streaming, message, on_fields)
+    
+    def _stream_pool(self) -> ThreadPoolExecutor:
+        with self._stream_lock:
+            if self._stream_executor is None:
+                self._stream_executor = ThreadPoolExecutor(
+                    max_workers=self.STREAM_WORKERS, thread_name_prefix="claude-stream"
+                )
+            return self._stream_executor
+    
+    def close(self):
+        """Wait for streams still being read in the background, then stop the pool"""
+        with self._stream_lock:
+            executor, self._stream_executor = self._stream_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+    
+    def triage_batch(self, messages: List[Dict], max_batch_size: int = 10) -> List[Dict]:
+        """
+        Triage many messages with as few API calls as possible.
+        
+        Messages are packed max_batch_size at a time into one request, with
+        the shared instructions sent once per request instead of once per
+        message. If a response can't be fully parsed, results that did
+        parse are kept and the missing messages are retried in two halves;
+        a single message falls back to triage_message().
+        
+        Args:
+            messages: List of message dicts (from, subject, text/preview)
+            max_batch_size: Maximum messages per API request
+        
+        Returns:
+            One triage dict per message, in input order
+        """
+        results: List[Optional[Dict]] = [None] * len(messages)
+        for start in range(0, len(messages), max_batch_size):
+            indices = list(range(start, min(start + max_batch_size, len(messages))))
+            self._triage_chunk(messages, indices, results)
+        return results
+    
+    def _triage_chunk(self, messages: List[Dict], indices: List[int], results: List[Optional[Dict]]):
+        """Triage messages[i] for i in indices with one request, splitting on failure"""
+        if len(indices) == 1:
+            results[indices[0]] = self.triage_message(messages[indices[0]])
+            return
+        
+        try:
+            parsed = self._request_batch([messages[i] for i in indices])
+        except Exception as e:
+            # The API itself failed - splitting would only multiply failing calls
+            log_event("claude_api_error", level=ERROR, error=str(e))
+            for index in indices:
+                subject = self._message_fields(messages[index])[1]
+                results[index] = self._fallback_result(subject, f"API error: {str(e)}")
+            return
+        
+        missing = []
+        for position, index in enumerate(indices):
+            triage_result = parsed.get(str(position + 1))
+            if triage_result is None:
+                missing.append(index)
+            else:
+                results[index] = self._fill_required(triage_result)
+        
+        if not missing:
+            return
+        
+        log_event("claude_batch_incomplete", level=WARNING, missing=len(missing), batch=len(indices))
+        if len(missing) < len(indices):
+            self._triage_chunk(messages, missing, results)
+        else:
+            middle = len(missing) // 2
+            self._triage_chunk(messages, missing[:middle], results)
+            self._triage_chunk(messages, missing[middle:], results)
+    
+    def _request_batch(self, batch: List[Dict]) -> Dict[str, Dict]:
+        """
+        Send one batched request.
+        
+        Returns:
+            Dict of message id ("1".."N") -> parsed result. Ids that could not
+            be recovered (bad JSON, missing entries) are absent.
+        
+        Raises:
+            Exception: whatever the client raises if the API call fails
+        """
+        blocks = []
+        for position, message in enumerate(batch, 1):
+            sender, subject, body = self._message_fields(message)
+            blocks.append(self.BATCH_MESSAGE_TEMPLATE.format(
+                id=position,
+                sender=sender,
+                subject=subject,
+                body=body[:2000]  # Truncate very long messages
+            ))
+        prompt = self.BATCH_PROMPT_TEMPLATE.format(messages="\n\n".join(blocks))
+        
+        response = self.client.messages.create(
+            model=self.MODEL,
+            max_tokens=self.BATCH_TOKENS_PER_MESSAGE * len(batch),
+            system=self.SYSTEM_PROMPT,
+            messages=[
+                {"role": "user", "content": prompt}
+            ]
+        )
+        
+        response_text = self._strip_markdown(response.content[0].text)
+        try:
+            items = json.loads(response_text)
+        except json.JSONDecodeError as e:
+            log_event("claude_bad_json", level=WARNING, error=str(e), batch=len(batch))
+            items = self._complete_array_items(response_text)
+        
+        if not isinstance(items, list):
+            return {}
+        
+        parsed = {}
+        for item in items:
+            if isinstance(item, dict) and "id" in item:
+                parsed[str(item.pop("id"))] = item
+        return parsed
+
+
+class IncrementalJSONObject:
+    """
+    Parses the top-level fields of one JSON object as its text streams in.
+    
+    feed() takes the next piece of text and returns the fields it
+    completed. Anything before the opening brace (prose, ```json fences)
+    is skipped, stray commas are tolerated, and a field is only reported
+    once its value is complete - so a truncated or corrupt object still
+    yields every field before the damage.
+    """
+    
+    _WHITESPACE = " \t\r\n"
+    
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict = {}
+        self.complete = False  # closing brace seen
+        self.error: Optional[str] = None  # unparseable text; nothing after it is read
+        self._position: Optional[int] = None  # start of the next field, once "{" is seen
+        self._decoder = json.JSONDecoder()
+    
+    def feed(self, text: str) -> Dict:
+        """Append text; returns the fields completed by it"""
+        self.text += text
+        completed = {}
+        if self.complete or self.error is not None:
+            return completed
+        if self._position is None:
+            start = self.text.find("{")
+            if start < 0:
+                return completed
+            self._position = start + 1
+        
+        while True:
+            field = self._next_field()
+            if field is None:
+                return completed
+            key, value = field
+            self.fields[key] = value
+            completed[key] = value
+    
+    def _skip(self, position: int, characters: str) -> int:
+        while position < len(self.text) and self.text[position] in characters:
+            position += 1
+        return position
+    
+    def _next_field(self) -> Optional[Tuple[str, object]]:
+        """Parse the field at _position, or None if it isn't complete yet"""
+        text = self.text
+        position = self._skip(self._position, self._WHITESPACE + ",")
+        if position == len(text):
+            return None
+        if text[position] == "}":
+            self.complete = True
+            return None
+        if text[position] != '"':
+            self.error = f"unexpected {text[position]!r} at {position}"
+            return None
+        
+        try:
+            key, position = self._decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            return None
+        position = self._skip(position, self._WHITESPACE)
+        if position == len(text):
+            return None
+        if text[position] != ":":
+            self.error = f"expected ':' at {position}"
+            return None
+        position = self._skip(position + 1, self._WHITESPACE)
+        
+        try:
+            value, end = self._decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            return None  # value still streaming (or malformed)
+        if end == len(text) and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return None  # more digits may follow
+        self._position = end
+        return key, value
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`.
+    
+    acquire() takes its tokens at once, going into debt if there aren't
+    enough, and then waits until the debt would be repaid - so callers are
+    served in arrival order. charge() applies a correction after the fact
+    (e.g. actual vs estimated token usage) and may also push the balance
+    negative, which delays later callers. The balance is guarded by a
+    threading lock, so one bucket can be shared by threads and event loops.
+    """
+    
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self):
+        """Add the tokens earned since the last update (caller holds _lock)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    async def acquire(self, amount: float = 1):
+        """Consume `amount` tokens (capped at capacity), waiting until they are covered"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            await asyncio.sleep(wait)
+    
+    def charge(self, amount: float):
+        """Consume (or refund, if negative) tokens without waiting"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AsyncClaudeTriage(ClaudeTriage):
+    """
+    Concurrent Claude triage using the async Anthropic client.
+    
+    Calls are limited three ways: requests per minute and tokens per minute
+    (token buckets), plus a cap on requests in flight. Each message gets the
+    same fallback dict as ClaudeTriage.triage_message on errors.
+    
+    Every request runs on one event loop owned by the instance, in a
+    background thread, so the client's connection pool and the limits are
+    shared by all callers: the synchronous ClaudeTriage entry points (from
+    any number of threads) and coroutines running on other loops submit
+    their work to it. close() stops the loop; the instance can't be used
+    after that.
+    """
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        client=None,
+        base_url: Optional[str] = None,
+        requests_per_minute: int = 50,
+        tokens_per_minute: int = 40000,
+        max_in_flight: int = 5
+    ):
+        """
+        Args:
+            api_key: Anthropic API key. If None, reads from ANTHROPIC_API_KEY env var.
+            client: Pre-built async client exposing `await messages.create(...)`
+                and `messages.stream(...)`. It must not be shared with another
+                instance or event loop.
+            base_url: API root override (e.g. a local fake server)
+            requests_per_minute: Request rate limit
+            tokens_per_minute: Input + output token rate limit
+            max_in_flight: Maximum concurrent API calls
+        """
+        self._owns_client = client is None
+        if client is None:
+            api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+            if not api_key:
+                raise ValueError("ANTHROPIC_API_KEY must be set in environment or passed to constructor")
+            client = anthropic.AsyncAnthropic(api_key=api_key, base_url=base_url)
+        super().__init__(api_key=api_key, client=client)
+        
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        
+        # Shared by every call for the life of the instance
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+        self._pending: set = set()
+    
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """The instance's event loop, started in a daemon thread on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="claude-async", daemon=True)
+                self._loop_thread.start()
+            return self._loop
+    
+    def _submit(self, coroutine) -> "Future":
+        """Schedule a coroutine on the instance's loop; close() waits for it"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._event_loop())
+        with self._loop_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._forget)
+        return future
+    
+    def _forget(self, future: "Future"):
+        with self._loop_lock:
+            self._pending.discard(future)
+    
+    def _on_own_loop(self) -> bool:
+        return asyncio.get_running_loop() is self._loop
+    
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """Rough token count (~4 characters per token)"""
+        return len(text) // 4 + 1
+    
+    @contextlib.asynccontextmanager
+    async def _rate_limited(self, request: Dict):
+        """
+        Hold an in-flight slot and the request/token budget for one API call.
+        
+        Yields:
+            The estimated token cost, to correct later with _charge_usage()
+        """
+        estimated = self._estimate_tokens(self.SYSTEM_PROMPT + request["messages"][0]["content"]) + request["max_tokens"]
+        async with self._in_flight:
+            await self._request_bucket.acquire(1)
+            await self._token_bucket.acquire(estimated)
+            yield estimated
+    
+    def _charge_usage(self, response, estimated: int):
+        """Replace the estimate with actual usage when the API reports it"""
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self._token_bucket.charge(usage.input_tokens + usage.output_tokens - estimated)
+    
+    async def atriage_message(self, message: Dict) -> Dict:
+        """
+        Async version of triage_message, honouring the rate limits.
+        
+        Args:
+            message: Dict with keys: from, subject, body/preview
+        
+        Returns:
+            Dict with triage fields (intent, service_type, urgency, etc)
+        """
+        if not self._on_own_loop():
+            return await asyncio.wrap_future(self._submit(self.atriage_message(message)))
+        
+        subject = self._message_fields(message)[1]
+        request = self._triage_request(message)
+        async with self._rate_limited(request) as estimated:
+            try:
+                response = await self.client.messages.create(**request)
+            except Exception as e:
+                log_event("claude_api_error", level=ERROR, error=str(e))
+                return self._fallback_result(subject, f"API error: {str(e)}")
+        
+        self._charge_usage(response, estimated)
+        return self._parse_response(response.content[0].text, subject)
+    
+    async def atriage_message_streaming(self, message: Dict, on_fields: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Async version of triage_message_streaming, honouring the rate limits"""
+        if not self._on_own_loop():
+            return await asyncio.wrap_future(self._submit(self.atriage_message_streaming(message, on_fields)))
+        
+        subject = self._message_fields(message)[1]
+        request = self._triage_request(message)
+        parser = IncrementalJSONObject()
+        async with self._rate_limited(request) as estimated:
+            try:
+                async with self.client.messages.stream(**request) as stream:
+                    async for text in stream.text_stream:
+                        if parser.feed(text) and on_fields is not None:
+                            on_fields(dict(parser.fields))
+                    response = await stream.get_final_message()
+            except Exception as e:
+                return self._streamed_result(parser, subject, e)
+        
+        self._charge_usage(response, estimated)
+        return self._streamed_result(parser, subject)
+    
+    async def atriage_many(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Triage messages concurrently within the rate limits.
+        
+        Returns:
+            One triage dict per message, in input order
+        """
+        if not self._on_own_loop():
+            return await asyncio.wrap_future(self._submit(self.atriage_many(messages)))
+        return await asyncio.gather(*(self.atriage_message(message) for message in messages))
+    
+    def triage_many(self, messages: List[Dict]) -> List[Dict]:
+        """Synchronous wrapper around atriage_many for non-async callers"""
+        return self._submit(self.atriage_many(messages)).result()
+    
+    def triage_message(self, message: Dict) -> Dict:
+        """Synchronous wrapper around atriage_message"""
+        return self._submit(self.atriage_message(message)).result()
+    
+    def triage_batch(self, messages: List[Dict], max_batch_size: int = 10) -> List[Dict]:
+        """Same results as ClaudeTriage.triage_batch, via concurrent single-message requests"""
+        return self.triage_many(messages)
+    
+    def triage_message_streaming(self, message: Dict, on_fields: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Synchronous wrapper around atriage_message_streaming"""
+        return self._submit(self.atriage_message_streaming(message, on_fields)).result()
+    
+    def _start_stream(self, message: Dict, on_fields: Callable[[Dict], None]) -> "Future[Dict]":
+        """Run atriage_message_streaming on the instance's loop (no stream threads needed)"""
+        return self._submit(self.atriage_message_streaming(message, on_fields))
+    
+    def close(self):
+        """Wait for calls still running (e.g. streams behind early routes), then stop the event loop"""
+        with self._loop_lock:
+            pending = list(self._pending)
+        wait(pending)
+        
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        if loop is None:
+            return
+        if self._owns_client:
+            asyncio.run_coroutine_threadsafe(self.client.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
 
 
 def test_triage():
@@ -194,6 +844,350 @@ def test_triage():
         print()
 
 
+class _StubMessages:
+    """Stand-in for client.messages that answers from a canned triage table"""
+    
+    def __init__(self, broken_batch_sizes=()):
+        self.calls = []
+        self.broken_batch_sizes = set(broken_batch_sizes)
+    
+    def create(self, model, max_tokens, system, messages):
+        prompt = messages[0]["content"]
+        self.calls.append(prompt)
+        
+        # Only look at the message text, not the instructions that follow it
+        prompt = prompt.split("Extract and return ONLY")[0].split("Return ONLY a JSON array")[0]
+        
+        def classify(text):
+            lowered = text.lower()
+            intent = "booking" if "schedule" in lowered or "come out" in lowered else "question"
+            return {"intent": intent, "service_type": "hvac_repair", "urgency": "today",
+                    "confidence": "high", "summary": text.strip().splitlines()[0][:60]}
+        
+        if "=== MESSAGE" not in prompt:
+            text = json.dumps(classify(prompt.split("SUBJECT:")[1]))
+        else:
+            blocks = [b for b in prompt.split("=== MESSAGE ")[1:] if "SUBJECT:" in b]
+            items = []
+            for block in blocks:
+                message_id = block.split(" ===")[0]
+                items.append(dict(classify(block.split("SUBJECT:")[1]), id=message_id))
+            text = "```json\n" + json.dumps(items) + "\n```"
+            if len(blocks) in self.broken_batch_sizes:
+                text = text[:len(text) * 3 // 5]  # simulate a truncated completion
+        
+        return SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+
+def test_triage_batch():
+    """Test batched triage against a stubbed local client (no API key needed)"""
+    
+    print("Testing batched Claude triage (stub client)")
+    print("=" * 60)
+    
+    messages = [
+        {"from": f"customer{i}@email.com", "subject": f"Request {i}",
+         "text": "Can you come out to schedule a repair?" if i % 2 else "How much is a tune-up?"}
+        for i in range(7)
+    ]
+    
+    stub = SimpleNamespace(messages=_StubMessages())
+    triage = ClaudeTriage(client=stub)
+    results = triage.triage_batch(messages, max_batch_size=4)
+    assert len(stub.messages.calls) == 2, len(stub.messages.calls)
+    assert [r["intent"] for r in results] == ["question", "booking"] * 3 + ["question"]
+    assert all("id" not in r for r in results)
+    print(f"✅ 7 messages triaged in {len(stub.messages.calls)} requests")
+    
+    # A truncated 4-message response keeps its complete items; the rest are retried
+    stub = SimpleNamespace(messages=_StubMessages(broken_batch_sizes={4}))
+    triage = ClaudeTriage(client=stub)
+    split_results = triage.triage_batch(messages, max_batch_size=4)
+    assert [r["intent"] for r in split_results] == [r["intent"] for r in results]
+    print(f"✅ Truncated batch recovered with {len(stub.messages.calls)} requests")
+    print()
+
+
+class _StubStreamingMessages:
+    """Stand-in for client.messages whose stream() yields a canned completion in chunks"""
+    
+    def __init__(self, text: str, chunk_size: int = 8, delay: float = 0.0, fail_after: Optional[int] = None):
+        self.text = text
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.fail_after = fail_after
+    
+    def create(self, **kwargs):
+        return SimpleNamespace(content=[SimpleNamespace(text=self.text)])
+    
+    def _chunks(self):
+        for start in range(0, len(self.text), self.chunk_size):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise ConnectionError("stream reset")
+            time.sleep(self.delay)
+            yield self.text[start:start + self.chunk_size]
+    
+    def stream(self, **kwargs):
+        stub = self
+        
+        class _Stream:
+            text_stream = stub._chunks()
+            
+            def __enter__(self):
+                return self
+            
+            def __exit__(self, *exc):
+                return False
+        
+        return _Stream()
+
+
+class _StubAsyncStreamingMessages(_StubStreamingMessages):
+    """The same stream for the async client: `async with messages.stream(...)`"""
+    
+    def stream(self, **kwargs):
+        stub = self
+        
+        class _Stream:
+            async def __aenter__(self):
+                self.text_stream = self._chunks()
+                return self
+            
+            async def __aexit__(self, *exc):
+                return False
+            
+            async def _chunks(self):
+                for start in range(0, len(stub.text), stub.chunk_size):
+                    await asyncio.sleep(stub.delay)
+                    yield stub.text[start:start + stub.chunk_size]
+            
+            async def get_final_message(self):
+                return SimpleNamespace(usage=SimpleNamespace(input_tokens=300, output_tokens=50))
+        
+        return _Stream()
+
+
+def test_streaming_triage():
+    """Test incremental parsing, partial recovery and early emergency routing (stub client)"""
+    from poc_monitor import MessageTriage
+    
+    print("Testing streaming Claude triage (stub client)")
+    print("=" * 60)
+    
+    full = {"intent": "urgent", "urgency": "emergency", "service_type": "plumbing_repair",
+            "preferred_times": ["now"], "customer_name": None, "customer_phone": None,
+            "customer_address": "12 Elm St", "confidence": "high",
+            "summary": "Burst pipe flooding the basement.", "reasoning": "Active flooding " * 20}
+    text = "```json\n" + json.dumps(full, indent=2) + "\n```"
+    
+    parser = IncrementalJSONObject()
+    seen = []
+    for char in text:
+        seen.extend(parser.feed(char))
+    assert parser.complete and parser.fields == full and seen == list(full), seen
+    parser = IncrementalJSONObject()
+    assert parser.feed('{"count": 12') == {} and parser.feed("3,") == {"count": 123}
+    print(f"✅ Incremental parser: {len(full)} fields from {len(text)} one-character chunks")
+    
+    message = {"from": "jo@example.com", "subject": "Pipe burst!", "text": "Water everywhere"}
+    cut = text.index('"service_type"') + 20
+    triage = ClaudeTriage(client=SimpleNamespace(messages=_StubStreamingMessages(text[:cut])))
+    result = triage.triage_message(message)
+    assert (result["intent"], result["urgency"], result["confidence"]) == ("urgent", "emergency", "low"), result
+    assert result["summary"] == "Pipe burst!" and result["reasoning"].startswith("Partial JSON") and result["partial"]
+    triage = ClaudeTriage(client=SimpleNamespace(messages=_StubStreamingMessages("Sorry, I can't help")))
+    assert triage.triage_message(message)["fallback"]
+    print("✅ Truncated response kept intent/urgency; non-JSON still falls back")
+    
+    stub = _StubStreamingMessages(text, chunk_size=16, delay=0.01)
+    triage = ClaudeTriage(client=SimpleNamespace(messages=stub))
+    start = time.perf_counter()
+    early, future = triage.triage_message_early(message)
+    early_at = time.perf_counter() - start
+    result = future.result(5)
+    done_at = time.perf_counter() - start
+    assert early["urgency"] == "emergency" and "summary" not in early, early
+    assert result == full, result
+    assert early_at < done_at / 4, (early_at, done_at)
+    print(f"✅ Emergency known after {early_at * 1000:.0f} ms, full answer after {done_at * 1000:.0f} ms")
+    
+    futures = [triage.triage_message_early(message)[1] for _ in range(3 * triage.STREAM_WORKERS)]
+    streams = [thread for thread in threading.enumerate() if thread.name.startswith("claude-stream")]
+    assert len(streams) <= triage.STREAM_WORKERS, len(streams)
+    triage.close()
+    assert all(future.done() for future in futures)
+    early, future = ClaudeTriage(client=SimpleNamespace(messages=_StubStreamingMessages(text, chunk_size=64, delay=0.05))).triage_message_early(message, timeout=0.01)
+    assert early == {} and not future.done()
+    print(f"✅ {len(futures)} streams shared {len(streams)} threads; close() waited for them; slow stream timed out")
+    
+    stub = _StubAsyncStreamingMessages(text, chunk_size=16, delay=0.01)
+    triage = AsyncClaudeTriage(client=SimpleNamespace(messages=stub))
+    early, future = triage.triage_message_early(message)
+    assert early["urgency"] == "emergency" and not future.done(), early
+    triage.close()
+    assert future.result() == full
+    print("✅ AsyncClaudeTriage streams on its event loop, early fields first")
+    
+    stub = _StubStreamingMessages(text, fail_after=cut)
+    result = ClaudeTriage(client=SimpleNamespace(messages=stub)).triage_message_streaming(message)
+    assert result["urgency"] == "emergency" and result["reasoning"].startswith("Stream interrupted")
+    print("✅ Interrupted stream kept the fields already received")
+    
+    # Tiered triage routes the emergency on the early fields, then caches the full answer
+    class _Cache:
+        def __init__(self):
+            self.stored = threading.Event()
+        
+        def get(self, message, version):
+            return None
+        
+        def put(self, message, version, result):
+            self.result = result
+            self.stored.set()
+    
+    stub = _StubStreamingMessages(text, chunk_size=16, delay=0.01)
+    cache = _Cache()
+    engine = MessageTriage(
+        cache=cache, mode="tiered", min_confidence="high", stream_early=True,
+        llm_engine=ClaudeTriage(client=SimpleNamespace(messages=stub))
+    )
+    routed = engine.triage_message({"from": "jo@example.com", "subject": "hmm", "text": "something odd"})
+    assert routed["urgency"] == "emergency" and routed["partial"] and not cache.stored.is_set()
+    engine.close()  # as on exit: the full answer must reach the cache first
+    assert cache.stored.is_set() and cache.result == full
+    print("✅ Tiered triage returned the emergency early and cached the full answer")
+    
+    cache = _Cache()
+    slow = ClaudeTriage(client=SimpleNamespace(messages=_StubStreamingMessages(text, chunk_size=64, delay=0.05)))
+    slow.EARLY_TIMEOUT = 0.01
+    engine = MessageTriage(cache=cache, mode="tiered", min_confidence="high", stream_early=True, llm_engine=slow)
+    routed = engine.triage_message({"from": "jo@example.com", "subject": "hmm", "text": "something odd"})
+    assert "partial" not in routed and routed["urgency"] != "emergency", routed
+    engine.close()
+    assert cache.result == full
+    print("✅ Timed-out stream fell back to the rule result; the late answer was still cached")
+    print()
+
+
+class _FakeMessagesAPI(BaseHTTPRequestHandler):
+    """Local stand-in for POST /v1/messages that tracks concurrency (keep-alive, like the real API)"""
+    
+    protocol_version = "HTTP/1.1"
+    
+    in_flight = 0
+    peak_in_flight = 0
+    lock = threading.Lock()
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = request["messages"][0]["content"]
+        
+        with self.lock:
+            _FakeMessagesAPI.in_flight += 1
+            _FakeMessagesAPI.peak_in_flight = max(_FakeMessagesAPI.peak_in_flight, _FakeMessagesAPI.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            _FakeMessagesAPI.in_flight -= 1
+        
+        if "SERVER ERROR" in prompt:
+            status, payload = 500, {"type": "error", "error": {"type": "api_error", "message": "boom"}}
+        else:
+            subject = prompt.split("SUBJECT: ")[1].split("\n")[0]
+            text = json.dumps({"intent": "booking", "service_type": "hvac_repair",
+                               "urgency": "today", "confidence": "high", "summary": subject})
+            status, payload = 200, {
+                "id": "msg_fake", "type": "message", "role": "assistant", "model": request["model"],
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn", "stop_sequence": None,
+                "usage": {"input_tokens": 300, "output_tokens": 50}
+            }
+        
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_async_triage():
+    """Test async triage against a fake local Messages API"""
+    
+    print("Testing async Claude triage (fake local server)")
+    print("=" * 60)
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeMessagesAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    
+    messages = [{"from": f"c{i}@email.com", "subject": f"Request {i}", "text": "AC broken"} for i in range(12)]
+    messages[5]["text"] = "SERVER ERROR"
+    
+    client = anthropic.AsyncAnthropic(api_key="test-key", base_url=base_url, max_retries=0)
+    triage = AsyncClaudeTriage(client=client, requests_per_minute=6000, max_in_flight=3)
+    
+    start = time.perf_counter()
+    results = triage.triage_many(messages)
+    elapsed = time.perf_counter() - start
+    
+    assert [r["summary"] for i, r in enumerate(results) if i != 5] == [f"Request {i}" for i in range(12) if i != 5]
+    assert results[5]["intent"] == "other" and results[5]["reasoning"].startswith("API error")
+    assert _FakeMessagesAPI.peak_in_flight <= 3, _FakeMessagesAPI.peak_in_flight
+    print(f"✅ 12 messages in {elapsed:.2f}s, peak in flight {_FakeMessagesAPI.peak_in_flight}, 1 per-message fallback")
+    
+    # Later calls reuse the kept-alive connections on the same loop (no retries to hide a dead pool)
+    result = triage.triage_message(messages[0])
+    assert result["summary"] == "Request 0" and result["intent"] == "booking", result
+    results = triage.triage_batch(messages[:3])
+    assert [r["intent"] for r in results] == ["booking"] * 3, results
+    print("✅ triage_message/triage_batch run the async client, reusing its connections")
+    
+    # Callers on several threads (and another event loop) share one in-flight limit
+    _FakeMessagesAPI.peak_in_flight = 0
+    ok = [message for i, message in enumerate(messages) if i != 5]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        batches = list(pool.map(triage.triage_many, [ok] * 4))
+    batches.append(asyncio.run(triage.atriage_many(ok)))
+    assert all(r["intent"] == "booking" for batch in batches for r in batch)
+    assert _FakeMessagesAPI.peak_in_flight <= 3, _FakeMessagesAPI.peak_in_flight
+    print(f"✅ 4 threads + 1 foreign loop: peak in flight {_FakeMessagesAPI.peak_in_flight}")
+    triage.close()
+    
+    # Requests per minute limit: 60/min with a burst of 2 -> 3rd request waits ~1s
+    bucket_start = time.perf_counter()
+    
+    async def three_requests():
+        bucket = TokenBucket(60, capacity=2)
+        for _ in range(3):
+            await bucket.acquire(1)
+    
+    asyncio.run(three_requests())
+    waited = time.perf_counter() - bucket_start
+    assert 0.9 <= waited < 1.5, waited
+    print(f"✅ Rate limiter delayed over-budget request by {waited:.2f}s")
+    
+    # The budget carries over between calls: two polls of 2 at 120/min with a burst of 2
+    client = anthropic.AsyncAnthropic(api_key="test-key", base_url=base_url, max_retries=0)
+    triage = AsyncClaudeTriage(client=client, requests_per_minute=120)
+    triage._request_bucket = TokenBucket(120, capacity=2)
+    start = time.perf_counter()
+    triage.triage_many(messages[:2])
+    triage.triage_many(messages[:2])
+    waited = time.perf_counter() - start
+    assert waited >= 0.9, waited
+    print(f"✅ Second poll waited for the shared request budget ({waited:.2f}s)")
+    triage.close()
+    print()
+    
+    server.shutdown()
+
+
 if __name__ == "__main__":
     # Run tests if executed directly
+    test_triage_batch()
+    test_streaming_triage()
+    test_async_triage()
     test_triage()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Conversation store - threads messages per customer (SQLite).
+
+Follows the conversations / messages / appointments schema planned in
+ARCHITECTURE.md, plus a slot_offers table recording which times were
+offered in a booking reply, so that a later "Option 2" can be matched to
+them. Lookups by customer email and thread id are indexed (one B-tree
+probe each), and message writes are buffered and inserted in batches so
+a burst of incoming mail costs one transaction per batch instead of one
+per message. Reads flush the buffer first, so callers always see their
+own writes.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from email.utils import parseaddr
+from typing import Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    business_id TEXT,
+    customer_email TEXT NOT NULL,
+    customer_name TEXT,
+    thread_id TEXT,
+    status TEXT NOT NULL DEFAULT 'active',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_customer ON conversations(customer_email, updated_at);
+CREATE INDEX IF NOT EXISTS idx_conversations_thread ON conversations(thread_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER NOT NULL REFERENCES conversations(id),
+    message_id TEXT UNIQUE,
+    direction TEXT NOT NULL,
+    channel TEXT NOT NULL DEFAULT 'email',
+    subject TEXT,
+    content TEXT,
+    intent TEXT,
+    urgency TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, created_at);
+
+CREATE TABLE IF NOT EXISTS slot_offers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER NOT NULL REFERENCES conversations(id),
+    message_id TEXT,
+    service_type TEXT,
+    slots TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_slot_offers_conversation ON slot_offers(conversation_id, status);
+
+CREATE TABLE IF NOT EXISTS appointments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER REFERENCES conversations(id),
+    service_type TEXT,
+    scheduled_at TEXT NOT NULL,
+    duration_minutes INTEGER,
+    status TEXT NOT NULL DEFAULT 'confirmed',
+    calendar_event_id TEXT,
+    offer_id INTEGER REFERENCES slot_offers(id),
+    confirmed_at REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_appointments_conversation ON appointments(conversation_id);
+"""
+
+
+def customer_address(message: Dict) -> str:
+    """Lower-cased sender address ("Jo <JO@x.com>" -> "jo@x.com")"""
+    name, address = parseaddr(message.get("from", ""))
+    return (address or message.get("from", "unknown")).strip().lower()
+
+
+class ConversationStore:
+    """
+    SQLite conversation history with batched message writes.
+    
+    Safe to share between threads.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        business_id: Optional[str] = None,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        offer_ttl: float = 48 * 3600
+    ):
+        """
+        Open (or create) the store.
+        
+        Args:
+            path: SQLite file path (":memory:" for a throwaway store)
+            business_id: Tenant the conversations belong to
+            batch_size: Buffered message writes that trigger a flush
+            flush_interval: Oldest buffered write age (seconds) that triggers a flush
+            offer_ttl: Seconds a slot offer stays open before it expires
+        """
+        self.path = path
+        self.business_id = business_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.offer_ttl = offer_ttl
+        
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(appointments)")}
+        if "offer_id" not in columns:
+            # Stores created before confirmations were tracked per offer
+            self._conn.execute("ALTER TABLE appointments ADD COLUMN offer_id INTEGER REFERENCES slot_offers(id)")
+            self._conn.execute("ALTER TABLE appointments ADD COLUMN confirmed_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_offer ON appointments(offer_id)")
+        self._conn.commit()
+        
+        self._pending_messages: List[tuple] = []
+        self._pending_since: Optional[float] = None
+        self._touched: Dict[int, float] = {}
+    
+    def _find_conversation(self, thread_id: Optional[str], email: str) -> Optional[int]:
+        # Tenants may share one database: only ever match this business's conversations
+        if thread_id:
+            row = self._conn.execute(
+                "SELECT id FROM conversations WHERE thread_id = ? AND business_id IS ? ORDER BY id DESC LIMIT 1",
+                (thread_id, self.business_id)
+            ).fetchone()
+            if row:
+                return row[0]
+        row = self._conn.execute(
+            "SELECT id FROM conversations WHERE customer_email = ? AND business_id IS ? AND status = 'active' "
+            "ORDER BY updated_at DESC LIMIT 1",
+            (email, self.business_id)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def conversation_for(self, message: Dict) -> int:
+        """
+        Find the conversation a message belongs to, creating it if needed.
+        
+        Matches on the message's thread_id first, then on the customer's most
+        recently active conversation, within this store's business_id.
+        """
+        email = customer_address(message)
+        thread_id = message.get("thread_id")
+        
+        with self._lock:
+            conversation_id = self._find_conversation(thread_id, email)
+            if conversation_id is None:
+                now = time.time()
+                cursor = self._conn.execute(
+                    "INSERT INTO conversations (business_id, customer_email, customer_name, thread_id, "
+                    "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.business_id, email, parseaddr(message.get("from", ""))[0] or None,
+                     thread_id, now, now)
+                )
+                self._conn.commit()
+                conversation_id = cursor.lastrowid
+            return conversation_id
+    
+    def record_message(
+        self,
+        message: Dict,
+        direction: str = "inbound",
+        triage: Optional[Dict] = None,
+        content: Optional[str] = None
+    ) -> int:
+        """
+        Buffer a message for writing.
+        
+        Args:
+            message: The inbound message (outbound replies are filed under
+                the conversation of the message they answer)
+            direction: "inbound" or "outbound"
+            triage: Triage result (inbound only)
+            content: Body to store (defaults to the message text)
+        
+        Returns:
+            Conversation id
+        """
+        conversation_id = self.conversation_for(message)
+        triage = triage or {}
+        now = time.time()
+        message_id = message.get("message_id") if direction == "inbound" else None
+        
+        with self._lock:
+            self._pending_messages.append((
+                conversation_id, message_id, direction,
+                message.get("subject"),
+                content if content is not None else (message.get("text") or message.get("preview", "")),
+                triage.get("intent"), triage.get("urgency"), now
+            ))
+            self._touched[conversation_id] = now
+            if self._pending_since is None:
+                self._pending_since = now
+            if (len(self._pending_messages) >= self.batch_size
+                    or now - self._pending_since >= self.flush_interval):
+                self.flush()
+        return conversation_id
+    
+    def flush(self):
+        """Write buffered messages in one transaction"""
+        with self._lock:
+            if not self._pending_messages:
+                return
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO messages (conversation_id, message_id, direction, subject, content, "
+                "intent, urgency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending_messages
+            )
+            self._conn.executemany(
+                "UPDATE conversations SET updated_at = ? WHERE id = ?",
+                [(updated_at, conversation_id) for conversation_id, updated_at in self._touched.items()]
+            )
+            self._conn.commit()
+            self._pending_messages = []
+            self._pending_since = None
+            self._touched = {}
+    
+    def history(self, message: Dict, limit: int = 10) -> List[Dict]:
+        """Most recent messages in this message's conversation, oldest first"""
+        conversation_id = self.conversation_for(message)
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute(
+                "SELECT message_id, direction, subject, content, intent, urgency, created_at "
+                "FROM messages WHERE conversation_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                (conversation_id, limit)
+            ).fetchall()
+        keys = ("message_id", "direction", "subject", "content", "intent", "urgency", "created_at")
+        return [dict(zip(keys, row)) for row in reversed(rows)]
+    
+    def record_slot_offer(self, message: Dict, slots: List[Dict], service_type: Optional[str] = None) -> int:
+        """
+        Remember the slots offered in reply to a message.
+        
+        Args:
+            message: The inbound message the offer answers
+            slots: Slot dicts (start, end, duration_minutes) in offered order
+            service_type: Service the customer asked for
+        
+        Older pending offers in the same conversation are superseded.
+        
+        Returns:
+            Offer id
+        """
+        conversation_id = self.conversation_for(message)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE slot_offers SET status = 'superseded' WHERE conversation_id = ? AND status = 'pending'",
+                (conversation_id,)
+            )
+            cursor = self._conn.execute(
+                "INSERT INTO slot_offers (conversation_id, message_id, service_type, slots, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, message.get("message_id"), service_type,
+                 json.dumps(slots, default=datetime.isoformat), time.time())
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+    
+    def pending_offer(self, message: Dict) -> Optional[Dict]:
+        """
+        The open slot offer in this message's conversation, if any.
+        
+        An offer older than offer_ttl is closed as "expired" instead.
+        
+        Returns:
+            Dict with id, conversation_id, thread_id, message_id, service_type,
+            slots (start/end datetimes, in offered order) and created_at
+        """
+        email = customer_address(message)
+        with self._lock:
+            conversation_id = self._find_conversation(message.get("thread_id"), email)
+            if conversation_id is None:
+                return None
+            row = self._conn.execute(
+                "SELECT o.id, o.message_id, o.service_type, o.slots, o.created_at, c.thread_id "
+                "FROM slot_offers o JOIN conversations c ON c.id = o.conversation_id "
+                "WHERE o.conversation_id = ? AND o.status = 'pending' ORDER BY o.id DESC LIMIT 1",
+                (conversation_id,)
+            ).fetchone()
+            if row is not None and row[4] < time.time() - self.offer_ttl:
+                self.close_offer(row[0], "expired")
+                return None
+        if row is None:
+            return None
+        offer_id, message_id, service_type, slots, created_at, thread_id = row
+        return {
+            "id": offer_id,
+            "conversation_id": conversation_id,
+            "thread_id": thread_id,
+            "message_id": message_id,
+            "service_type": service_type,
+            "slots": [
+                dict(slot, start=datetime.fromisoformat(slot["start"]), end=datetime.fromisoformat(slot["end"]))
+                for slot in json.loads(slots)
+            ],
+            "created_at": created_at
+        }
+    
+    def close_offer(self, offer_id: int, status: str = "accepted"):
+        """Mark a slot offer as no longer pending"""
+        with self._lock:
+            self._conn.execute("UPDATE slot_offers SET status = ? WHERE id = ?", (status, offer_id))
+            self._conn.commit()
+    
+    def record_appointment(
+        self,
+        conversation_id: int,
+        slot: Dict,
+        service_type: Optional[str] = None,
+        calendar_event_id: Optional[str] = None,
+        offer_id: Optional[int] = None
+    ) -> int:
+        """Store a confirmed appointment for a conversation (booked from `offer_id`, if given)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO appointments (conversation_id, service_type, scheduled_at, duration_minutes, "
+                "calendar_event_id, offer_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (conversation_id, service_type, slot["start"].isoformat(), slot.get("duration_minutes"),
+                 calendar_event_id, offer_id, time.time())
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+    
+    def appointment_for_offer(self, offer_id: int) -> Optional[Dict]:
+        """
+        The appointment booked from a slot offer, if any.
+        
+        Returns:
+            Dict with id, conversation_id, service_type, slot (start datetime,
+            duration_minutes), calendar_event_id and confirmed_at (None until
+            the confirmation has been sent)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, conversation_id, service_type, scheduled_at, duration_minutes, calendar_event_id, "
+                "confirmed_at FROM appointments WHERE offer_id = ? ORDER BY id DESC LIMIT 1",
+                (offer_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        appointment_id, conversation_id, service_type, scheduled_at, duration, event_id, confirmed_at = row
+        return {
+            "id": appointment_id,
+            "conversation_id": conversation_id,
+            "service_type": service_type,
+            "slot": {"start": datetime.fromisoformat(scheduled_at), "duration_minutes": duration},
+            "calendar_event_id": event_id,
+            "confirmed_at": confirmed_at
+        }
+    
+    def mark_confirmed(self, appointment_id: int):
+        """Record that the customer has been sent the booking confirmation"""
+        with self._lock:
+            self._conn.execute("UPDATE appointments SET confirmed_at = ? WHERE id = ?", (time.time(), appointment_id))
+            self._conn.commit()
+    
+    def stats(self) -> Dict:
+        """Row counts (after flushing buffered writes)"""
+        with self._lock:
+            self.flush()
+            return {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("conversations", "messages", "slot_offers", "appointments")
+            }
+    
+    def close(self):
+        """Flush buffered writes and close the database"""
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+
+def test_conversation_store():
+    """Test threading, slot offers, batching and lookup cost at scale"""
+    import os
+    import tempfile
+    
+    print("Testing Conversation Store")
+    print("=" * 60)
+    print()
+    
+    store = ConversationStore(":memory:", business_id="demo", batch_size=50)
+    
+    first = {"message_id": "m1", "from": "Jo Smith <JO@example.com>", "subject": "AC broken", "text": "Need a tech"}
+    reply = {"message_id": "m2", "from": "jo@example.com", "subject": "Re: AC broken", "text": "Option 2 please"}
+    other = {"message_id": "m3", "from": "sam@example.com", "subject": "Quote", "thread_id": "t9", "text": "How much?"}
+    
+    conversation_id = store.record_message(first, triage={"intent": "booking", "urgency": "this_week"})
+    assert store.record_message(reply) == conversation_id
+    assert store.record_message(other) != conversation_id
+    assert [m["message_id"] for m in store.history(reply)] == ["m1", "m2"]
+    print("✅ Customer messages threaded into one conversation")
+    
+    assert store.pending_offer(reply) is None
+    slots = [
+        {"start": datetime(2026, 3, 2, 9 + i), "end": datetime(2026, 3, 2, 10 + i), "duration_minutes": 60}
+        for i in range(4)
+    ]
+    store.record_slot_offer(first, slots, service_type="hvac_repair")
+    offer = store.pending_offer(reply)
+    assert offer["slots"] == slots and offer["service_type"] == "hvac_repair"
+    assert store.pending_offer(other) is None
+    store.close_offer(offer["id"])
+    assert store.pending_offer(reply) is None
+    print("✅ Pending slot offer found from the customer's reply")
+    
+    offer_id = store.record_slot_offer(first, slots)
+    store.offer_ttl = 0
+    assert store.pending_offer(reply) is None
+    store.offer_ttl = 48 * 3600
+    assert store.pending_offer(reply) is None  # closed, not just hidden
+    assert store._conn.execute("SELECT status FROM slot_offers WHERE id = ?", (offer_id,)).fetchone() == ("expired",)
+    print("✅ Stale slot offer expired")
+    
+    path = os.path.join(tempfile.mkdtemp(), "conversations.db")
+    shop_a, shop_b = ConversationStore(path, business_id="a"), ConversationStore(path, business_id="b")
+    assert shop_a.conversation_for(first) != shop_b.conversation_for(reply)
+    assert shop_a.conversation_for(other) != shop_b.conversation_for(other)
+    shop_a.record_slot_offer(first, slots)
+    assert shop_b.pending_offer(reply) is None
+    print("✅ Conversations kept apart per business in a shared database")
+    
+    # Ingest throughput and lookup cost with a large store
+    count = 20000
+    start = time.perf_counter()
+    for i in range(count):
+        store.record_message({"message_id": f"bulk_{i}", "from": f"c{i % 5000}@example.com",
+                              "subject": "Hi", "text": "Hello"})
+    store.flush()
+    ingest = time.perf_counter() - start
+    print(f"   Ingested {count} messages in {ingest:.2f}s ({count / ingest:.0f}/s, batches of {store.batch_size})")
+    
+    start = time.perf_counter()
+    for i in range(2000):
+        store.pending_offer({"from": f"c{i * 7 % 5000}@example.com"})
+    per_lookup = (time.perf_counter() - start) / 2000 * 1e6
+    plan = store._conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM conversations WHERE customer_email = ? AND business_id IS ? "
+        "AND status = 'active' ORDER BY updated_at DESC LIMIT 1", ("x", "demo")
+    ).fetchall()
+    assert "idx_conversations_customer" in str(plan)
+    print(f"✅ Offer lookup by customer: {per_lookup:.1f} µs ({store.stats()['conversations']} conversations, indexed)")
+    print()
+
+
+if __name__ == "__main__":
+    test_conversation_store()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Local Agentmail stand-in for load and failure testing.
+
+Implements the two endpoints poc_monitor's AgentmailClient uses:
+    
+    GET  /inboxes/{inbox}/messages?limit=&after=&page_token=
+    POST /inboxes/{inbox}/messages/send
+
+Listing is newest-first with page tokens; "after" filters by timestamp
+the way incremental sync expects. Every request can be slowed down
+(latency + jitter), failed with a 500 (error_rate) or throttled with a
+429 and Retry-After once it exceeds a token-bucket rate limit, so the
+client's pooling, retries and backoff can be exercised without the live
+API. Messages are added with inject(); sent replies are kept in `sent`.
+
+Standalone:
+    python3 fake_agentmail.py --port 8025 --latency 0.05 --error-rate 0.02 --rate-limit 10
+    AGENTMAIL_BASE_URL=http://127.0.0.1:8025 AGENTMAIL_API_KEY=test AGENTMAIL_EMAIL=test \\
+        python3 poc_monitor.py --daemon --min-interval 1
+(load_generator.py --serve does the same and also feeds the inbox.)
+"""
+
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _epoch(value: str) -> float:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class FakeAgentmail:
+    """In-memory inboxes plus an HTTP front end with injectable latency, errors and throttling"""
+    
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: Optional[float] = None,
+        burst: Optional[float] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            latency: Added delay per request in seconds
+            latency_jitter: Extra uniform random delay, 0..latency_jitter seconds
+            error_rate: Fraction of requests answered with 500
+            rate_limit: Requests per second before answering 429 (None = unlimited)
+            burst: Token bucket size (default: one second's worth of rate_limit)
+            seed: RNG seed for reproducible jitter and errors
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.burst = burst or (max(1.0, rate_limit) if rate_limit else None)
+        
+        # inbox -> (sorted (epoch, seq) keys, messages in the same order)
+        self._inboxes: Dict[str, Tuple[List[Tuple[float, int]], List[Dict]]] = {}
+        self.sent: List[Dict] = []
+        self.stats = {"requests": 0, "list": 0, "send": 0, "throttled": 0, "errors": 0}
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._tokens = self.burst or 0.0
+        self._refilled_at = time.monotonic()
+        self._httpd: Optional[ThreadingHTTPServer] = None
+    
+    def inject(self, inbox_id: str, message: Dict) -> Dict:
+        """
+        Deliver a message to an inbox.
+        
+        Missing message_id/timestamp are filled in (timestamp = now).
+        
+        Returns:
+            The stored message
+        """
+        seq = next(self._seq)
+        message = dict(message)
+        message.setdefault("message_id", f"msg_{seq}")
+        message.setdefault("timestamp", _iso(time.time()))
+        message.setdefault("created_at", message["timestamp"])
+        message.setdefault("to", inbox_id)
+        message.setdefault("preview", (message.get("text") or "")[:100])
+        key = (_epoch(message["timestamp"]), seq)
+        
+        with self._lock:
+            keys, messages = self._inboxes.setdefault(inbox_id, ([], []))
+            index = bisect_left(keys, key)
+            keys.insert(index, key)
+            messages.insert(index, message)
+        return message
+    
+    def list_messages(self, inbox_id: str, limit: int = 10, after: Optional[str] = None, page_token: Optional[str] = None) -> Dict:
+        """Newest-first page of messages at or after `after`"""
+        offset = int(page_token or 0)
+        with self._lock:
+            keys, messages = self._inboxes.get(inbox_id, ([], []))
+            start = bisect_left(keys, (_epoch(after), 0)) if after else 0
+            newest_first = messages[start:][::-1]
+        page = newest_first[offset:offset + limit]
+        more = offset + limit < len(newest_first)
+        return {
+            "count": len(page),
+            "messages": page,
+            "next_page_token": str(offset + limit) if more else None
+        }
+    
+    def send(self, inbox_id: str, payload: Dict) -> Dict:
+        """Record an outbound message"""
+        message_id = f"out_{next(self._seq)}"
+        record = {"message_id": message_id, "inbox_id": inbox_id, "sent_at": time.time(), **payload}
+        with self._lock:
+            self.sent.append(record)
+        return {"message_id": message_id, "thread_id": f"thread_{message_id}"}
+    
+    def inbox_size(self, inbox_id: str) -> int:
+        with self._lock:
+            return len(self._inboxes.get(inbox_id, ([], []))[1])
+    
+    def _admit(self) -> Optional[Tuple[int, Dict, Dict]]:
+        """Apply latency, throttling and error injection; returns an error response or None"""
+        with self._lock:
+            self.stats["requests"] += 1
+            delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+            fail = self.error_rate and self._rng.random() < self.error_rate
+            
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_limit)
+                self._refilled_at = now
+                if self._tokens < 1:
+                    self.stats["throttled"] += 1
+                    retry_after = math.ceil((1 - self._tokens) / self.rate_limit * 100) / 100
+                    return 429, {"error": "rate limited"}, {"Retry-After": str(retry_after)}
+                self._tokens -= 1
+            
+            if fail:
+                self.stats["errors"] += 1
+        
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return 500, {"error": "internal error (injected)"}, {}
+        return None
+    
+    def _handler_class(self):
+        fake = self
+        
+        class AgentmailHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+            disable_nagle_algorithm = True
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def _reply(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def _route(self) -> Optional[Tuple[str, str]]:
+                parts = urlparse(self.path).path.strip("/").split("/")
+                if len(parts) >= 3 and parts[0] == "inboxes" and parts[2] == "messages":
+                    return unquote(parts[1]), "/".join(parts[3:])
+                return None
+            
+            def _check(self) -> bool:
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    self._reply(401, {"error": "missing API key"})
+                    return False
+                rejected = fake._admit()
+                if rejected:
+                    self._reply(*rejected)
+                    return False
+                return True
+            
+            def do_GET(self):
+                route = self._route()
+                if route is None or route[1]:
+                    self._reply(404, {"error": "not found"})
+                    return
+                if not self._check():
+                    return
+                query = parse_qs(urlparse(self.path).query)
+                with fake._lock:
+                    fake.stats["list"] += 1
+                self._reply(200, fake.list_messages(
+                    route[0],
+                    limit=int(query.get("limit", ["10"])[0]),
+                    after=query.get("after", [None])[0],
+                    page_token=query.get("page_token", [None])[0]
+                ))
+            
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                route = self._route()
+                if route is None or route[1] != "send":
+                    self._reply(404, {"error": "not found"})
+                    return
+                if not self._check():
+                    return
+                if not payload.get("to"):
+                    self._reply(400, {"error": "missing 'to'"})
+                    return
+                with fake._lock:
+                    fake.stats["send"] += 1
+                self._reply(200, fake.send(route[0], payload))
+        
+        return AgentmailHandler
+    
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve in a background thread; returns the base URL"""
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self.base_url
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+
+def test_fake_agentmail():
+    """Drive the stand-in with the real AgentmailClient: paging, sync, sends, 429s and 500s"""
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from poc_monitor import ActionRouter, AgentmailClient, CalendarManager, InboxWatermark, MessageTriage, poll_once
+    
+    print("Testing Fake Agentmail")
+    print("=" * 60)
+    print()
+    
+    fake = FakeAgentmail()
+    client = AgentmailClient("test-key", "shop@example.com", base_url=fake.start())
+    
+    base = time.time() - 600
+    for i in range(120):
+        fake.inject("shop@example.com", {"from": f"c{i}@example.com", "subject": f"Msg {i}", "text": "Hi", "timestamp": _iso(base + i)})
+    
+    assert [m["subject"] for m in client.get_messages(limit=3)] == ["Msg 119", "Msg 118", "Msg 117"]
+    watermark = InboxWatermark(None)
+    watermark.timestamp = datetime.fromtimestamp(base + 49.5, timezone.utc).replace(tzinfo=None)
+    new = client.get_new_messages(watermark, page_size=25)
+    assert [m["subject"] for m in new] == [f"Msg {i}" for i in range(50, 120)]
+    print(f"✅ Incremental sync fetched {len(new)} new messages over {fake.stats['list'] - 1} pages")
+    
+    # A quota-limited poll pages to the watermark once, then works through its backlog
+    router = ActionRouter(client, CalendarManager())
+    watermark = InboxWatermark(None)
+    watermark.timestamp = datetime.fromtimestamp(base + 49.5, timezone.utc).replace(tzinfo=None)
+    handled, lists = [], []
+    for _ in range(3):
+        lists_before = fake.stats["list"]
+        handled.append(poll_once(client, MessageTriage(), router, watermark, max_messages=30))
+        lists.append(fake.stats["list"] - lists_before)
+    assert handled == [30, 30, 10], handled
+    assert lists == [2, 0, 1], lists
+    assert watermark.timestamp == datetime.fromtimestamp(base + 119, timezone.utc).replace(tzinfo=None)
+    print(f"✅ Quota of 30 drained 70 messages oldest-first with {sum(lists)} list requests")
+    
+    assert client.send_reply("c1@example.com", "Re: Msg 1", "Thanks")["message_id"].startswith("out_")
+    assert fake.sent[-1]["to"] == "c1@example.com"
+    print("✅ Reply recorded")
+    
+    fake.rate_limit, fake.burst, fake._tokens = 20, 2, 0
+    start = time.perf_counter()
+    for _ in range(5):
+        client.get_messages(limit=1)
+    elapsed = time.perf_counter() - start
+    assert fake.stats["throttled"] > 0
+    print(f"✅ Rate limit: 5 calls in {elapsed:.2f}s, {fake.stats['throttled']} throttled with Retry-After and retried")
+    
+    fake.rate_limit = None
+    fake.error_rate = 0.3
+    fake._rng.seed(3)
+    for _ in range(20):
+        client.get_messages(limit=1)
+    assert fake.stats["errors"] > 0
+    print(f"✅ {fake.stats['errors']} injected 500s absorbed by client retries")
+    
+    # A send that may have been accepted is not retried (it could go out twice)
+    fake.error_rate = 1.0
+    requests_before = fake.stats["requests"]
+    assert client.send_reply("c2@example.com", "Re: Msg 2", "Thanks") is None
+    assert fake.stats["requests"] == requests_before + 1
+    print("✅ Failed send not retried")
+    
+    client.close()
+    fake.stop()
+    print()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local Agentmail stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit", type=float, help="requests/second before answering 429")
+    parser.add_argument("--test", action="store_true", help="run the self-test instead of serving")
+    args = parser.parse_args(argv)
+    
+    if args.test:
+        test_fake_agentmail()
+        return 0
+    
+    fake = FakeAgentmail(args.latency, args.jitter, args.error_rate, args.rate_limit)
+    print(f"Fake Agentmail on {fake.start(args.host, args.port)} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    fake.stop()
+    print(f"Stats: {fake.stats}, {len(fake.sent)} replies sent")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Synthetic inbox load generator.
+
+Feeds a FakeAgentmail inbox with realistic home-services mail (HVAC,
+plumbing and electrical requests at mixed urgency, plus questions,
+complaints, spam and thank-yous) at a target rate with Poisson arrivals,
+runs the real monitor pipeline against it (AgentmailClient ->
+MessageTriage -> ActionRouter -> SendPipeline, driven by run_daemon),
+and reports processing throughput and time-to-first-response: from a
+message landing in the inbox to the stand-in receiving our reply.
+Throughput is messages triaged and routed per second the daemon spent
+polling (queued sends finish in the background), not the arrival rate;
+--backlog pre-fills the inbox so the run also
+measures how fast the pipeline drains a queue it cannot keep up with.
+
+Usage:
+    python3 load_generator.py --rate 20 --duration 30 --workers 4
+    python3 load_generator.py --backlog 2000 --duration 0    # maximum drain rate
+    python3 load_generator.py --rate 20 --latency 0.05 --error-rate 0.05 --rate-limit 20
+    python3 load_generator.py --serve 8025 --rate 2    # feed a stand-in for an external monitor
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_agentmail import FakeAgentmail
+from metrics import METRICS
+from poc_monitor import (
+    ActionRouter,
+    AgentmailClient,
+    CalendarManager,
+    InboxWatermark,
+    MessageTriage,
+    _message_time,
+    run_daemon,
+)
+from send_pipeline import SendPipeline
+
+FIRST_NAMES = ["John", "Maria", "David", "Linda", "James", "Patricia", "Robert", "Jennifer", "Michael", "Susan",
+               "Carlos", "Aisha", "Wei", "Priya", "Tom", "Grace", "Luis", "Nora", "Sam", "Olivia"]
+LAST_NAMES = ["Smith", "Garcia", "Johnson", "Brown", "Nguyen", "Patel", "Miller", "Davis", "Lopez", "Wilson",
+              "Kim", "Martinez", "Clark", "Lewis", "Walker", "Young", "Hall", "Allen", "King", "Wright"]
+STREETS = ["Main St", "Oak Ave", "Maple Dr", "Cedar Ln", "Elm St", "Pine Rd", "Lakeview Blvd", "Hillcrest Way"]
+WHEN = ["tomorrow morning", "Thursday afternoon", "sometime next week", "this weekend", "any weekday after 3pm"]
+
+# (weight, [(subject, body)]) - bodies may use {name}, {address}, {when}, {temp}
+SCENARIOS = {
+    "hvac_emergency": (8, [
+        ("No heat - {temp} degrees outside", "Our furnace quit overnight and it's {temp} degrees outside. We have a newborn at home. Please send someone ASAP. {address}"),
+        ("AC died, house is 90+", "The AC stopped working completely and it's over 90 inside. My father is elderly - this is an emergency. {address}"),
+        ("Gas smell near furnace", "There's a gas smell near the furnace. We opened the windows. Can someone come immediately? {address}"),
+    ]),
+    "hvac_repair": (18, [
+        ("AC blowing warm air", "Hi, our AC is running but only blowing warm air. Could someone come out {when}? {address}\n\nThanks,\n{name}"),
+        ("Furnace making banging noise", "The furnace makes a loud bang every time it kicks on. I'd like to book a repair visit {when}.\n\n{name}"),
+        ("Heat pump not working", "Our heat pump stopped heating yesterday. Can you schedule a technician {when}? {address}"),
+        ("Thermostat broken", "The thermostat screen is blank and the system won't turn on. Can you fix it {when}?"),
+    ]),
+    "hvac_maintenance": (10, [
+        ("Annual furnace tune-up", "I'd like to schedule our annual furnace tune-up {when}. {address}\n\n{name}"),
+        ("AC maintenance before summer", "Can we book an AC service visit before summer? {when} works best."),
+    ]),
+    "plumbing_emergency": (6, [
+        ("Pipe burst - water everywhere", "A pipe burst under the kitchen sink and water is everywhere. Shut off the main but need help immediately! {address}"),
+        ("Sewage backing up", "Sewage is backing up into the basement shower. This is an emergency. {address}"),
+    ]),
+    "plumbing_repair": (16, [
+        ("Leaky faucet", "Our bathroom faucet has been dripping for a week. Could you come fix it {when}?\n\n{name}"),
+        ("Clogged drain", "Kitchen drain is clogged and the plunger isn't helping. Can I book someone {when}? {address}"),
+        ("Water heater leaking", "The water heater is leaking a little onto the garage floor. Can you schedule a visit {when}?"),
+        ("Toilet keeps running", "Upstairs toilet runs constantly. Need a plumber {when}. {address}"),
+    ]),
+    "electrical": (8, [
+        ("Breaker keeps tripping", "The breaker keeps tripping when we run the microwave. Can an electrician come out {when}?"),
+        ("Outlet sparking", "An outlet in the living room sparked and smells like burning. Is this dangerous? Please send someone. {address}"),
+        ("Ceiling fan install", "I'd like to book an electrician to install two ceiling fans {when}."),
+    ]),
+    "question": (12, [
+        ("Quick question about pricing", "How much do you charge for a service call? Just trying to budget."),
+        ("Do you service my area?", "Do you cover {address}? And what are your hours on Saturday?"),
+        ("Duct cleaning cost", "What's the price for duct cleaning in a two-story house?"),
+    ]),
+    "complaint": (6, [
+        ("Technician never showed", "We had an appointment yesterday and the technician never showed. No call either. Very disappointed.\n\n{name}"),
+        ("Unhappy with repair", "The repair last week didn't fix anything and now it's worse. I'm unhappy with the service."),
+    ]),
+    "spam": (10, [
+        ("Boost your Google ranking", "Get your business on page one in 30 days! Click here for a free audit. Unsubscribe anytime."),
+        ("Wholesale HVAC parts", "Limited time marketing offer: wholesale parts. Click here. Unsubscribe at bottom."),
+    ]),
+    "other": (6, [
+        ("Re: appointment", "Thanks, see you then!\n\n{name}"),
+        ("Thank you", "Great job on the repair yesterday, everything works perfectly now."),
+    ]),
+}
+
+
+class MessageGenerator:
+    """Random but realistic inbound customer messages, each from a unique address"""
+    
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.count = 0
+        self._kinds = list(SCENARIOS)
+        self._weights = [SCENARIOS[kind][0] for kind in self._kinds]
+    
+    def generate(self) -> Dict:
+        """One message dict (from, subject, text) plus its scenario under "kind" """
+        rng = self.rng
+        self.count += 1
+        kind = rng.choices(self._kinds, self._weights)[0]
+        subject, body = rng.choice(SCENARIOS[kind][1])
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        fields = {
+            "name": f"{first} {last}",
+            "address": f"I'm at {rng.randint(10, 9999)} {rng.choice(STREETS)}.",
+            "when": rng.choice(WHEN),
+            "temp": rng.randint(-5, 25)
+        }
+        address = f"{first.lower()}.{last.lower()}{self.count}@example.com"
+        return {
+            "from": f"{first} {last} <{address}>",
+            "subject": subject.format(**fields),
+            "text": body.format(**fields),
+            "kind": kind
+        }
+
+
+def feed(
+    fake: FakeAgentmail,
+    inbox: str,
+    generator: MessageGenerator,
+    rate: float,
+    duration: float,
+    stop_event: Optional[threading.Event] = None
+) -> Dict[str, float]:
+    """
+    Inject messages with Poisson arrivals at `rate` per second for `duration` seconds.
+    
+    Returns:
+        Sender address -> injection time (epoch seconds)
+    """
+    stop_event = stop_event or threading.Event()
+    injected = {}
+    if rate <= 0 or duration <= 0:
+        return injected
+    start = time.monotonic()
+    next_at = start
+    while not stop_event.is_set():
+        next_at += generator.rng.expovariate(rate)
+        if next_at - start >= duration:
+            break
+        delay = next_at - time.monotonic()
+        if delay > 0 and stop_event.wait(delay):
+            break
+        message = generator.generate()
+        injected[message["from"]] = time.time()
+        fake.inject(inbox, message)
+    return injected
+
+
+def _percentiles(values: List[float]) -> Dict:
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {
+        "p50_ms": round(pick(0.50) * 1000, 1),
+        "p95_ms": round(pick(0.95) * 1000, 1),
+        "p99_ms": round(pick(0.99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1)
+    }
+
+
+def response_times(fake: FakeAgentmail, injected: Dict[str, float]) -> List[float]:
+    """Seconds from injection to the first reply sent to each sender"""
+    first_reply = {}
+    for sent in list(fake.sent):
+        to = sent.get("to")
+        if to in injected and to not in first_reply:
+            first_reply[to] = sent["sent_at"]
+    return [first_reply[to] - injected[to] for to in first_reply]
+
+
+def run_load(
+    rate: float = 10,
+    duration: float = 10,
+    workers: int = 4,
+    send_concurrency: int = 4,
+    min_interval: float = 1.0,
+    max_interval: float = 5.0,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    rate_limit: Optional[float] = None,
+    drain_timeout: float = 60,
+    seed: Optional[int] = None,
+    backlog: int = 0
+) -> Dict:
+    """
+    Run the monitor pipeline against a fed stand-in inbox and measure it.
+    
+    The daemon keeps polling after the feed stops until its watermark
+    passes the last injected message (or drain_timeout), so throughput
+    counts the whole backlog, not just what kept up.
+    
+    Args:
+        backlog: Messages put in the inbox before the daemon starts; the
+            report's drain_per_sec is then the pipeline's maximum rate
+    
+    Returns:
+        Report dict: injected/replied counts, arrival and processing rates,
+        time-to-first-response percentiles, drain time, API and outbound
+        stats, stage latencies
+    """
+    fake = FakeAgentmail(latency, jitter, error_rate, rate_limit, seed=seed)
+    inbox = "loadtest@example.com"
+    client = AgentmailClient("load-test", inbox, base_url=fake.start(), pool_size=workers + send_concurrency)
+    outbox = SendPipeline(client, max_in_flight=send_concurrency, backoff_base=0.5) if send_concurrency else None
+    router = ActionRouter(client, CalendarManager(), outbox=outbox)
+    router.send_emails_enabled = True
+    watermark = InboxWatermark(None)
+    watermark.timestamp = datetime.now(timezone.utc).replace(tzinfo=None)
+    METRICS.reset()
+    
+    generator = MessageGenerator(seed)
+    injected = {}
+    for _ in range(backlog):
+        message = generator.generate()
+        injected[message["from"]] = time.time()
+        fake.inject(inbox, message)
+    
+    stop_event = threading.Event()
+    daemon = threading.Thread(
+        target=run_daemon,
+        args=(client, MessageTriage(), router, watermark),
+        kwargs={"workers": workers, "min_interval": min_interval, "max_interval": max_interval, "stop_event": stop_event},
+        daemon=True
+    )
+    start = time.time()
+    daemon.start()
+    injected.update(feed(fake, inbox, generator, rate, duration))
+    fed_at = time.time()
+    
+    # Wait for the daemon to get through the backlog
+    last = _message_time(fake.list_messages(inbox, limit=1)["messages"][0]) if injected else None
+    deadline = time.monotonic() + drain_timeout
+    while last is not None and time.monotonic() < deadline:
+        if watermark.timestamp is not None and watermark.timestamp >= last:
+            break
+        time.sleep(0.05)
+    drained = last is None or (watermark.timestamp is not None and watermark.timestamp >= last)
+    if outbox is not None:
+        outbox.flush(timeout=drain_timeout)
+    finished = time.time()
+    stop_event.set()
+    daemon.join()
+    
+    times = response_times(fake, injected)
+    stages = METRICS.snapshot()["stages"]
+    processed = stages.get("process_message", {}).get("count", 0)
+    poll = stages.get("poll", {})
+    busy = poll.get("count", 0) * poll.get("mean_ms", 0) / 1000  # time spent inside polls
+    report = {
+        "target_rate": rate,
+        "backlog": backlog,
+        "injected": len(injected),
+        "drained": drained,
+        "processed": processed,
+        "replied": len(times),
+        "arrival_per_sec": round((len(injected) - backlog) / (fed_at - start), 1) if fed_at > start else 0.0,
+        "messages_per_sec": round(processed / busy, 1) if busy else 0.0,
+        "drain_per_sec": round(processed / (finished - start), 1) if backlog else None,
+        "drain_seconds": round(finished - fed_at, 2),
+        "time_to_first_response": _percentiles(times),
+        "api": dict(fake.stats),
+        "outbound": outbox.stats() if outbox is not None else None,
+        "stages": {stage: stages[stage] for stage in ("get_messages", "triage_message", "route", "send_reply", "process_message") if stage in stages}
+    }
+    if outbox is not None:
+        outbox.close()
+    client.close()
+    fake.stop()
+    return report
+
+
+def print_report(report: Dict):
+    backlog = f"{report['backlog']} pre-filled + " if report["backlog"] else ""
+    print(f"Injected:   {backlog}{report['injected'] - report['backlog']} messages at ~{report['arrival_per_sec']}/s "
+          f"({'fully drained' if report['drained'] else 'NOT drained before timeout'}, {report['drain_seconds']}s after the feed stopped)")
+    print(f"Throughput: {report['messages_per_sec']} messages/sec triaged and routed while polling ({report['processed']} processed)")
+    if report["drain_per_sec"] is not None:
+        print(f"Drain:      {report['drain_per_sec']} messages/sec from daemon start to empty inbox")
+    ttfr = report["time_to_first_response"]
+    if ttfr:
+        print(f"Time to first response ({report['replied']} replies): "
+              f"p50 {ttfr['p50_ms']} ms, p95 {ttfr['p95_ms']} ms, p99 {ttfr['p99_ms']} ms, max {ttfr['max_ms']} ms")
+    print(f"API:        {report['api']}")
+    if report["outbound"]:
+        print(f"Outbound:   {report['outbound']}")
+    for stage, summary in report["stages"].items():
+        print(f"  {stage:<16} n={summary['count']:<6} p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  p99 {summary['p99_ms']} ms")
+
+
+def serve(port: int, rate: float, inbox: str, fake_options: Dict, seed: Optional[int] = None):
+    """Run a fed stand-in for an external monitor until Ctrl-C, then report response times"""
+    fake = FakeAgentmail(seed=seed, **fake_options)
+    base_url = fake.start("127.0.0.1", port)
+    print(f"Fake Agentmail on {base_url}, feeding {inbox} at ~{rate} messages/s. Point the monitor at it:")
+    print(f"  AGENTMAIL_BASE_URL={base_url} AGENTMAIL_API_KEY=test AGENTMAIL_EMAIL={inbox} POC_SEND_EMAILS=true \\")
+    print(f"      python3 poc_monitor.py --daemon --min-interval 1")
+    print("Ctrl-C to stop")
+    
+    stop_event = threading.Event()
+    injected: Dict[str, float] = {}
+    generator = MessageGenerator(seed)
+    feeder = threading.Thread(
+        target=lambda: injected.update(feed(fake, inbox, generator, rate, float("inf"), stop_event)),
+        daemon=True
+    )
+    feeder.start()
+    try:
+        while feeder.is_alive():
+            feeder.join(1)
+    except KeyboardInterrupt:
+        pass
+    stop_event.set()
+    feeder.join()
+    fake.stop()
+    
+    times = response_times(fake, injected)
+    print()
+    print(f"Injected {len(injected)} messages, {len(times)} answered")
+    if times:
+        print(f"Time to first response: {_percentiles(times)}")
+    print(f"API: {fake.stats}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Synthetic inbox load against a local Agentmail stand-in")
+    parser.add_argument("--rate", type=float, default=10, help="messages per second (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to feed the inbox")
+    parser.add_argument("--workers", type=int, default=4, help="messages triaged/routed concurrently (POC_WORKERS)")
+    parser.add_argument("--send-concurrency", type=int, default=4, help="background sends in flight (0 = inline)")
+    parser.add_argument("--min-interval", type=float, default=1.0, help="daemon poll interval while mail is arriving")
+    parser.add_argument("--max-interval", type=float, default=5.0, help="daemon idle back-off")
+    parser.add_argument("--latency", type=float, default=0.0, help="stand-in: seconds added per API call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="stand-in: extra random delay per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="stand-in: fraction of calls failing with 500")
+    parser.add_argument("--rate-limit", type=float, help="stand-in: requests/second before 429s")
+    parser.add_argument("--seed", type=int, help="reproducible message stream")
+    parser.add_argument("--backlog", type=int, default=0, help="messages in the inbox before the daemon starts (measures maximum drain rate)")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="only serve and feed a stand-in for an external monitor")
+    args = parser.parse_args(argv)
+    
+    fake_options = {"latency": args.latency, "latency_jitter": args.jitter,
+                    "error_rate": args.error_rate, "rate_limit": args.rate_limit}
+    if args.serve:
+        serve(args.serve, args.rate, "loadtest@example.com", fake_options, args.seed)
+        return 0
+    
+    print("Load test: synthetic inbox -> monitor pipeline -> stand-in Agentmail")
+    print("=" * 60)
+    print(f"Rate {args.rate}/s for {args.duration}s after a backlog of {args.backlog}, {args.workers} workers, "
+          f"send concurrency {args.send_concurrency}, poll every {args.min_interval}-{args.max_interval}s")
+    print()
+    report = run_load(
+        rate=args.rate,
+        duration=args.duration,
+        workers=args.workers,
+        send_concurrency=args.send_concurrency,
+        min_interval=args.min_interval,
+        max_interval=args.max_interval,
+        seed=args.seed,
+        backlog=args.backlog,
+        **{key: value for key, value in fake_options.items() if key != "latency_jitter"},
+        jitter=args.jitter
+    )
+    print_report(report)
+    return 0 if report["drained"] else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+In-process metrics: stage timers, latency histograms, counters and gauges.
+
+Cheap enough to leave on in production (one bisect and a few integer
+updates per observation). Latencies go into fixed log-spaced buckets, so
+memory per stage is constant and p50/p95/p99 are estimated from the
+bucket counts. Export as Prometheus text (GET /metrics) or as a JSON
+snapshot written to a file.
+
+Usage:
+    from metrics import METRICS
+    
+    with METRICS.timer("triage_message"):
+        ...
+    METRICS.inc("route_actions_total", action="booking_options_sent")
+    METRICS.register_gauge("work_queue_depth", lambda: queue.depth())
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+# Upper bounds in seconds: 100 µs to ~100 s, each sqrt(2) above the last
+LATENCY_BUCKETS: List[float] = [0.0001 * 2 ** (i / 2) for i in range(41)]
+
+
+class Histogram:
+    """Fixed-bucket latency histogram"""
+    
+    def __init__(self, bounds: List[float] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float):
+        """Record one value (seconds)"""
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+    
+    def percentile(self, q: float) -> float:
+        """Estimate the q-th quantile (0-1), interpolating inside the bucket"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+            largest = self.max
+        if not total:
+            return 0.0
+        
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else largest
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(estimate, largest)
+            seen += count
+        return largest
+    
+    def summary(self) -> Dict:
+        """Count, mean and p50/p95/p99/max in milliseconds"""
+        mean = self.sum / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "mean_ms": round(mean * 1000, 3),
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p95_ms": round(self.percentile(0.95) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+
+class StageTimer:
+    """Context manager recording the block's duration into a histogram"""
+    
+    __slots__ = ("histogram", "start")
+    
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _label_key(name: str, labels: Dict[str, str]) -> LabelKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    """Registry of stage histograms, labelled counters and gauge callbacks"""
+    
+    def __init__(self, prefix: str = "poc"):
+        self.prefix = prefix
+        self.started_at = time.time()
+        self._stages: Dict[str, Histogram] = {}
+        self._counters: Dict[LabelKey, float] = {}
+        self._gauges: Dict[str, Callable[[], Union[float, Dict[str, float]]]] = {}
+        self._lock = threading.Lock()
+    
+    def _stage(self, stage: str) -> Histogram:
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._stages.setdefault(stage, Histogram())
+        return histogram
+    
+    def observe(self, stage: str, seconds: float):
+        """Record a stage duration"""
+        self._stage(stage).observe(seconds)
+    
+    def timer(self, stage: str) -> "StageTimer":
+        """Time a `with` block as one observation of `stage` (errors included)"""
+        return StageTimer(self._stage(stage))
+    
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Add to a counter, e.g. inc("route_actions_total", action="marked_spam")"""
+        key = _label_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def register_gauge(self, name: str, func: Callable[[], Union[float, Dict[str, float]]]):
+        """
+        Register a gauge read at export time.
+        
+        `func` returns a number, or a dict of label value -> number (exported
+        with a "status" label, e.g. work queue depth by job status).
+        """
+        with self._lock:
+            self._gauges[name] = func
+    
+    def _read_gauges(self) -> Dict[str, Union[float, Dict[str, float]]]:
+        with self._lock:
+            gauges = dict(self._gauges)
+        values = {}
+        for name, func in gauges.items():
+            try:
+                values[name] = func()
+            except Exception:
+                continue  # a closed queue must not break the export
+        return values
+    
+    def snapshot(self) -> Dict:
+        """JSON-friendly view of every metric"""
+        with self._lock:
+            stages = dict(self._stages)
+            counters = dict(self._counters)
+        
+        counter_view: Dict[str, Dict[str, float]] = {}
+        for (name, labels), value in sorted(counters.items()):
+            label_text = ",".join(f"{key}={val}" for key, val in labels) or "total"
+            counter_view.setdefault(name, {})[label_text] = value
+        
+        return {
+            "time": time.time(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "stages": {stage: histogram.summary() for stage, histogram in sorted(stages.items())},
+            "counters": counter_view,
+            "gauges": self._read_gauges()
+        }
+    
+    def prometheus_text(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        prefix = self.prefix
+        lines = []
+        
+        with self._lock:
+            stages = sorted(self._stages.items())
+            counters = sorted(self._counters.items())
+        
+        name = f"{prefix}_stage_duration_seconds"
+        lines.append(f"# HELP {name} Pipeline stage latency")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in stages:
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total, total_sum = histogram.count, histogram.sum
+            labels = (("stage", stage),)
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:.6g}'))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {total}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total_sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {total}")
+        
+        typed = set()
+        for (counter, labels), value in counters:
+            full = f"{prefix}_{counter}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} counter")
+                typed.add(full)
+            lines.append(f"{full}{_format_labels(labels)} {value:g}")
+        
+        for gauge, value in sorted(self._read_gauges().items()):
+            full = f"{prefix}_{gauge}"
+            lines.append(f"# TYPE {full} gauge")
+            if isinstance(value, dict):
+                for status, number in sorted(value.items()):
+                    lines.append(f"{full}{_format_labels((('status', str(status)),))} {number:g}")
+            else:
+                lines.append(f"{full} {value:g}")
+        
+        lines.append(f"{prefix}_uptime_seconds {time.time() - self.started_at:.1f}")
+        return "\n".join(lines) + "\n"
+    
+    def write_snapshot(self, path: str):
+        """Write snapshot() as JSON, replacing the file atomically"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+    
+    def reset(self):
+        """Forget all observations and counters (gauges stay registered)"""
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+            self.started_at = time.time()
+
+
+# Process-wide registry used by poc_monitor and friends
+METRICS = Metrics()
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0", registry: Metrics = METRICS) -> ThreadingHTTPServer:
+    """Serve GET /metrics (Prometheus text) and /metrics.json in a background thread"""
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+        
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = registry.prometheus_text().encode("utf-8")
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(registry.snapshot()).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_metrics():
+    """Test percentiles, exports and per-observation overhead"""
+    import random
+    import urllib.request
+    
+    print("Testing Metrics")
+    print("=" * 60)
+    print()
+    
+    registry = Metrics()
+    rng = random.Random(7)
+    samples = sorted(rng.lognormvariate(-4, 1) for _ in range(20000))  # median ~18 ms
+    for value in samples:
+        registry.observe("triage_message", value)
+    
+    for q in (0.50, 0.95, 0.99):
+        exact = samples[int(q * len(samples)) - 1]
+        estimate = registry._stage("triage_message").percentile(q)
+        assert abs(estimate - exact) / exact < 0.2, (q, estimate, exact)
+    print(f"✅ Percentiles within 20% of exact: {registry.snapshot()['stages']['triage_message']}")
+    
+    registry.inc("route_actions_total", action="marked_spam")
+    registry.inc("route_actions_total", action="marked_spam")
+    registry.inc("route_actions_total", action="booking_options_sent")
+    registry.register_gauge("work_queue_depth", lambda: {"ready": 3, "done": 10})
+    text = registry.prometheus_text()
+    assert 'poc_route_actions_total{action="marked_spam"} 2' in text
+    assert 'poc_work_queue_depth{status="ready"} 3' in text
+    assert 'poc_stage_duration_seconds_count{stage="triage_message"} 20000' in text
+    print("✅ Prometheus export has histograms, counters and gauges")
+    
+    server = start_metrics_server(0, host="127.0.0.1", registry=registry)
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics.json") as response:
+        assert json.loads(response.read())["counters"]["route_actions_total"]["action=marked_spam"] == 2
+    server.shutdown()
+    print("✅ /metrics.json served")
+    
+    n = 100000
+    start = time.perf_counter()
+    for _ in range(n):
+        with registry.timer("overhead"):
+            pass
+    per_timer = (time.perf_counter() - start) / n * 1e6
+    print(f"✅ {per_timer:.2f} µs per timed block")
+    print()
+
+
+if __name__ == "__main__":
+    test_metrics()
@@ -9,9 +9,38 @@ import subprocess
 import tempfile
 from typing import Dict
 
+
 class OpenClawTriage:
     """Message triage using OpenClaw's Claude integration"""
     
+    # Keyword groups for the rule-based classifier. A group "hits" when any of
+    # its keywords appears as a substring of the lowercased subject + body.
+    KEYWORD_GROUPS = {
+        # Intent
+        "complaint": ["complaint", "unhappy", "disappointed", "didn't show", "late", "never showed", "no show"],
+        "urgent": ["emergency", "urgent", "asap", "immediately", "critical"],
+        "booking": ["book", "schedule", "appointment", "come out", "visit"],
+        "didnt": ["didn't"],
+        "never": ["never"],
+        "question": ["how much", "cost", "price", "question", "?"],
+        "spam": ["unsubscribe", "spam", "marketing", "click here"],
+        # Service type
+        "hvac": ["ac ", "air condition", "hvac", "heat", "furnace", "cooling"],
+        "hvac_repair": ["broken", "not working", "stopped", "repair", "fix"],
+        "plumbing": ["plumb", "leak", "drain", "pipe", "toilet", "sink", "water"],
+        "plumbing_repair": ["leak", "broken", "clog"],
+        "electrical": ["electric", "wiring", "outlet", "breaker", "power"],
+        "cleaning": ["clean", "maid", "house"],
+        "landscaping": ["lawn", "grass", "landscape", "yard"],
+        # Urgency
+        "emergency": ["emergency", "asap", "immediately", "critical", "dangerous"],
+        "today": ["today", "right now", "this morning", "this afternoon"],
+        "this_week": ["this week", "soon", "quickly"],
+    }
+    
+    # Keyword tuples per group, built once when the class loads
+    _GROUP_KEYWORDS = {group: tuple(words) for group, words in KEYWORD_GROUPS.items()}
+    
     TRIAGE_PROMPT_TEMPLATE = """Analyze this customer message for a home services business and extract structured information.
 
 FROM: {sender}
@@ -42,21 +71,17 @@ JSON only, no markdown:"""
         Triage a message using direct Claude API call.
         For POC, we'll use a simplified inline approach.
         """
-        sender = message.get("from", "Unknown")
         subject = message.get("subject", "(no subject)")
         body = message.get("text") or message.get("preview", "")
         
-        prompt = self.TRIAGE_PROMPT_TEMPLATE.format(
-            sender=sender,
-            subject=subject,
-            body=body[:2000]
-        )
-        
         # For POC: Return mock intelligent triage
-        # In production, this would call Claude via OpenClaw's sessions_send or similar
+        # In production, this would call Claude via OpenClaw's sessions_send or similar,
+        # with TRIAGE_PROMPT_TEMPLATE filled in from the message
         
         # Enhanced rule-based logic as fallback for now
         full_text = f"{subject} {body}".lower()
+        contains = full_text.__contains__
+        keywords = self._GROUP_KEYWORDS  # any(map(...)) stops at the first keyword found
         
         triage = {
             "intent": "other",
@@ -68,43 +93,43 @@ JSON only, no markdown:"""
         }
         
         # Intent detection (order matters - check complaints before bookings)
-        if any(word in full_text for word in ["complaint", "unhappy", "disappointed", "didn't show", "late", "never showed", "no show"]):
+        if any(map(contains, keywords["complaint"])):
             triage["intent"] = "complaint"
             triage["confidence"] = "high"
-        elif any(word in full_text for word in ["emergency", "urgent", "asap", "immediately", "critical"]):
+        elif any(map(contains, keywords["urgent"])):
             triage["intent"] = "urgent"
             triage["confidence"] = "high"
-        elif any(word in full_text for word in ["book", "schedule", "appointment", "come out", "visit"]) and "didn't" not in full_text and "never" not in full_text:
+        elif any(map(contains, keywords["booking"])) and not any(map(contains, keywords["didnt"])) and not any(map(contains, keywords["never"])):
             triage["intent"] = "booking"
             triage["confidence"] = "high"
-        elif any(word in full_text for word in ["how much", "cost", "price", "question", "?"]):
+        elif any(map(contains, keywords["question"])):
             triage["intent"] = "question"
             triage["confidence"] = "medium"
-        elif any(word in full_text for word in ["unsubscribe", "spam", "marketing", "click here"]):
+        elif any(map(contains, keywords["spam"])):
             triage["intent"] = "spam"
             triage["confidence"] = "high"
         
         # Service type detection
-        if any(word in full_text for word in ["ac ", "air condition", "hvac", "heat", "furnace", "cooling"]):
-            if any(word in full_text for word in ["broken", "not working", "stopped", "repair", "fix"]):
+        if any(map(contains, keywords["hvac"])):
+            if any(map(contains, keywords["hvac_repair"])):
                 triage["service_type"] = "hvac_repair"
             else:
                 triage["service_type"] = "hvac_maintenance"
-        elif any(word in full_text for word in ["plumb", "leak", "drain", "pipe", "toilet", "sink", "water"]):
-            triage["service_type"] = "plumbing_repair" if any(word in full_text for word in ["leak", "broken", "clog"]) else "plumbing_maintenance"
-        elif any(word in full_text for word in ["electric", "wiring", "outlet", "breaker", "power"]):
+        elif any(map(contains, keywords["plumbing"])):
+            triage["service_type"] = "plumbing_repair" if any(map(contains, keywords["plumbing_repair"])) else "plumbing_maintenance"
+        elif any(map(contains, keywords["electrical"])):
             triage["service_type"] = "electrical"
-        elif any(word in full_text for word in ["clean", "maid", "house"]):
+        elif any(map(contains, keywords["cleaning"])):
             triage["service_type"] = "cleaning"
-        elif any(word in full_text for word in ["lawn", "grass", "landscape", "yard"]):
+        elif any(map(contains, keywords["landscaping"])):
             triage["service_type"] = "landscaping"
         
         # Urgency detection
-        if any(word in full_text for word in ["emergency", "asap", "immediately", "critical", "dangerous"]):
+        if any(map(contains, keywords["emergency"])):
             triage["urgency"] = "emergency"
-        elif any(word in full_text for word in ["today", "right now", "this morning", "this afternoon"]):
+        elif any(map(contains, keywords["today"])):
             triage["urgency"] = "today"
-        elif any(word in full_text for word in ["this week", "soon", "quickly"]):
+        elif any(map(contains, keywords["this_week"])):
             triage["urgency"] = "this_week"
         
         # Build better summary
@@ -117,39 +142,40 @@ JSON only, no markdown:"""
         return triage
 
 
+TEST_MESSAGES = [
+    {
+        "from": "john.smith@email.com",
+        "subject": "AC not working - need help today!",
+        "text": "Hi, my air conditioner stopped working this morning and it's supposed to be 95 degrees today. Can someone come out as soon as possible? I'm at 123 Main Street. Thanks!"
+    },
+    {
+        "from": "jane.doe@email.com",
+        "subject": "Question about maintenance plans",
+        "text": "Hi, I saw on your website you offer annual maintenance plans. How much do they cost and what's included?"
+    },
+    {
+        "from": "bob.jones@email.com",
+        "subject": "Very disappointed",
+        "text": "I scheduled an appointment for today between 2-4pm and nobody showed up. I took time off work for this."
+    },
+    {
+        "from": "spam@marketing.com",
+        "subject": "Best HVAC deals!",
+        "text": "Click here for amazing discounts! Unsubscribe at bottom."
+    }
+]
+
+
 def test_triage():
     """Test the triage system"""
     
-    test_messages = [
-        {
-            "from": "john.smith@email.com",
-            "subject": "AC not working - need help today!",
-            "text": "Hi, my air conditioner stopped working this morning and it's supposed to be 95 degrees today. Can someone come out as soon as possible? I'm at 123 Main Street. Thanks!"
-        },
-        {
-            "from": "jane.doe@email.com",
-            "subject": "Question about maintenance plans",
-            "text": "Hi, I saw on your website you offer annual maintenance plans. How much do they cost and what's included?"
-        },
-        {
-            "from": "bob.jones@email.com",
-            "subject": "Very disappointed",
-            "text": "I scheduled an appointment for today between 2-4pm and nobody showed up. I took time off work for this."
-        },
-        {
-            "from": "spam@marketing.com",
-            "subject": "Best HVAC deals!",
-            "text": "Click here for amazing discounts! Unsubscribe at bottom."
-        }
-    ]
-    
     print("Testing OpenClaw Triage System")
     print("=" * 60)
     print()
     
     triage = OpenClawTriage()
     
-    for i, message in enumerate(test_messages, 1):
+    for i, message in enumerate(TEST_MESSAGES, 1):
         print(f"Test Message {i}")
         print(f"From: {message['from']}")
         print(f"Subject: {message['subject']}")
@@ -164,5 +190,105 @@ def test_triage():
         print()
 
 
+def _reference_triage(message: Dict) -> Dict:
+    """The rule engine as it was before KEYWORD_GROUPS (inline keyword lists, one any() scan per decision)"""
+    subject = message.get("subject", "(no subject)")
+    body = message.get("text") or message.get("preview", "")
+    full_text = f"{subject} {body}".lower()
+    
+    triage = {
+        "intent": "other",
+        "service_type": "other",
+        "urgency": "flexible",
+        "confidence": "medium",
+        "summary": subject[:100] if subject else body[:100],
+        "reasoning": "Rule-based classification"
+    }
+    
+    if any(word in full_text for word in ["complaint", "unhappy", "disappointed", "didn't show", "late", "never showed", "no show"]):
+        triage["intent"] = "complaint"
+        triage["confidence"] = "high"
+    elif any(word in full_text for word in ["emergency", "urgent", "asap", "immediately", "critical"]):
+        triage["intent"] = "urgent"
+        triage["confidence"] = "high"
+    elif any(word in full_text for word in ["book", "schedule", "appointment", "come out", "visit"]) and "didn't" not in full_text and "never" not in full_text:
+        triage["intent"] = "booking"
+        triage["confidence"] = "high"
+    elif any(word in full_text for word in ["how much", "cost", "price", "question", "?"]):
+        triage["intent"] = "question"
+        triage["confidence"] = "medium"
+    elif any(word in full_text for word in ["unsubscribe", "spam", "marketing", "click here"]):
+        triage["intent"] = "spam"
+        triage["confidence"] = "high"
+    
+    if any(word in full_text for word in ["ac ", "air condition", "hvac", "heat", "furnace", "cooling"]):
+        if any(word in full_text for word in ["broken", "not working", "stopped", "repair", "fix"]):
+            triage["service_type"] = "hvac_repair"
+        else:
+            triage["service_type"] = "hvac_maintenance"
+    elif any(word in full_text for word in ["plumb", "leak", "drain", "pipe", "toilet", "sink", "water"]):
+        triage["service_type"] = "plumbing_repair" if any(word in full_text for word in ["leak", "broken", "clog"]) else "plumbing_maintenance"
+    elif any(word in full_text for word in ["electric", "wiring", "outlet", "breaker", "power"]):
+        triage["service_type"] = "electrical"
+    elif any(word in full_text for word in ["clean", "maid", "house"]):
+        triage["service_type"] = "cleaning"
+    elif any(word in full_text for word in ["lawn", "grass", "landscape", "yard"]):
+        triage["service_type"] = "landscaping"
+    
+    if any(word in full_text for word in ["emergency", "asap", "immediately", "critical", "dangerous"]):
+        triage["urgency"] = "emergency"
+    elif any(word in full_text for word in ["today", "right now", "this morning", "this afternoon"]):
+        triage["urgency"] = "today"
+    elif any(word in full_text for word in ["this week", "soon", "quickly"]):
+        triage["urgency"] = "this_week"
+    
+    if triage["intent"] != "other":
+        triage["summary"] = f"{triage['intent'].title()} request for {triage['service_type'].replace('_', ' ')}, urgency: {triage['urgency']}"
+    triage["reasoning"] = f"Detected {triage['intent']} intent based on keywords. Service type: {triage['service_type']}. Urgency: {triage['urgency']}."
+    return triage
+
+
+def test_keyword_parity():
+    """Check triage_message output and speed against the original implementation on a fixed corpus"""
+    import os
+    import timeit
+    
+    print("Testing keyword table parity")
+    print("=" * 60)
+    
+    messages = list(TEST_MESSAGES)
+    messages += [
+        {"subject": "", "text": ""},
+        {"subject": "No show", "text": "The technician never showed and didn't call"},
+        {"subject": "No heat", "text": "Furnace is broken, please come out asap!"},
+        {"subject": "Leak", "text": "Leaking pipe under the sink, water everywhere"},
+        {"subject": "Power", "text": "Breaker keeps tripping, outlet has no power this week"},
+        {"subject": "Quote", "text": "Can you quote lawn and yard cleanup? need it soon"},
+        {"subject": "Re: visit", "preview": "I'd like to book a visit, never mind the AC "},
+    ]
+    corpus_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "triage_corpus.jsonl")
+    if os.path.exists(corpus_path):
+        with open(corpus_path, encoding="utf-8") as f:
+            messages += [json.loads(line) for line in f if line.strip()]
+    
+    triage = OpenClawTriage()
+    for message in messages:
+        actual = triage.triage_message(message)
+        expected = _reference_triage(message)
+        assert actual == expected, f"{message.get('subject')!r}: {actual} != {expected}"
+    
+    print(f"✅ {len(messages)} messages triaged identically to the original implementation")
+    
+    # The table-driven engine must not be slower, on short or 50x-long bodies
+    long_messages = [dict(message, text=(message.get("text") or message.get("preview", "")) * 50) for message in messages]
+    for label, batch in (("short", messages), ("long", long_messages)):
+        actual = min(timeit.repeat(lambda: [triage.triage_message(message) for message in batch], number=10, repeat=5))
+        expected = min(timeit.repeat(lambda: [_reference_triage(message) for message in batch], number=10, repeat=5))
+        assert actual <= expected * 1.1, f"{label}: {actual:.4f}s vs {expected:.4f}s"
+        print(f"✅ {label} bodies: {actual * 1000:.1f} ms vs {expected * 1000:.1f} ms for the original")
+    print()
+
+
 if __name__ == "__main__":
+    test_keyword_parity()
     test_triage()
@@ -10,52 +10,369 @@ v2: Integrated improved OpenClaw-based triage system.
 
 import os
 import sys
+import argparse
 import json
+import random
+import signal
+import threading
+import time
 import requests
-from datetime import datetime
-from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parseaddr
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 # Add current directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from openclaw_triage import OpenClawTriage
 from calendar_manager import CalendarManager
+from conversation_store import ConversationStore
+from triage_cache import TriageCache, engine_version, message_fingerprint
+from send_ledger import SendLedger
+from send_pipeline import SendPipeline
+from slot_reply import is_reply, is_urgent, parse_slot_choice, reply_text
+from work_queue import WorkQueue
+from metrics import METRICS, start_metrics_server
+from structured_log import DEBUG, ERROR, INFO, WARNING, log_enabled, log_event, setup_logging
 
 # Configuration
 AGENTMAIL_API_KEY = os.getenv("AGENTMAIL_API_KEY")
 AGENTMAIL_EMAIL = os.getenv("AGENTMAIL_EMAIL")
-AGENTMAIL_BASE_URL = "https://api.agentmail.to/v0"
+AGENTMAIL_BASE_URL = os.getenv("AGENTMAIL_BASE_URL", "https://api.agentmail.to/v0")  # override for a local stand-in
+
+
+def _message_time(message: Dict) -> Optional[datetime]:
+    """Parse a message's ISO 8601 timestamp as naive UTC (None if missing)"""
+    value = message.get("timestamp") or message.get("created_at")
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _message_key(message: Dict) -> str:
+    """Stable identity for a message: its id, or a content fingerprint without one"""
+    return message.get("message_id") or message_fingerprint(message)
+
+
+class InboxWatermark:
+    """
+    Durable high-water mark for incremental inbox sync.
+    
+    Stores the newest processed message timestamp plus the ids seen at
+    exactly that timestamp (so ties are not reprocessed or dropped).
+    Messages without a usable timestamp are remembered by id (the most
+    recent UNTIMED_LIMIT of them). A message that fails is parked in a
+    retry list instead of holding the watermark back, and is dropped
+    after MAX_ATTEMPTS failures. Saved as a small JSON file, replaced
+    atomically on every advance (kept in memory only when path is None).
+    
+    When a poll handles only part of what it fetched, the rest is kept as
+    a backlog (in memory and in state(), not in the file) so the next
+    polls can work through it without paging the inbox again.
+    """
+    
+    UNTIMED_LIMIT = 1000
+    MAX_ATTEMPTS = 5
+    
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.timestamp: Optional[datetime] = None
+        self.ids: set = set()
+        self.untimed: List[str] = []
+        self.retry: Dict[str, Dict] = {}  # key -> {"message", "attempts"}
+        self.backlog: List[Dict] = []  # fetched but not yet handled, oldest first
+        
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.restore(json.load(f))
+    
+    def state(self) -> Dict:
+        """JSON-serialisable sync state (what the file holds, plus the backlog)"""
+        return {
+            "timestamp": self.timestamp.isoformat() if self.timestamp else None,
+            "ids": sorted(i for i in self.ids if i),
+            "untimed": list(self.untimed),
+            "retry": dict(self.retry),
+            "backlog": list(self.backlog)
+        }
+    
+    def restore(self, state: Dict):
+        """Load state produced by state()"""
+        self.timestamp = datetime.fromisoformat(state["timestamp"]) if state.get("timestamp") else None
+        self.ids = set(state.get("ids", []))
+        self.untimed = list(state.get("untimed", []))
+        self.retry = dict(state.get("retry", {}))
+        self.backlog = list(state.get("backlog", []))
+    
+    def is_new(self, message: Dict) -> bool:
+        """True if the message is newer than the watermark"""
+        sent_at = _message_time(message)
+        if sent_at is None:
+            key = _message_key(message)
+            return key not in self.untimed and key not in self.retry
+        if self.timestamp is None or sent_at > self.timestamp:
+            return True
+        return sent_at == self.timestamp and message.get("message_id") not in self.ids
+    
+    def retries(self) -> List[Dict]:
+        """Messages that failed earlier and are due another attempt"""
+        return [entry["message"] for entry in self.retry.values()]
+    
+    def pending(self) -> List[Dict]:
+        """Backlog messages still newer than the watermark, oldest first"""
+        return [message for message in self.backlog if self.is_new(message)]
+    
+    def advance(self, messages: List[Dict], failed: List[Dict] = ()):
+        """
+        Move the watermark past the given messages and persist it.
+        
+        Args:
+            messages: Messages fetched this poll (handled or not)
+            failed: Those among them that failed; they are retried on later
+                polls without holding the watermark back
+        """
+        for message in messages:
+            sent_at = _message_time(message)
+            if sent_at is None:
+                key = _message_key(message)
+                if key not in self.untimed:
+                    self.untimed.append(key)
+                continue
+            if self.timestamp is None or sent_at > self.timestamp:
+                self.timestamp = sent_at
+                self.ids = set()
+            if sent_at == self.timestamp:
+                self.ids.add(message.get("message_id"))
+        del self.untimed[:-self.UNTIMED_LIMIT]
+        
+        failed_keys = {_message_key(message) for message in failed}
+        for message in messages:
+            key = _message_key(message)
+            if key not in failed_keys:
+                self.retry.pop(key, None)
+        for message in failed:
+            key = _message_key(message)
+            attempts = self.retry.get(key, {"attempts": 0})["attempts"] + 1
+            if attempts >= self.MAX_ATTEMPTS:
+                self.retry.pop(key, None)
+                log_event("message_abandoned", level=ERROR, message_id=message.get("message_id"), attempts=attempts)
+            else:
+                self.retry[key] = {"message": message, "attempts": attempts}
+        
+        if not self.path:
+            return
+        
+        state = self.state()
+        del state["backlog"]  # refetched after a restart
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+
+class SeenMessages:
+    """
+    Bounded, thread-safe set of recently handled message ids.
+    
+    Shared by the poller and the webhook server so a message that arrives
+    both ways is only triaged and routed once.
+    """
+    
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._ids: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def add(self, message: Dict) -> bool:
+        """Record a message; returns False if it was already seen"""
+        message_id = message.get("message_id")
+        if not message_id:
+            return True
+        
+        with self._lock:
+            if message_id in self._ids:
+                return False
+            self._ids[message_id] = True
+            if len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+            return True
+    
+    def discard(self, message: Dict):
+        """Forget a message so it is picked up again (e.g. after a failure)"""
+        with self._lock:
+            self._ids.pop(message.get("message_id"), None)
+
+
+def _never_sent(error: requests.exceptions.RequestException) -> bool:
+    """True if the request failed before reaching the server (safe to resend a POST)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
 
 class AgentmailClient:
-    """Simple Agentmail API client"""
+    """
+    Simple Agentmail API client.
+    
+    Holds one pooled keep-alive HTTP session for all calls, and retries
+    429/5xx responses with exponential backoff + jitter (honouring
+    Retry-After when the server sends it). POSTs are only retried when
+    they cannot have reached the server (connect errors, 429) unless they
+    carry an Idempotency-Key header, so a reply is never sent twice.
+    """
     
-    def __init__(self, api_key: str, inbox_id: str):
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+    
+    def __init__(
+        self,
+        api_key: str,
+        inbox_id: str,
+        base_url: str = AGENTMAIL_BASE_URL,
+        pool_size: int = 10,
+        timeout: Union[float, Tuple[float, float]] = (5, 30),
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0
+    ):
+        """
+        Args:
+            api_key: Agentmail API key
+            inbox_id: Inbox address
+            base_url: API root (override to point at a local stand-in)
+            pool_size: Max pooled connections kept alive (match worker count)
+            timeout: Default per-call timeout, seconds or (connect, read)
+            max_retries: Retries after the first attempt on 429/5xx/connection errors
+                (429/connect errors only, for non-idempotent requests)
+            backoff_base: First retry delay in seconds, doubled each retry
+            backoff_max: Cap on any single retry delay
+        """
         self.api_key = api_key
         self.inbox_id = inbox_id
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
     
-    def get_messages(self, limit: int = 10) -> List[Dict]:
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Seconds to wait before retry number `attempt` (0-based)"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass  # HTTP-date form; fall back to backoff
+        
+        # Full jitter: uniform over [0, base * 2^attempt]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    def _request(self, method: str, url: str, timeout=None, **kwargs) -> requests.Response:
+        """
+        Send a request through the pooled session, retrying transient failures.
+        
+        Raises:
+            requests.exceptions.RequestException: once retries are exhausted
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS or "Idempotency-Key" in kwargs.get("headers", {})
+        retry_statuses = self.RETRY_STATUSES if idempotent else {429}
+        
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+                if response.status_code not in retry_statuses or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries or not (idempotent or _never_sent(e)):
+                    raise
+            
+            time.sleep(self._retry_delay(attempt, response))
+    
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
+    
+    def get_messages(self, limit: int = 10, timeout=None) -> List[Dict]:
         """Fetch recent messages from inbox"""
-        url = f"{AGENTMAIL_BASE_URL}/inboxes/{self.inbox_id}/messages"
+        url = f"{self.base_url}/inboxes/{self.inbox_id}/messages"
         params = {"limit": limit}
         
-        response = requests.get(url, headers=self.headers, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        with METRICS.timer("get_messages"):
+            response = self._request("GET", url, params=params, timeout=timeout)
+            data = response.json()
         return data.get("messages", [])
     
+    def get_new_messages(self, watermark: InboxWatermark, page_size: int = 50, timeout=None) -> List[Dict]:
+        """
+        Fetch every message newer than the watermark, paging as needed.
+        
+        Pages are fetched newest-first and paging stops at the first page
+        that reaches already-seen mail, so each poll costs roughly one
+        request per page_size new messages regardless of inbox size.
+        
+        Args:
+            watermark: Sync state from the previous run
+            page_size: Messages per API request
+            
+        Returns:
+            New messages, oldest first
+        """
+        url = f"{self.base_url}/inboxes/{self.inbox_id}/messages"
+        params = {"limit": page_size}
+        if watermark.timestamp is not None:
+            params["after"] = watermark.timestamp.isoformat() + "Z"
+        
+        new_messages = []
+        while True:
+            with METRICS.timer("get_messages"):
+                response = self._request("GET", url, params=params, timeout=timeout)
+                data = response.json()
+            page = data.get("messages", [])
+            fresh = [message for message in page if watermark.is_new(message)]
+            new_messages.extend(fresh)
+            
+            next_page_token = data.get("next_page_token")
+            if not next_page_token or len(fresh) < len(page):
+                break
+            params["page_token"] = next_page_token
+        
+        new_messages.sort(key=lambda m: _message_time(m) or datetime.min)
+        return new_messages
+    
     def mark_as_read(self, message_id: str):
         """Mark message as read"""
         # Note: Check Agentmail API docs for actual endpoint
         # This is a placeholder
         pass
     
-    def send_reply(self, to: str, subject: str, text: str, html: Optional[str] = None):
+    def send_reply(self, to: str, subject: str, text: str, html: Optional[str] = None, timeout=None):
         """Send email reply"""
-        url = f"{AGENTMAIL_BASE_URL}/inboxes/{self.inbox_id}/messages/send"
+        url = f"{self.base_url}/inboxes/{self.inbox_id}/messages/send"
         
         payload = {
             "to": to,
@@ -67,45 +384,323 @@ class AgentmailClient:
             payload["html"] = html
         
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            return response.json()
+            with METRICS.timer("send_reply"):
+                response = self._request("POST", url, json=payload, timeout=timeout)
+                return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error sending email: {e}")
+            log_event("send_error", level=ERROR, to=to, error=str(e))
+            METRICS.inc("send_errors_total")
             return None
 
 
 class MessageTriage:
-    """AI-powered message triage using OpenClaw integration"""
+    """
+    AI-powered message triage using OpenClaw integration.
+    
+    Modes:
+        "rules":  OpenClaw rule engine only (default)
+        "tiered": rule engine first; messages it classifies below
+                  `min_confidence`, or as intent "other", are escalated
+                  to the LLM engine (ClaudeTriage unless one is passed in).
+                  If the LLM call fails the rule engine's answer is used
+                  and nothing is cached, so the next attempt asks again.
+    
+    With stream_early, escalated messages are triaged from the LLM's
+    streamed answer: once it has produced intent and urgency, an
+    emergency is returned for routing straight away (other fields taken
+    from the rule engine) while the rest of the answer finishes in the
+    background and goes to the cache. Anything else waits for the full
+    answer, since booking and replies need the remaining fields. If the
+    early fields don't arrive in time the rule engine's answer is used and
+    the full answer still goes to the cache; close() waits for those.
+    """
     
-    def __init__(self):
+    CONFIDENCE_RANK = {"low": 0, "medium": 1, "high": 2}
+    
+    def __init__(
+        self,
+        cache: Optional[TriageCache] = None,
+        mode: str = "rules",
+        llm_engine=None,
+        min_confidence: str = "high",
+        stream_early: bool = False
+    ):
+        if mode not in ("rules", "tiered"):
+            raise ValueError(f"Unknown triage mode: {mode}")
+        if min_confidence not in self.CONFIDENCE_RANK:
+            raise ValueError(f"Unknown confidence level: {min_confidence}")
+        
         self.triage_engine = OpenClawTriage()
+        self.mode = mode
+        self.min_confidence = min_confidence
+        self.llm_engine = llm_engine
+        self.stream_early = stream_early
+        if mode == "tiered" and self.llm_engine is None:
+            from claude_triage import ClaudeTriage  # needs anthropic; only import when used
+            self.llm_engine = ClaudeTriage()
+        
+        self.cache = cache
+        self.cache_version = engine_version(self.triage_engine)
+        if mode == "tiered":
+            self.cache_version = f"tiered:{min_confidence}:{self.cache_version}+{engine_version(self.llm_engine)}"
+        
+        # How many messages each tier answered
+        self.tier_counts = {"rules": 0, "llm": 0}
+        self._tier_lock = threading.Lock()
     
     def triage_message(self, message: Dict) -> Dict:
         """
         Perform AI triage on a message using OpenClaw's improved logic.
+        Results are served from / stored in the cache when one is configured.
         """
-        return self.triage_engine.triage_message(message)
+        with METRICS.timer("triage_message"):
+            return self._triage(message)
+    
+    def _triage(self, message: Dict) -> Dict:
+        if self.cache is not None:
+            cached = self.cache.get(message, self.cache_version)
+            if cached is not None:
+                METRICS.inc("triage_total", source="cache")
+                return cached
+        
+        triage = self.triage_engine.triage_message(message)
+        tier = "rules"
+        pending = None
+        llm_failed = False
+        
+        if self.mode == "tiered" and self._needs_escalation(triage):
+            with METRICS.timer("llm_triage"):
+                if self.stream_early:
+                    llm_triage, pending = self._llm_triage_early(message, triage)
+                else:
+                    llm_triage = self.llm_engine.triage_message(message)
+            if llm_triage.get("fallback"):
+                # The LLM call failed: act on the rule engine's answer and ask again next time
+                llm_failed = True
+                METRICS.inc("llm_triage_failures_total")
+                log_event("llm_triage_fallback", level=WARNING, message_id=message.get("message_id"), reason=llm_triage.get("reasoning"))
+            else:
+                triage, tier = llm_triage, "llm"
+        
+        with self._tier_lock:
+            self.tier_counts[tier] += 1
+        METRICS.inc("triage_total", source=tier)
+        
+        if pending is not None:
+            pending.add_done_callback(lambda future: self._finish_early(message, future))
+        elif self.cache is not None and not llm_failed:
+            self.cache.put(message, self.cache_version, triage)  # skips partial LLM answers
+        return triage
+    
+    def _llm_triage_early(self, message: Dict, rules_triage: Dict) -> Tuple[Dict, Optional[Future]]:
+        """
+        Streamed LLM triage that returns early for emergencies.
+        
+        Returns:
+            (triage, pending): pending is the future for the full answer when
+            triage is only the early part of it or timed out, else None
+        """
+        early, future = self.llm_engine.triage_message_early(message)
+        if not early:
+            # Timed out: handled like a failed call, but the late answer is still cached
+            return {"fallback": True, "reasoning": "LLM triage timed out"}, future
+        if future.done() or early.get("urgency") != "emergency":
+            return future.result(), None
+        
+        METRICS.inc("llm_early_routes_total")
+        triage = dict(rules_triage, **early)
+        triage["partial"] = True
+        return triage, future
+    
+    def _finish_early(self, message: Dict, future: Future):
+        """Cache and log the full LLM answer behind an early-routed emergency"""
+        if future.exception() is not None:
+            log_event("llm_triage_failed", level=ERROR, message_id=message.get("message_id"), error=str(future.exception()))
+            return
+        triage = future.result()
+        if self.cache is not None and not triage.get("fallback"):
+            self.cache.put(message, self.cache_version, triage)
+        log_event("llm_triage_finished", level=DEBUG, message_id=message.get("message_id"), triage=triage)
+    
+    def close(self):
+        """Wait for LLM answers still streaming in the background to reach the cache"""
+        if self.llm_engine is not None and hasattr(self.llm_engine, "close"):
+            self.llm_engine.close()
+    
+    def _needs_escalation(self, triage: Dict) -> bool:
+        """True if the rule engine's answer is too uncertain to act on"""
+        confidence = self.CONFIDENCE_RANK.get(triage.get("confidence"), 0)
+        return triage.get("intent") == "other" or confidence < self.CONFIDENCE_RANK[self.min_confidence]
+    
+    def tier_stats(self) -> Dict:
+        """Counts and traffic share per tier (cache hits are not counted)"""
+        with self._tier_lock:
+            counts = dict(self.tier_counts)
+        total = sum(counts.values())
+        return {
+            tier: {"count": count, "share": count / total if total else 0.0}
+            for tier, count in counts.items()
+        }
 
 
 class ActionRouter:
     """Routes triaged messages to appropriate actions"""
     
-    def __init__(self, client: AgentmailClient, calendar: CalendarManager):
+    def __init__(
+        self,
+        client: AgentmailClient,
+        calendar: CalendarManager,
+        ledger: Optional[SendLedger] = None,
+        outbox: Optional[SendPipeline] = None,
+        store: Optional[ConversationStore] = None
+    ):
         self.client = client
         self.calendar = calendar
+        self.ledger = ledger  # Optional: skip replies already sent for a message
+        self.outbox = outbox  # Optional: send replies in the background
+        self.store = store  # Optional: conversation history and open slot offers
         self.send_emails_enabled = False  # Safety default
+        self._collecting = threading.local()
+    
+    @contextmanager
+    def collect_sends(self):
+        """
+        Collect the outbox replies queued by this thread inside the block,
+        so a caller can wait for them to finish before acking its work.
+        
+        Yields:
+            List that fills with OutboundReply objects
+        """
+        replies = []
+        self._collecting.replies = replies
+        try:
+            yield replies
+        finally:
+            self._collecting.replies = None
+    
+    def _send_once(
+        self,
+        message: Dict,
+        action: str,
+        to: str,
+        subject: str,
+        text: str,
+        on_sent: Optional[Callable[[], None]] = None
+    ) -> Tuple[str, Optional[Dict]]:
+        """
+        Send a reply unless the ledger says this (message, action) was already answered.
+        
+        With an outbox the reply is only queued (the outbox checks the ledger).
+        on_sent runs once the reply has actually gone out, immediately or
+        from the outbox.
+        
+        Returns:
+            (status, send result) - status is "sent", "failed", "duplicate" or "queued"
+        """
+        if self.store is not None:
+            self.store.record_message(message, direction="outbound", content=text)
+        
+        if self.outbox is not None:
+            reply = self.outbox.submit(
+                message, action, to, subject, text,
+                on_sent=None if on_sent is None else (lambda reply: on_sent())
+            )
+            collected = getattr(self._collecting, "replies", None)
+            if collected is not None:
+                collected.append(reply)
+            return "queued", None
+        
+        if self.ledger is not None and self.ledger.has_sent(message, action):
+            return "duplicate", None
+        
+        result = self.client.send_reply(to, subject, text)
+        if not result:
+            return "failed", None
+        if self.ledger is not None:
+            self.ledger.record(message, action, to, result.get("message_id"))
+        if on_sent is not None:
+            on_sent()
+        return "sent", result
+    
+    def _send_if_enabled(
+        self,
+        message: Dict,
+        action: str,
+        to: str,
+        subject: str,
+        text: str,
+        on_sent: Optional[Callable[[], None]] = None
+    ) -> str:
+        """_send_once() status, or "disabled" when sending is switched off"""
+        if not self.send_emails_enabled:
+            return "disabled"
+        return self._send_once(message, action, to, subject, text, on_sent)[0]
+    
+    def _log_action(self, message: Dict, action: str, triage: Optional[Dict] = None, **fields):
+        """One "action" event per routed message (a warning if its reply failed to send)"""
+        level = WARNING if fields.get("send") == "failed" else INFO
+        if not log_enabled(level):
+            return
+        if triage is not None:
+            fields["summary"] = triage.get("summary")
+        log_event("action", level=level, message_id=message.get("message_id"), action=action, **fields)
+    
+    def match_slot_reply(self, message: Dict) -> Optional[Dict]:
+        """
+        Recognise a reply picking one of the slots we offered.
+        
+        Deterministic and cheap (an indexed offer lookup plus a regex parse),
+        so slot picks skip the triage engine entirely. Only replies to the
+        offer (same thread, or a "Re:" subject) count, and a reply that
+        mentions an emergency always goes to triage so it is escalated.
+        
+        Returns:
+            Triage-shaped dict with intent "slot_selection", or None to fall
+            back to normal triage
+        """
+        if self.store is None:
+            return None
+        text = reply_text(message)
+        if is_urgent(text):
+            return None
+        offer = self.store.pending_offer(message)
+        if offer is None or not is_reply(message, offer["thread_id"]):
+            return None
+        choice = parse_slot_choice(text, offer["slots"])
+        if choice is None:
+            return None
+        
+        return {
+            "intent": "slot_selection",
+            "urgency": "flexible",
+            "service_type": offer["service_type"],
+            "option": choice + 1,
+            "offer_id": offer["id"],
+            "summary": f"Customer picked option {choice + 1} of the offered slots",
+            "confidence": "high",
+            "method": "slot_reply"
+        }
     
     def route(self, message: Dict, triage: Dict) -> str:
         """
         Decide and execute action based on triage result.
         Returns action taken (for logging).
         """
+        with METRICS.timer("route"):
+            action = self._dispatch(message, triage)
+        METRICS.inc("route_actions_total", action=action)
+        return action
         
+    def _dispatch(self, message: Dict, triage: Dict) -> str:
         intent = triage.get("intent")
         urgency = triage.get("urgency")
         
-        if urgency == "emergency":
+        if self.store is not None:
+            self.store.record_message(message, triage=triage)
+        
+        if intent == "slot_selection":
+            return self._book_selected_slot(message, triage)
+        elif urgency == "emergency":
             return self._escalate_urgent(message, triage)
         elif intent == "booking":
             return self._handle_booking(message, triage)
@@ -120,8 +715,6 @@ class ActionRouter:
     
     def _escalate_urgent(self, message: Dict, triage: Dict) -> str:
         """Escalate urgent requests to human immediately"""
-        print(f"🔴 URGENT ESCALATION: {triage.get('summary')}")
-        
         # Send auto-reply acknowledging urgency
         sender = message.get("from", "unknown")
         subject = f"Re: {message.get('subject', 'Your urgent request')}"
@@ -137,40 +730,29 @@ Summary of your request: {triage.get('summary')}
 Best regards,
 Customer Service Team"""
         
-        if self.send_emails_enabled:
-            result = self.client.send_reply(sender, subject, text)
-            if result:
-                print(f"   → ✅ Auto-reply sent to {sender} (message_id: {result.get('message_id', 'unknown')})")
-            else:
-                print(f"   → ❌ Failed to send auto-reply to {sender}")
-        else:
-            print(f"   → 📧 Would send auto-reply to {sender} (emails disabled)")
-        print(f"   → TODO: Alert business owner via SMS/phone")
+        status = self._send_if_enabled(message, "escalated_urgent", sender, subject, text)
+        # TODO: Alert business owner via SMS/phone
+        self._log_action(message, "escalated_urgent", triage, to=sender, send=status)
         
         return "escalated_urgent"
     
     def _handle_booking(self, message: Dict, triage: Dict) -> str:
         """Handle booking request with real calendar availability"""
-        print(f"📅 BOOKING REQUEST: {triage.get('summary')}")
-        
         sender = message.get("from", "unknown")
         service_type = triage.get("service_type", "service")
         urgency = triage.get("urgency", "flexible")
         
-        # Get real available slots from calendar
-        available_slots = self.calendar.get_next_available_slots(count=4, urgency=urgency)
+        # Get real available slots from calendar (lazy scan, stops after 4 free slots)
+        with METRICS.timer("get_next_available_slots"):
+            available_slots = self.calendar.get_next_available_slots(count=4, urgency=urgency)
         
         if not available_slots:
-            print(f"   → No availability found for urgency: {urgency}")
+            self._log_action(message, "no_availability", triage, urgency=urgency)
             return "no_availability"
         
         # Format slots for customer
-        formatted_slots = []
-        for i, slot in enumerate(available_slots, 1):
-            formatted = self.calendar.format_slot_for_customer(slot)
-            formatted_slots.append(f"• Option {i}: {formatted}")
-        
-        slots_text = "\n".join(formatted_slots)
+        slot_labels = [self.calendar.format_slot_for_customer(slot) for slot in available_slots]
+        slots_text = "\n".join(f"• Option {i}: {label}" for i, label in enumerate(slot_labels, 1))
         
         text = f"""Thank you for your {service_type.replace('_', ' ')} request.
 
@@ -185,104 +767,662 @@ For urgent matters, you can also call us directly at: [BUSINESS_PHONE]
 Best regards,
 Scheduling Team"""
         
-        if self.send_emails_enabled:
-            result = self.client.send_reply(sender, f"Re: {message.get('subject')}", text)
-            if result:
-                print(f"   → ✅ {len(available_slots)} availability options sent to {sender}")
-            else:
-                print(f"   → ❌ Failed to send availability options to {sender}")
-        else:
-            print(f"   → 📧 Would send {len(available_slots)} availability options to {sender} (emails disabled)")
-        print(f"   → Slots offered: {', '.join([self.calendar.format_slot_for_customer(s) for s in available_slots])}")
+        def record_offer():
+            # Only an offer the customer actually received can be picked from
+            self.store.record_slot_offer(message, available_slots, service_type)
+        
+        status = self._send_if_enabled(
+            message, "booking_options_sent", sender, f"Re: {message.get('subject')}", text,
+            on_sent=record_offer if self.store is not None else None
+        )
+        self._log_action(message, "booking_options_sent", triage, to=sender, send=status, slots=slot_labels)
         
         return "booking_options_sent"
     
+    def _book_selected_slot(self, message: Dict, triage: Dict) -> str:
+        """Book the slot a customer picked from an earlier offer and confirm it"""
+        offer = self.store.pending_offer(message) if self.store is not None else None
+        if offer is None or offer["id"] != triage.get("offer_id"):
+            appointment = self.store.appointment_for_offer(triage["offer_id"]) if self.store is not None else None
+            if appointment is not None:
+                # A retry after the slot was booked: only the confirmation may be missing
+                return self._confirm_booking(message, triage, appointment)
+            log_event("offer_closed", level=WARNING, message_id=message.get("message_id"), option=triage.get("option"))
+            return self._escalate_unknown(message, triage)
+        
+        slot = offer["slots"][triage["option"] - 1]
+        service_type = offer["service_type"] or "service"
+        if slot["start"] <= datetime.now():
+            # Picked too late: the slot has already started
+            booking = {"success": False, "error": "Slot is in the past"}
+        else:
+            name, email = parseaddr(message.get("from", ""))
+            booking = self.calendar.book_appointment(
+                slot["start"], slot["duration_minutes"], name or email, email, service_type
+            )
+        
+        if not booking["success"]:
+            log_event("slot_taken", level=WARNING, message_id=message.get("message_id"),
+                      option=triage.get("option"), error=booking["error"])
+            self.store.close_offer(offer["id"], "expired")
+            return self._handle_booking(message, dict(triage, intent="booking"))
+        
+        self.store.close_offer(offer["id"], "accepted")
+        self.store.record_appointment(offer["conversation_id"], slot, service_type, booking["booking_id"], offer["id"])
+        return self._confirm_booking(message, triage, self.store.appointment_for_offer(offer["id"]))
+    
+    def _confirm_booking(self, message: Dict, triage: Dict, appointment: Dict) -> str:
+        """
+        Send the confirmation for a booked appointment, once.
+        
+        Its own step so that a route retry after a failed send confirms the
+        existing booking instead of treating the closed offer as unknown.
+        """
+        slot = appointment["slot"]
+        service_type = appointment["service_type"] or "service"
+        label = self.calendar.format_slot_for_customer(slot)
+        if appointment["confirmed_at"] is not None:
+            self._log_action(
+                message, "booking_confirmed", triage, send="duplicate",
+                slot=label, booking_id=appointment["calendar_event_id"]
+            )
+            return "booking_confirmed"
+        
+        sender = message.get("from", "unknown")
+        text = f"""You're booked!
+
+Your {service_type.replace('_', ' ')} appointment is confirmed for {label}.
+
+If you need to reschedule, just reply to this email or call us at: [BUSINESS_PHONE]
+
+Best regards,
+Scheduling Team"""
+        
+        status = self._send_if_enabled(
+            message, "booking_confirmed", sender, f"Re: {message.get('subject')}", text,
+            on_sent=lambda: self.store.mark_confirmed(appointment["id"])
+        )
+        self._log_action(
+            message, "booking_confirmed", triage, to=sender, send=status,
+            slot=label, booking_id=appointment["calendar_event_id"]
+        )
+        
+        return "booking_confirmed"
+    
     def _handle_question(self, message: Dict, triage: Dict) -> str:
         """Handle question - may need human review"""
-        print(f"❓ QUESTION: {triage.get('summary')}")
+        self._log_action(message, "escalated_for_review", triage)
         return "escalated_for_review"
     
     def _escalate_complaint(self, message: Dict, triage: Dict) -> str:
         """Escalate complaints to human"""
-        print(f"⚠️  COMPLAINT: {triage.get('summary')}")
+        self._log_action(message, "escalated_complaint", triage)
         return "escalated_complaint"
     
     def _mark_spam(self, message: Dict) -> str:
         """Mark as spam"""
-        print(f"🚫 SPAM: {message.get('subject')}")
+        self._log_action(message, "marked_spam", subject=message.get("subject"))
         return "marked_spam"
     
     def _escalate_unknown(self, message: Dict, triage: Dict) -> str:
         """Escalate unknown/unclear messages"""
-        print(f"🤔 UNKNOWN: {triage.get('summary')}")
+        self._log_action(message, "escalated_unknown", triage)
         return "escalated_unknown"
 
 
-def main():
+def process_message(message: Dict, triage_engine: MessageTriage, router: ActionRouter) -> Dict:
+    """
+    Triage and route a single message.
+    
+    Errors are caught and reported in the result so one bad message
+    cannot stall the rest of the batch.
+    
+    Returns:
+        Dict with triage, action and error (None on success)
+    """
+    try:
+        with METRICS.timer("process_message"):
+            triage = router.match_slot_reply(message) or triage_engine.triage_message(message)
+            action = router.route(message, triage)
+        return {"triage": triage, "action": action, "error": None}
+    except Exception as e:
+        METRICS.inc("process_errors_total")
+        return {"triage": None, "action": "error", "error": str(e)}
+
+
+def process_messages(
+    messages: List[Dict],
+    triage_engine: MessageTriage,
+    router: ActionRouter,
+    max_workers: int = 1
+) -> List[Dict]:
+    """
+    Triage and route a batch of messages, optionally in parallel.
+    
+    Args:
+        messages: Messages in inbox order
+        triage_engine: Triage engine shared by all workers
+        router: Action router shared by all workers
+        max_workers: Maximum messages in flight at once (1 = sequential)
+        
+    Returns:
+        One process_message() result per message, in inbox order
+    """
+    return _map_parallel(lambda message: process_message(message, triage_engine, router), messages, max_workers)
+
+
+def _map_parallel(func, items: List, max_workers: int = 1) -> List:
+    """map() over items, on a bounded thread pool when max_workers > 1 (order preserved)"""
+    if max_workers <= 1:
+        return [func(item) for item in items]
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(func, items))
+
+
+def enqueue_messages(work_queue: WorkQueue, messages: List[Dict]) -> int:
+    """
+    Stage fetched messages for triage.
+    
+    Each message is keyed by its id (or content hash), so re-fetching the
+    same mail after a restart never queues it twice.
+    
+    Returns:
+        Number of messages newly queued
+    """
+    queued = 0
+    for message in messages:
+        key = message.get("message_id") or message_fingerprint(message)
+        if work_queue.enqueue("triage", {"key": key, "message": message}, dedupe_key=key) is not None:
+            queued += 1
+    return queued
+
+
+def drain_work_queue(
+    work_queue: WorkQueue,
+    triage_engine: MessageTriage,
+    router: ActionRouter,
+    workers: int = 1,
+    batch_size: int = 20
+) -> int:
+    """
+    Run the triage and route stages until neither has due jobs.
+    
+    Triage hands its result to the route queue in the same transaction
+    that acks the triage job; route acks only after the action completes,
+    including any reply it queued on the outbox, so a failed send is
+    retried with the job. Failures are retried with backoff by the queue.
+    
+    Returns:
+        Number of messages routed
+    """
+    def triage_job(job):
+        try:
+            message = job.payload["message"]
+            triage = router.match_slot_reply(message) or triage_engine.triage_message(message)
+        except Exception as e:
+            if not work_queue.fail(job, str(e)):
+                log_event("job_lease_lost", level=WARNING, job_id=job.id, queue=job.queue)
+            return
+        if not work_queue.complete_and_enqueue(
+            job, "route", {"key": job.payload["key"], "message": job.payload["message"], "triage": triage},
+            dedupe_key=job.payload["key"]
+        ):
+            log_event("job_lease_lost", level=WARNING, job_id=job.id, queue=job.queue)
+    
+    def route_job(job):
+        message, triage = job.payload["message"], job.payload["triage"]
+        try:
+            with router.collect_sends() as replies:
+                action = router.route(message, triage)
+        except Exception as e:
+            return {"triage": triage, "action": "error", "error": str(e), "replies": []}
+        return {"triage": triage, "action": action, "error": None, "replies": replies}
+    
+    def settle(job, result):
+        # Queued replies are still being sent: wait for them before acking
+        for reply in result.pop("replies"):
+            reply.wait()
+            if reply.status == "failed" and not result["error"]:
+                result["error"] = f"{reply.action} reply to {reply.to} failed to send"
+        if result["error"]:
+            owned = work_queue.fail(job, result["error"])
+        else:
+            owned = work_queue.ack(job)
+        if not owned:
+            log_event("job_lease_lost", level=WARNING, job_id=job.id, queue=job.queue)
+    
+    while True:
+        jobs = work_queue.lease("triage", limit=batch_size)
+        if not jobs:
+            break
+        _map_parallel(triage_job, jobs, workers)
+    
+    routed = 0
+    while True:
+        jobs = work_queue.lease("route", limit=batch_size)
+        if not jobs:
+            break
+        results = _map_parallel(route_job, jobs, workers)
+        for job, result in zip(jobs, results):
+            settle(job, result)
+        report_results([job.payload["message"] for job in jobs], results)
+        routed += sum(1 for result in results if not result["error"])
+    
+    return routed
+
+
+def report_results(messages: List[Dict], results: List[Dict]):
+    """Log one "message" event per result, in inbox order (full triage at debug level)"""
+    if not log_enabled(INFO):
+        return
+    verbose = log_enabled(DEBUG)
+    for message, result in zip(messages, results):
+        fields = {
+            "message_id": message.get("message_id"),
+            "from": message.get("from"),
+            "subject": message.get("subject"),
+            "received": message.get("created_at") or message.get("timestamp"),
+            "action": result["action"]
+        }
+        if result["error"]:
+            log_event("message", level=ERROR, error=result["error"], **fields)
+            continue
+        
+        triage = result["triage"] or {}
+        if verbose:
+            fields["triage"] = triage
+        else:
+            fields.update(
+                intent=triage.get("intent"),
+                urgency=triage.get("urgency"),
+                confidence=triage.get("confidence"),
+                method=triage.get("method")
+            )
+        log_event("message", **fields)
+
+
+def poll_once(
+    client: AgentmailClient,
+    triage_engine: MessageTriage,
+    router: ActionRouter,
+    watermark: Optional[InboxWatermark] = None,
+    workers: int = 1,
+    seen: Optional[SeenMessages] = None,
+    work_queue: Optional[WorkQueue] = None,
+    max_messages: Optional[int] = None
+) -> int:
+    """
+    Fetch, triage and route one batch of mail.
+    
+    Args:
+        watermark: Incremental sync state, or None to fetch the newest 5 messages
+        workers: Messages triaged/routed concurrently
+        seen: Skip messages already handled elsewhere (e.g. via webhook)
+        work_queue: Durable queue between stages; messages are staged there
+            first and survive a crash mid-batch
+        max_messages: With a watermark, handle only the oldest this many new
+            messages; the rest stay ahead of the watermark and are kept as
+            its backlog, so later polls skip the inbox until it runs low
+        
+    Returns:
+        Number of new messages handled (queued, with a work queue)
+    """
+    if watermark is not None:
+        # Earlier failures first, then new mail (both oldest first). Pages
+        # come newest-first, so the oldest messages are only known after
+        # paging to the watermark: reuse that backlog while it fills a turn.
+        backlog = watermark.pending()
+        if max_messages is not None and len(backlog) >= max_messages:
+            new_messages = backlog
+        else:
+            new_messages = client.get_new_messages(watermark)
+        messages = watermark.retries() + new_messages
+        found = len(messages)
+        watermark.backlog = []
+        if max_messages is not None and len(messages) > max_messages:
+            watermark.backlog = [
+                message for message in messages[max_messages:] if _message_key(message) not in watermark.retry
+            ]
+            messages = messages[:max_messages]
+    else:
+        messages = client.get_messages(limit=5)
+        found = len(messages)
+    
+    fetched = messages
+    if seen is not None:
+        messages = [message for message in fetched if seen.add(message)]
+    log_event(
+        "fetch", mode="sync" if watermark is not None else "recent", found=found,
+        handling=len(messages), skipped_seen=len(fetched) - len(messages)
+    )
+    
+    if work_queue is not None:
+        # Once queued the messages are durable, so the watermark can move on
+        queued = enqueue_messages(work_queue, messages)
+        if watermark is not None:
+            watermark.advance(fetched)
+        log_event("queued", queued=queued, already_queued=len(messages) - queued)
+        drain_work_queue(work_queue, triage_engine, router, workers)
+        return queued
+    
+    if not messages:
+        if watermark is not None:
+            watermark.advance(fetched)
+        return 0
+    
+    # Triage and route (concurrently when workers > 1)
+    results = process_messages(messages, triage_engine, router, max_workers=workers)
+    report_results(messages, results)
+    
+    # Failures are retried on later polls; the watermark moves past everything
+    failed = [message for message, result in zip(messages, results) if result["error"]]
+    if seen is not None:
+        for message in failed:
+            seen.discard(message)
+    if watermark is not None:
+        watermark.advance(fetched, failed=failed)
+    
+    return len(messages)
+
+
+def next_poll_interval(current: float, found: int, min_interval: float, max_interval: float) -> float:
+    """Poll again quickly while mail is arriving; back off exponentially when idle"""
+    if found:
+        return min_interval
+    return min(max_interval, current * 2)
+
+
+def run_daemon(
+    client: AgentmailClient,
+    triage_engine: MessageTriage,
+    router: ActionRouter,
+    watermark: InboxWatermark,
+    workers: int = 1,
+    min_interval: float = 15,
+    max_interval: float = 120,
+    heartbeat_path: Optional[str] = None,
+    stop_event: Optional[threading.Event] = None,
+    seen: Optional[SeenMessages] = None,
+    work_queue: Optional[WorkQueue] = None,
+    metrics_path: Optional[str] = None,
+    purge_interval: float = 3600
+) -> int:
+    """
+    Poll the inbox until stopped, keeping clients and engines in memory.
+    
+    The interval drops to min_interval whenever a poll finds mail and
+    doubles (up to max_interval) while the inbox is idle. Keep max_interval
+    well under the 5 minute first-response budget. SIGTERM/SIGINT finish
+    the current poll and exit cleanly.
+    
+    Args:
+        heartbeat_path: File rewritten with a JSON status line after every poll
+        stop_event: Set to stop the loop (signal handlers set it too)
+        seen: Shared dedupe set when a webhook server also ingests mail
+        work_queue: Durable queue between fetch, triage and route
+        metrics_path: File rewritten with a JSON metrics snapshot after every poll
+        purge_interval: Seconds between purges of finished work_queue jobs
+        
+    Returns:
+        Process exit code
+    """
+    stop_event = stop_event or threading.Event()
+    
+    def request_stop(signum, frame):
+        log_event("stop_requested", level=WARNING, signal=signum)
+        stop_event.set()
+    
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+    
+    interval = min_interval
+    polls = 0
+    processed = 0
+    errors = 0
+    last_purge = None
+    
+    while not stop_event.is_set():
+        try:
+            with METRICS.timer("poll"):
+                found = poll_once(client, triage_engine, router, watermark, workers, seen, work_queue)
+        except Exception as e:
+            # Transient API trouble: keep running, but back off as if idle
+            log_event("poll_failed", level=ERROR, error=str(e))
+            found = 0
+            errors += 1
+        
+        polls += 1
+        processed += found
+        interval = next_poll_interval(interval, found, min_interval, max_interval)
+        
+        heartbeat = {
+            "time": datetime.now().isoformat(),
+            "polls": polls,
+            "messages_processed": processed,
+            "poll_errors": errors,
+            "next_poll_seconds": interval
+        }
+        if work_queue is not None:
+            if last_purge is None or time.monotonic() - last_purge >= purge_interval:
+                purged = work_queue.purge_done()
+                last_purge = time.monotonic()
+                if purged:
+                    log_event("queue_purged", jobs=purged)
+            heartbeat["queue_depth"] = work_queue.depth()
+        if router.outbox is not None:
+            heartbeat["outbound"] = router.outbox.stats()
+        log_event("heartbeat", **heartbeat)
+        if heartbeat_path:
+            tmp_path = f"{heartbeat_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(heartbeat, f)
+            os.replace(tmp_path, heartbeat_path)
+        if metrics_path:
+            METRICS.write_snapshot(metrics_path)
+        
+        stop_event.wait(interval)
+    
+    log_event("daemon_stopped", polls=polls, messages_processed=processed)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None):
     """Main POC execution"""
     
+    parser = argparse.ArgumentParser(description="Customer Communication Assistant inbox monitor")
+    parser.add_argument("--daemon", action="store_true", help="keep running and poll the inbox continuously")
+    parser.add_argument("--min-interval", type=float, default=15, help="daemon: seconds between polls while mail is arriving")
+    parser.add_argument("--max-interval", type=float, default=120, help="daemon: longest idle back-off in seconds")
+    parser.add_argument("--webhook-port", type=int, help="daemon: also accept pushed messages on this port")
+    parser.add_argument("--tenants", metavar="FILE", help="poll every business listed in this JSON file instead of AGENTMAIL_EMAIL")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port (GET /metrics; not with --tenants)")
+    args = parser.parse_args(argv)
+    
     # Safety flag: set to True to actually send emails
     SEND_EMAILS = os.getenv("POC_SEND_EMAILS", "false").lower() == "true"
     
-    print("=" * 60)
-    print("Customer Communication Assistant - POC v3")
-    print(f"Time: {datetime.now().isoformat()}")
-    print(f"Send Emails: {'ENABLED' if SEND_EMAILS else 'DISABLED (set POC_SEND_EMAILS=true to enable)'}")
-    print("=" * 60)
-    print()
+    # Number of messages triaged/routed concurrently (1 = sequential)
+    WORKERS = max(1, int(os.getenv("POC_WORKERS", "1")))
+    
+    # Optional on-disk triage cache so cron re-runs skip already-seen messages
+    TRIAGE_CACHE_PATH = os.getenv("POC_TRIAGE_CACHE")
+    
+    # Triage mode: "rules" (keyword engine only) or "tiered" (escalate uncertain mail to Claude)
+    TRIAGE_MODE = os.getenv("POC_TRIAGE_MODE", "rules")
+    TRIAGE_MIN_CONFIDENCE = os.getenv("POC_TRIAGE_MIN_CONFIDENCE", "high")
+    TRIAGE_STREAMING = os.getenv("POC_TRIAGE_STREAMING", "false").lower() == "true"
+    
+    # Optional sync state file: fetch only mail newer than the last run
+    SYNC_STATE_PATH = os.getenv("POC_SYNC_STATE")
+    
+    # Daemon mode: file rewritten with a status line after every poll
+    HEARTBEAT_PATH = os.getenv("POC_HEARTBEAT_FILE")
+    
+    # Optional durable work queue between fetch, triage and route
+    WORK_QUEUE_PATH = os.getenv("POC_WORK_QUEUE")
+    
+    # Webhook ingestion: shared secret expected in X-Webhook-Secret
+    WEBHOOK_SECRET = os.getenv("POC_WEBHOOK_SECRET")
+    WEBHOOK_HOST = os.getenv("POC_WEBHOOK_HOST", "127.0.0.1")  # other interfaces need POC_WEBHOOK_SECRET
+    
+    # Optional send ledger: never send the same reply for a message twice
+    SEND_LEDGER_PATH = os.getenv("POC_SEND_LEDGER")
+    
+    # Optional conversation store: threads customer messages and remembers slot offers
+    CONVERSATION_DB_PATH = os.getenv("POC_CONVERSATION_DB")
+    
+    # Optional reservations file: booking stays atomic across monitor processes
+    RESERVATIONS_PATH = os.getenv("POC_RESERVATIONS")
+    
+    # Replies sent concurrently in the background (0 = send inline while routing)
+    SEND_CONCURRENCY = max(0, int(os.getenv("POC_SEND_CONCURRENCY", "4")))
+    
+    # Optional metrics snapshot: JSON rewritten after every poll and at exit
+    METRICS_PATH = os.getenv("POC_METRICS_FILE")
+    
+    # JSON-lines log: stdout unless POC_LOG_FILE is set (rotated by size)
+    LOG_PATH = os.getenv("POC_LOG_FILE")
+    LOG_LEVEL = os.getenv("POC_LOG_LEVEL", "info")
+    
+    try:
+        LOG_MAX_BYTES = int(os.getenv("POC_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+        LOG_BACKUPS = int(os.getenv("POC_LOG_BACKUPS", "5"))
+        setup_logging(LOG_PATH, level=LOG_LEVEL, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUPS)
+    except ValueError as e:
+        # No writer yet: log_event falls back to stderr
+        log_event("config_error", level=ERROR, error=str(e))
+        return 1
+    log_event(
+        "startup", version="POC v3", mode="daemon" if args.daemon else "single run",
+        send_emails=SEND_EMAILS, workers=WORKERS, inbox=None if args.tenants else AGENTMAIL_EMAIL
+    )
     
     # Initialize
+    if args.webhook_port and not args.daemon:
+        log_event("config_error", level=ERROR, error="--webhook-port requires --daemon")
+        return 1
+    if args.webhook_port and not WEBHOOK_SECRET:
+        from webhook_server import _is_loopback
+        if not _is_loopback(WEBHOOK_HOST):
+            log_event("config_error", level=ERROR, error=f"POC_WEBHOOK_SECRET is required to listen on {WEBHOOK_HOST}")
+            return 1
+    
+    if args.tenants and (args.metrics_port or METRICS_PATH):
+        # Tenant turns run in pool processes, each with its own registry
+        log_event("config_error", level=ERROR, error="--metrics-port and POC_METRICS_FILE are not supported with --tenants")
+        return 1
+    
+    if args.tenants:
+        from tenants import load_tenants, run_tenants
+        try:
+            tenants = load_tenants(args.tenants)
+            log_event("tenants_loaded", tenants=len(tenants))
+            results = run_tenants(
+                tenants,
+                processes=int(os.getenv("POC_TENANT_PROCESSES", "0")) or None,
+                quantum=int(os.getenv("POC_TENANT_QUANTUM", "20")),
+                min_interval=args.min_interval,
+                max_interval=args.max_interval,
+                once=not args.daemon
+            )
+        except ValueError as e:
+            log_event("config_error", level=ERROR, error=str(e))
+            return 1
+        log_event("tenants_done", turns=len(results), handled=sum(r["handled"] for r in results))
+        return 1 if any(r["error"] for r in results) and not args.daemon else 0
+    
     if not AGENTMAIL_API_KEY or not AGENTMAIL_EMAIL:
-        print("❌ Error: AGENTMAIL_API_KEY and AGENTMAIL_EMAIL must be set")
+        log_event("config_error", level=ERROR, error="AGENTMAIL_API_KEY and AGENTMAIL_EMAIL must be set")
         return 1
     
     client = AgentmailClient(AGENTMAIL_API_KEY, AGENTMAIL_EMAIL)
-    triage_engine = MessageTriage()
-    calendar = CalendarManager()
-    router = ActionRouter(client, calendar)
+    cache = TriageCache(TRIAGE_CACHE_PATH) if TRIAGE_CACHE_PATH else None
+    triage_engine = MessageTriage(
+        cache=cache, mode=TRIAGE_MODE, min_confidence=TRIAGE_MIN_CONFIDENCE, stream_early=TRIAGE_STREAMING
+    )
+    calendar = CalendarManager(reservations_path=RESERVATIONS_PATH)
+    ledger = SendLedger(SEND_LEDGER_PATH) if SEND_LEDGER_PATH else None
+    outbox = SendPipeline(client, ledger=ledger, max_in_flight=SEND_CONCURRENCY) if SEND_EMAILS and SEND_CONCURRENCY else None
+    store = ConversationStore(CONVERSATION_DB_PATH) if CONVERSATION_DB_PATH else None
+    router = ActionRouter(client, calendar, ledger=ledger, outbox=outbox, store=store)
     router.send_emails_enabled = SEND_EMAILS
+    work_queue = WorkQueue(WORK_QUEUE_PATH) if WORK_QUEUE_PATH else None
+    
+    if work_queue is not None:
+        METRICS.register_gauge("work_queue_depth", work_queue.depth)
+    if outbox is not None:
+        METRICS.register_gauge("outbound_pending", lambda: outbox.stats()["pending"])
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+        log_event("metrics_server", port=args.metrics_port)
     
-    print(f"📧 Checking inbox: {AGENTMAIL_EMAIL}")
-    print()
+    if args.daemon:
+        # Without a state file, only mail arriving after startup is handled
+        watermark = InboxWatermark(SYNC_STATE_PATH)
+        if watermark.timestamp is None:
+            watermark.timestamp = datetime.now(timezone.utc).replace(tzinfo=None)
+        
+        seen = None
+        webhook_server = None
+        if args.webhook_port:
+            from webhook_server import WebhookIngestServer
+            seen = SeenMessages()
+            webhook_server = WebhookIngestServer(
+                triage_engine, router, seen=seen,
+                host=WEBHOOK_HOST, port=args.webhook_port,
+                secret=WEBHOOK_SECRET, workers=WORKERS, work_queue=work_queue
+            )
+            webhook_server.start()
+            METRICS.register_gauge("webhook_queue_depth", webhook_server.queue.qsize)
+        
+        try:
+            return run_daemon(
+                client, triage_engine, router, watermark,
+                workers=WORKERS,
+                min_interval=args.min_interval,
+                max_interval=args.max_interval,
+                heartbeat_path=HEARTBEAT_PATH,
+                seen=seen,
+                work_queue=work_queue,
+                metrics_path=METRICS_PATH
+            )
+        finally:
+            if webhook_server is not None:
+                webhook_server.stop()
+            triage_engine.close()
+            if outbox is not None:
+                outbox.close()
+            if store is not None:
+                store.close()
     
     # Fetch messages
     try:
-        messages = client.get_messages(limit=5)
-        print(f"Found {len(messages)} recent messages")
-        print()
-        
-        if not messages:
-            print("No messages to process.")
-            return 0
-        
-        # Process each message
-        for i, message in enumerate(messages, 1):
-            print(f"Message {i}/{len(messages)}")
-            print(f"From: {message.get('from', 'unknown')}")
-            print(f"Subject: {message.get('subject', '(no subject)')}")
-            print(f"Received: {message.get('created_at', 'unknown')}")
-            print()
-            
-            # Triage
-            triage = triage_engine.triage_message(message)
-            print(f"Triage Result:")
-            print(json.dumps(triage, indent=2))
-            print()
-            
-            # Route action
-            action = router.route(message, triage)
-            print(f"Action Taken: {action}")
-            print()
-            print("-" * 60)
-            print()
+        watermark = InboxWatermark(SYNC_STATE_PATH) if SYNC_STATE_PATH else None
+        handled = poll_once(client, triage_engine, router, watermark, WORKERS, work_queue=work_queue)
         
-        print("✅ Processing complete")
+        summary = {"handled": handled}
+        triage_engine.close()
+        if outbox is not None:
+            outbox.close()
+            summary["outbound"] = outbox.stats()
+        if store is not None:
+            store.close()
+        if work_queue is not None:
+            summary["work_queue"] = work_queue.depth()
+        if TRIAGE_MODE == "tiered":
+            summary["triage_tiers"] = triage_engine.tier_stats()
+        if cache is not None:
+            summary["triage_cache"] = cache.stats()
+        if METRICS_PATH:
+            METRICS.write_snapshot(METRICS_PATH)
+        log_event("run_complete", **summary)
         return 0
         
     except Exception as e:
-        print(f"❌ Error: {e}")
         import traceback
-        traceback.print_exc()
+        log_event("run_failed", level=ERROR, error=str(e), traceback=traceback.format_exc())
         return 1
 
 
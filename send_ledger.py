@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Outbound send ledger - makes customer auto-replies idempotent.
+
+Every reply is recorded under (inbound message key, action type). The
+router checks the ledger before sending, so re-seeing the same inbound
+message (cron re-runs, webhook + poll, queue retries) never sends the
+customer a second copy.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from triage_cache import message_fingerprint
+
+
+def message_key(message: Dict) -> str:
+    """Stable key for an inbound message: its id, else a content hash"""
+    return message.get("message_id") or message_fingerprint(message)
+
+
+class SendLedger:
+    """
+    SQLite-backed ledger of sent replies.
+    
+    Keyed by a clustered primary key (WITHOUT ROWID), so lookups are a
+    single B-tree probe and stay flat as the ledger grows into millions
+    of rows. Safe to share between threads.
+    """
+    
+    def __init__(self, path: str):
+        """
+        Open (or create) the ledger.
+        
+        Args:
+            path: SQLite file path (":memory:" for a throwaway ledger)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sends (
+                message_key TEXT NOT NULL,
+                action TEXT NOT NULL,
+                recipient TEXT,
+                outbound_id TEXT,
+                sent_at REAL NOT NULL,
+                PRIMARY KEY (message_key, action)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+    
+    def has_sent(self, message: Dict, action: str) -> bool:
+        """True if a reply for this inbound message and action was already sent"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM sends WHERE message_key = ? AND action = ?",
+                (message_key(message), action)
+            ).fetchone()
+        return row is not None
+    
+    def record(self, message: Dict, action: str, recipient: str, outbound_id: Optional[str] = None) -> bool:
+        """
+        Record a sent reply (single atomic insert).
+        
+        Returns:
+            False if the entry already existed
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO sends (message_key, action, recipient, outbound_id, sent_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (message_key(message), action, recipient, outbound_id, time.time())
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+    
+    def count(self) -> int:
+        """Number of recorded sends"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sends").fetchone()[0]
+    
+    def close(self):
+        """Close the underlying database connection"""
+        with self._lock:
+            self._conn.close()
+
+
+def test_send_ledger():
+    """Test idempotency and lookup cost at scale"""
+    
+    print("Testing Send Ledger")
+    print("=" * 60)
+    print()
+    
+    ledger = SendLedger(":memory:")
+    message = {"message_id": "m1", "from": "a@example.com", "subject": "No heat!"}
+    
+    assert not ledger.has_sent(message, "escalated_urgent")
+    assert ledger.record(message, "escalated_urgent", "a@example.com", "out_1")
+    assert ledger.has_sent(message, "escalated_urgent")
+    assert not ledger.has_sent(message, "booking_options_sent")
+    assert not ledger.record(message, "escalated_urgent", "a@example.com", "out_2")
+    assert ledger.has_sent({"from": "b@example.com", "subject": "x"}, "a") is False
+    print("✅ Second send for the same (message, action) is detected")
+    
+    # Lookup cost should not grow with ledger size
+    for size in (10000, 200000):
+        with ledger._lock:
+            ledger._conn.executemany(
+                "INSERT OR IGNORE INTO sends (message_key, action, sent_at) VALUES (?, ?, ?)",
+                ((f"bulk_{i}", "booking_options_sent", 0.0) for i in range(size))
+            )
+            ledger._conn.commit()
+        start = time.perf_counter()
+        for i in range(2000):
+            ledger.has_sent({"message_id": f"bulk_{i * 7 % size}"}, "booking_options_sent")
+        per_lookup = (time.perf_counter() - start) / 2000 * 1e6
+        print(f"   {ledger.count():>7} entries: {per_lookup:.1f} µs per lookup")
+    print()
+
+
+if __name__ == "__main__":
+    test_send_ledger()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Outbound send pipeline - takes reply sending off the routing path.
+
+ActionRouter hands replies to the pipeline and moves on; a small pool of
+sender threads delivers them with a bounded number of sends in flight.
+Failed sends can be retried after a jittered backoff (without holding a
+sender slot), and every reply ends up with a per-message status:
+"sent", "duplicate" (already in the send ledger, or sent by an identical
+reply that was in flight) or "failed".
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from send_ledger import SendLedger, message_key
+from structured_log import ERROR, INFO, log_event
+
+
+class OutboundReply:
+    """A reply waiting to be (or already) sent"""
+    
+    def __init__(
+        self,
+        message: Dict,
+        action: str,
+        to: str,
+        subject: str,
+        text: str,
+        on_sent: Optional[Callable[["OutboundReply"], None]] = None
+    ):
+        self.message = message
+        self.action = action
+        self.to = to
+        self.subject = subject
+        self.text = text
+        self.on_sent = on_sent
+        self.status = "pending"
+        self.attempts = 0
+        self.outbound_id: Optional[str] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._done = threading.Event()
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the reply is sent, skipped or failed (False on timeout)"""
+        return self._done.wait(timeout)
+    
+    def __repr__(self):
+        return f"OutboundReply(to={self.to!r}, action={self.action!r}, status={self.status!r})"
+
+
+class SendPipeline:
+    """Concurrent, bounded, retrying sender for ActionRouter replies"""
+    
+    def __init__(
+        self,
+        client,
+        ledger: Optional[SendLedger] = None,
+        max_in_flight: int = 4,
+        max_attempts: int = 1,
+        backoff_base: float = 2.0,
+        results_limit: int = 1000
+    ):
+        """
+        Args:
+            client: Anything with send_reply(to, subject, text) -> dict or None
+            ledger: Send ledger consulted before and written after each send
+            max_in_flight: Maximum concurrent sends
+            max_attempts: Attempts per reply before it is reported as failed.
+                AgentmailClient already retries what is safe to retry, so
+                raise this only for clients that do not
+            backoff_base: First retry delay in seconds, doubled per attempt
+            results_limit: Finished replies kept for drain_results() (oldest dropped)
+        """
+        self.client = client
+        self.ledger = ledger
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="sender")
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._keys_in_flight: Dict[tuple, List[OutboundReply]] = {}  # key -> duplicates waiting on it
+        self._completed = deque(maxlen=results_limit)
+        self.counts = {"sent": 0, "duplicate": 0, "failed": 0, "retries": 0}
+    
+    def submit(
+        self,
+        message: Dict,
+        action: str,
+        to: str,
+        subject: str,
+        text: str,
+        on_sent: Optional[Callable[[OutboundReply], None]] = None
+    ) -> OutboundReply:
+        """
+        Queue a reply for sending and return immediately.
+        
+        A reply identical to one still in flight is not sent again; it
+        finishes with that one, as "duplicate" if it was sent and "failed"
+        if it failed, so waiters never take a lost send for a done one.
+        
+        Args:
+            on_sent: Called with the reply once it has actually been sent
+                (on a sender thread, before flush() can return)
+        """
+        reply = OutboundReply(message, action, to, subject, text, on_sent)
+        key = (message_key(message), action)
+        
+        with self._cond:
+            if key in self._keys_in_flight:
+                # The same reply is already on its way: share its outcome
+                self._keys_in_flight[key].append(reply)
+                return reply
+            self._keys_in_flight[key] = []
+            self._pending += 1
+        
+        self._executor.submit(self._deliver, reply)
+        return reply
+    
+    def _deliver(self, reply: OutboundReply):
+        try:
+            self._attempt(reply)
+        except Exception as e:
+            # e.g. the ledger failed: finish the reply so flush() cannot hang
+            log_event("send_error", level=ERROR, message_id=reply.message.get("message_id"),
+                      action=reply.action, error=str(e))
+            self._complete(reply, "sent" if reply.outbound_id else "failed")
+    
+    def _attempt(self, reply: OutboundReply):
+        if reply.attempts == 0 and self.ledger is not None and self.ledger.has_sent(reply.message, reply.action):
+            self._complete(reply, "duplicate")
+            return
+        
+        reply.attempts += 1
+        try:
+            result = self.client.send_reply(reply.to, reply.subject, reply.text)
+        except Exception:
+            result = None
+        
+        if result:
+            reply.outbound_id = result.get("message_id")
+            if self.ledger is not None:
+                self.ledger.record(reply.message, reply.action, reply.to, reply.outbound_id)
+            self._complete(reply, "sent")
+        elif reply.attempts < self.max_attempts:
+            delay = self.backoff_base * (2 ** (reply.attempts - 1))
+            with self._cond:
+                self.counts["retries"] += 1
+            timer = threading.Timer(random.uniform(delay / 2, delay), self._retry, (reply,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._complete(reply, "failed")
+    
+    def _retry(self, reply: OutboundReply):
+        try:
+            self._executor.submit(self._deliver, reply)
+        except RuntimeError:
+            # Pipeline shut down while waiting for the retry
+            self._complete(reply, "failed")
+    
+    def _finish_locked(self, reply: OutboundReply, status: str):
+        reply.status = status
+        reply.finished_at = time.time()
+        self.counts[status] += 1
+        self._completed.append(reply)
+        reply._done.set()
+    
+    def _complete(self, reply: OutboundReply, status: str):
+        if status != "duplicate":
+            log_event(
+                "send", level=ERROR if status == "failed" else INFO,
+                message_id=reply.message.get("message_id"), action=reply.action, to=reply.to,
+                status=status, attempts=reply.attempts, outbound_id=reply.outbound_id
+            )
+        if status == "sent" and reply.on_sent is not None:
+            try:
+                reply.on_sent(reply)
+            except Exception as e:
+                log_event("send_callback_failed", level=ERROR, message_id=reply.message.get("message_id"),
+                          action=reply.action, error=str(e))
+        
+        with self._cond:
+            self._finish_locked(reply, status)
+            for duplicate in self._keys_in_flight.pop((message_key(reply.message), reply.action), []):
+                self._finish_locked(duplicate, "failed" if status == "failed" else "duplicate")
+            self._pending -= 1
+            self._cond.notify_all()
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every submitted reply is sent, skipped or failed.
+        
+        Returns:
+            False if the timeout expired first
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+    
+    def drain_results(self) -> List[OutboundReply]:
+        """Return (and forget) replies finished since the last call (at most results_limit)"""
+        with self._cond:
+            results = list(self._completed)
+            self._completed.clear()
+        return results
+    
+    def stats(self) -> Dict:
+        """Send counters and replies still outstanding"""
+        with self._cond:
+            return dict(self.counts, pending=self._pending)
+    
+    def close(self, timeout: Optional[float] = None):
+        """Flush outstanding replies and stop the sender threads"""
+        self.flush(timeout)
+        self._executor.shutdown(wait=True)
+
+
+def test_send_pipeline():
+    """Slow and flaky sends must not block submit; results are reported per reply"""
+    
+    print("Testing Send Pipeline")
+    print("=" * 60)
+    print()
+    
+    class SlowFlakyClient:
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.calls = 0
+            self.in_flight = 0
+            self.peak = 0
+            self.flaky_attempts = 0
+        
+        def send_reply(self, to, subject, text):
+            with self.lock:
+                self.calls += 1
+                call = self.calls
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            time.sleep(0.05)
+            with self.lock:
+                self.in_flight -= 1
+            if to == "flaky@example.com":
+                with self.lock:
+                    self.flaky_attempts += 1
+                    if self.flaky_attempts < 3:
+                        return None
+            if to == "dead@example.com":
+                return None
+            return {"message_id": f"out_{call}"}
+    
+    client = SlowFlakyClient()
+    ledger = SendLedger(":memory:")
+    pipeline = SendPipeline(client, ledger=ledger, max_in_flight=4, max_attempts=3, backoff_base=0.01)
+    
+    start = time.perf_counter()
+    for i in range(20):
+        pipeline.submit({"message_id": f"m{i}"}, "booking_options_sent", f"c{i}@example.com", "Re", "Hi")
+    pipeline.submit({"message_id": "flaky"}, "escalated_urgent", "flaky@example.com", "Re", "Hi")
+    pipeline.submit({"message_id": "dead"}, "escalated_urgent", "dead@example.com", "Re", "Hi")
+    pipeline.submit({"message_id": "m0"}, "booking_options_sent", "c0@example.com", "Re", "Hi")
+    submit_ms = (time.perf_counter() - start) * 1000
+    assert submit_ms < 50, f"submit blocked for {submit_ms:.1f} ms"
+    print(f"✅ 23 replies queued in {submit_ms:.1f} ms (sends take 50 ms each)")
+    
+    assert pipeline.flush(timeout=10)
+    elapsed = time.perf_counter() - start
+    assert client.peak <= 4
+    print(f"✅ Delivered in {elapsed:.2f}s with at most {client.peak} sends in flight")
+    
+    statuses = {(r.message["message_id"], r.status) for r in pipeline.drain_results()}
+    assert ("flaky", "sent") in statuses and ("dead", "failed") in statuses
+    assert ("m0", "duplicate") in statuses
+    print("✅ Flaky send retried, dead send reported as failed, in-flight duplicate skipped")
+    
+    pipeline.submit({"message_id": "m5"}, "booking_options_sent", "c5@example.com", "Re", "Hi")
+    pipeline.flush()
+    assert pipeline.drain_results()[0].status == "duplicate"
+    print("✅ Reply already in the send ledger skipped")
+    
+    original = pipeline.submit({"message_id": "dead2"}, "escalated_urgent", "dead@example.com", "Re", "Hi")
+    copy = pipeline.submit({"message_id": "dead2"}, "escalated_urgent", "dead@example.com", "Re", "Hi")
+    assert not copy.wait(0), "duplicate finished before the send it copies"
+    assert pipeline.flush(timeout=5)
+    assert (original.status, copy.status) == ("failed", "failed")
+    pipeline.drain_results()
+    print("✅ Duplicate of an in-flight send shares its outcome (failed here)")
+    
+    class BrokenLedger(SendLedger):
+        def record(self, *args, **kwargs):
+            raise OSError("disk full")
+    
+    broken = SendPipeline(client, ledger=BrokenLedger(":memory:"), results_limit=2)
+    replies = [broken.submit({"message_id": f"b{i}"}, "booking_options_sent", "c@example.com", "Re", "Hi")
+               for i in range(3)]
+    assert broken.flush(timeout=5)
+    assert all(reply.wait(0) and reply.status == "sent" for reply in replies)
+    assert len(broken.drain_results()) == 2
+    broken.close()
+    print("✅ Ledger error does not hang flush(); finished replies kept up to results_limit")
+    
+    pipeline.close()
+    print(f"Stats: {pipeline.stats()}")
+    print()
+
+
+if __name__ == "__main__":
+    test_send_pipeline()
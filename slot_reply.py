@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Slot-selection reply parser.
+
+After ActionRouter offers booking options ("Option 1: Monday, Mar 02 at
+09:00 AM", ...), customers usually answer with something short: "2",
+"option 3", "the second one", "Tuesday works", "10am please". This module
+turns such a reply into an index into the stored offer with a handful of
+precompiled regexes, so confirming a booking needs no triage model call.
+Anything ambiguous ("2 or 3"), negative ("none of these work") or
+unrecognised returns None and the message goes through normal triage,
+as does a reply that mentions an emergency.
+"""
+
+import re
+from typing import Dict, List, Optional
+
+from openclaw_triage import OpenClawTriage
+
+ORDINALS = {
+    "first": 1, "1st": 1,
+    "second": 2, "2nd": 2,
+    "third": 3, "3rd": 3,
+    "fourth": 4, "4th": 4,
+    "fifth": 5, "5th": 5,
+}
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+WEEKDAY_NAMES = {
+    **{day: i for i, day in enumerate(WEEKDAYS)},
+    "mon": 0, "tue": 1, "tues": 1, "wed": 2, "thu": 3, "thur": 3, "thurs": 3, "fri": 4, "sat": 5, "sun": 6,
+}
+
+# Replies longer than this are real emails, not option picks
+MAX_REPLY_CHARS = 300
+
+_QUOTE_HEADER = re.compile(r"^\s*(on .+ wrote:|-----\s*original message\s*-----|from:\s)", re.IGNORECASE)
+_NEGATIVE = re.compile(r"\b(none|neither|no(?:ne)? of|can'?t|cannot|won'?t work|doesn'?t work|don'?t work|not available|reschedule|cancel)\b")
+_OPTION_NUMBER = re.compile(r"(?:\boption|\bopt\.?|\bnumber|\bno\.|#)\s*(\d+|" + "|".join(NUMBER_WORDS) + r")\b")
+_BARE_NUMBER = re.compile(r"^\W*(\d+)\W*$")
+_ANY_NUMBER = re.compile(r"(?<![:\d])\b(\d+)\b(?!\s*(?::|am\b|pm\b|a\.m\.|p\.m\.))")
+_ORDINAL = re.compile(r"\b(" + "|".join(ORDINALS) + r"|last)\b(?:\s+(?:one|option|slot|time))?")
+_WEEKDAY = re.compile(r"\b(" + "|".join(sorted(WEEKDAY_NAMES, key=len, reverse=True)) + r")\b\.?")
+_REPLY_SUBJECT = re.compile(r"^\s*re\s*(\[\d+\])?\s*:", re.IGNORECASE)
+_URGENT = re.compile("|".join(
+    re.escape(word)
+    for word in OpenClawTriage.KEYWORD_GROUPS["urgent"] + OpenClawTriage.KEYWORD_GROUPS["emergency"]
+))
+_TIME = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)")
+
+
+def reply_text(message: Dict) -> str:
+    """The customer's own words: body up to the first quoted line or quote header"""
+    body = message.get("text") or message.get("preview", "")
+    lines = []
+    for line in body.splitlines():
+        if line.lstrip().startswith(">") or _QUOTE_HEADER.match(line):
+            break
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def is_reply(message: Dict, thread_id: Optional[str] = None) -> bool:
+    """True if the message answers our email: same thread, or a "Re:" subject"""
+    if thread_id and message.get("thread_id") == thread_id:
+        return True
+    return bool(_REPLY_SUBJECT.match(message.get("subject") or ""))
+
+
+def is_urgent(text: str) -> bool:
+    """True if the text uses any of the rule engine's urgent/emergency keywords"""
+    return bool(_URGENT.search(text.lower()))
+
+
+def _single(choices: set) -> Optional[int]:
+    return next(iter(choices)) if len(choices) == 1 else None
+
+
+def parse_slot_choice(text: str, slots: List[Dict]) -> Optional[int]:
+    """
+    Resolve a reply against the offered slots.
+    
+    Args:
+        text: The customer's reply (already stripped of quoted text)
+        slots: Offered slot dicts with a "start" datetime, in offered order
+    
+    Returns:
+        0-based index into slots, or None if the reply doesn't pick exactly one
+    """
+    text = text.lower().strip()
+    if not text or len(text) > MAX_REPLY_CHARS or not slots or _NEGATIVE.search(text):
+        return None
+    
+    # Explicit option numbers win; more than one distinct number is ambiguous
+    numbers = {NUMBER_WORDS[n] if n in NUMBER_WORDS else int(n) for n in _OPTION_NUMBER.findall(text)}
+    if numbers:
+        numbers.update(int(n) for n in _ANY_NUMBER.findall(text))  # "option 2 or 3"
+    else:
+        bare = _BARE_NUMBER.match(text)
+        if bare:
+            numbers = {int(bare.group(1))}
+    if numbers:
+        choice = _single(numbers)
+        return choice - 1 if choice is not None and 1 <= choice <= len(slots) else None
+    
+    ordinals = {len(slots) if word == "last" else ORDINALS[word] for word in _ORDINAL.findall(text)}
+    if ordinals:
+        choice = _single(ordinals)
+        return choice - 1 if choice is not None and 1 <= choice <= len(slots) else None
+    
+    # Otherwise narrow by weekday and/or clock time mentioned in the reply
+    candidates = range(len(slots))
+    days = {WEEKDAY_NAMES[name] for name in _WEEKDAY.findall(text)}
+    if days:
+        candidates = [i for i in candidates if slots[i]["start"].weekday() in days]
+    
+    times = set()
+    for hour, minute, meridiem in _TIME.findall(text):
+        hour = int(hour) % 12 + (12 if meridiem.startswith("p") else 0)
+        times.add((hour, int(minute or 0)))
+    if times:
+        candidates = [i for i in candidates if (slots[i]["start"].hour, slots[i]["start"].minute) in times]
+    
+    if not (days or times):
+        return None
+    return _single(set(candidates))
+
+
+def test_parse_slot_choice():
+    """Test option numbers, ordinals, weekdays, times and rejections"""
+    import time
+    from datetime import datetime
+    
+    print("Testing Slot Reply Parser")
+    print("=" * 60)
+    print()
+    
+    # Mon 09:00, Mon 10:00, Tue 14:00, Wed 09:00
+    slots = [{"start": start} for start in (
+        datetime(2026, 3, 2, 9), datetime(2026, 3, 2, 10), datetime(2026, 3, 3, 14), datetime(2026, 3, 4, 9)
+    )]
+    
+    cases = [
+        ("2", 1),
+        ("Option 3 please", 2),
+        ("#4", 3),
+        ("Option two works", 1),
+        ("I'll take the second one, thanks!", 1),
+        ("the last option", 3),
+        ("The Tuesday one works", 2),
+        ("wednesday", 3),
+        ("Monday at 10am", 1),
+        ("10:00 AM is good", 1),
+        ("Monday", None),            # two Monday slots
+        ("9am", None),               # Monday and Wednesday
+        ("option 2 or 3", None),
+        ("Option 3 at 2pm is fine", 2),
+        ("7", None),
+        ("None of these work for me", None),
+        ("Can we do Friday instead?", None),
+        ("Tues works", 2),
+        ("Wed. please", 3),
+        ("Wednesday or Thursday", 3),
+        ("After the wedding, Tuesday works", 2),   # "wed" inside a word is not a day
+        ("Monster thanks - Wednesday", 3),
+        ("My AC is making a weird noise again", None),
+        ("", None),
+    ]
+    for text, expected in cases:
+        got = parse_slot_choice(text, slots)
+        assert got == expected, f"{text!r}: expected {expected}, got {got}"
+    print(f"✅ {len(cases)} replies resolved as expected")
+    
+    quoted = {"text": "Option 2\n\nOn Mon, Mar 2, 2026 Scheduling Team wrote:\n> • Option 1: Monday\n> • Option 3: Tuesday"}
+    assert reply_text(quoted) == "Option 2"
+    assert parse_slot_choice(reply_text(quoted), slots) == 1
+    print("✅ Quoted offer text ignored")
+    
+    start = time.perf_counter()
+    for _ in range(10000):
+        parse_slot_choice("The Tuesday one works", slots)
+    per_parse = (time.perf_counter() - start) / 10000 * 1e6
+    print(f"✅ {per_parse:.1f} µs per parse")
+    print()
+
+
+def test_slot_reply_booking():
+    """Offer slots, reply "option 2", and check it books without triage"""
+    import time
+    from datetime import datetime, timedelta
+    from calendar_manager import CalendarManager
+    from conversation_store import ConversationStore
+    from poc_monitor import ActionRouter, process_message
+    from send_pipeline import SendPipeline
+    
+    print("Testing Slot Reply Booking")
+    print("=" * 60)
+    print()
+    
+    class FakeClient:
+        def send_reply(self, to, subject, text):
+            return {"message_id": "out_1"}
+    
+    class NoTriage:
+        def triage_message(self, message):
+            raise AssertionError("slot reply should not reach the triage engine")
+    
+    store = ConversationStore(":memory:")
+    calendar = CalendarManager()
+    router = ActionRouter(FakeClient(), calendar, store=store)
+    router.send_emails_enabled = True
+    
+    request = {"message_id": "m1", "from": "Jo <jo@example.com>", "subject": "AC broken", "text": "Can someone come out?"}
+    router.route(request, {"intent": "booking", "urgency": "flexible", "service_type": "hvac_repair"})
+    offered = store.pending_offer(request)["slots"]
+    
+    reply = {"message_id": "m2", "from": "jo@example.com", "subject": "Re: AC broken",
+             "text": "Option 2 please\n\nOn Mon, Scheduling Team wrote:\n> Option 1: ..."}
+    start = time.perf_counter()
+    result = process_message(reply, NoTriage(), router)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    assert result["action"] == "booking_confirmed", result
+    assert calendar._is_slot_booked(offered[1]["start"], offered[1]["end"])
+    assert store.pending_offer(reply) is None and store.stats()["appointments"] == 1
+    print(f"✅ Option 2 booked in {elapsed_ms:.2f} ms without a triage call")
+    
+    # Replies the parser can't resolve fall back to triage
+    router.route(request, {"intent": "booking", "urgency": "flexible", "service_type": "hvac_repair"})
+    assert router.match_slot_reply({"from": "jo@example.com", "subject": "Re: AC broken",
+                                    "text": "Do you also fix heat pumps?"}) is None
+    print("✅ Unrelated reply falls back to triage")
+    
+    # A new email (not a reply) and an emergency both go to triage
+    assert router.match_slot_reply(dict(reply, subject="Another question", text="2")) is None
+    assert router.match_slot_reply(dict(reply, text="Option 2, but water is everywhere - emergency!")) is None
+    assert router.match_slot_reply(reply) is not None
+    print("✅ Non-replies and emergencies are not treated as slot picks")
+    
+    # A slot that has already started is re-offered instead of booked
+    offer = store.pending_offer(reply)
+    past = dict(offer["slots"][0], start=datetime.now() - timedelta(hours=1))
+    store.close_offer(offer["id"], "superseded")
+    store.record_slot_offer(request, [past] + offer["slots"][1:], "hvac_repair")
+    result = process_message(dict(reply, message_id="m3", text="Option 1"), NoTriage(), router)
+    assert result["action"] == "booking_options_sent", result
+    assert store.stats()["appointments"] == 1
+    print("✅ Past slot not booked; fresh options sent")
+    
+    # An offer whose email never went out cannot be picked from
+    class FailingClient:
+        def send_reply(self, to, subject, text):
+            return None
+    
+    outbox = SendPipeline(FailingClient())
+    router = ActionRouter(FailingClient(), calendar, store=ConversationStore(":memory:"), outbox=outbox)
+    router.send_emails_enabled = True
+    router.route(request, {"intent": "booking", "urgency": "flexible", "service_type": "hvac_repair"})
+    outbox.close()
+    assert router.store.pending_offer(request) is None
+    print("✅ No offer recorded when the offer email fails to send")
+    
+    # A retried route job re-sends a failed confirmation instead of escalating the closed offer
+    class ConfirmationFailsOnce:
+        confirmations = 0
+        
+        def send_reply(self, to, subject, text):
+            if text.startswith("You're booked"):
+                self.confirmations += 1
+                if self.confirmations == 1:
+                    return None
+            return {"message_id": "out_2"}
+    
+    client = ConfirmationFailsOnce()
+    outbox = SendPipeline(client)
+    router = ActionRouter(client, CalendarManager(), store=ConversationStore(":memory:"), outbox=outbox)
+    router.send_emails_enabled = True
+    router.route(request, {"intent": "booking", "urgency": "flexible", "service_type": "hvac_repair"})
+    outbox.flush()
+    triage = router.match_slot_reply(reply)
+    for expected in ("failed", "sent", None):
+        with router.collect_sends() as replies:
+            assert router.route(reply, triage) == "booking_confirmed"
+        outbox.flush()
+        assert [sent.status for sent in replies] == ([expected] if expected else []), replies
+    outbox.close()
+    assert client.confirmations == 2 and router.store.stats()["appointments"] == 1
+    print("✅ Retry after a failed confirmation re-sends it once, without booking twice")
+    print()
+
+
+if __name__ == "__main__":
+    test_parse_slot_choice()
+    test_slot_reply_booking()
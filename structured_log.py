@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Structured logging - one compact JSON line per event.
+
+poc_monitor and friends log events (a name plus fields) instead of
+printing. Records are handed to a background writer thread through a
+queue, so the caller never waits on the terminal or the disk; the writer
+serialises them in batches, writes each batch with a single write and
+flush, and rotates the log file by size. log_event() checks the level
+before doing anything else, so a disabled DEBUG event on the hot path
+costs one comparison and no formatting. Until setup_logging() is called,
+warnings and errors are written straight to stderr and the rest is
+dropped, so scripts that never configure logging still see failures.
+
+Usage:
+    from structured_log import DEBUG, log_event, setup_logging
+    
+    setup_logging(path="monitor.log", level="info")
+    log_event("action", message_id="m1", action="marked_spam")
+    log_event("triage", level=DEBUG, triage=triage)   # skipped unless debug
+
+Each line looks like:
+    {"ts":"2026-03-02T09:00:00.123Z","level":"info","event":"action","message_id":"m1","action":"marked_spam"}
+"""
+
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: rotation is re-checked but not locked
+    fcntl = None
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {number: name for name, number in LEVELS.items()}
+
+# (time, level, event, fields) as queued by log_event()
+Event = Tuple[float, int, str, Dict]
+
+_DEFAULT_LEVEL = WARNING
+_min_level = _DEFAULT_LEVEL  # to stderr until setup_logging()
+_writer: Optional["AsyncJsonWriter"] = None
+
+
+def log_event(event: str, level: int = INFO, **fields):
+    """Log one event with JSON-serialisable fields (nothing happens below the level)"""
+    if level >= _min_level:
+        writer = _writer
+        if writer is not None:
+            writer.put((time.time(), level, event, fields))
+        else:
+            sys.stderr.write(format_event((time.time(), level, event, fields)) + "\n")
+
+
+def log_enabled(level: int) -> bool:
+    """True if events at this level are written (guard for fields that are costly to build)"""
+    return level >= _min_level
+
+
+def format_event(event: Event) -> str:
+    """Compact single-line JSON: ts, level, event, then the event's fields"""
+    created, level, name, fields = event
+    entry = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(created)) + f".{int(created % 1 * 1000):03d}Z",
+        "level": LEVEL_NAMES.get(level, str(level)),
+        "event": name
+    }
+    entry.update(fields)
+    return json.dumps(entry, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class AsyncJsonWriter:
+    """
+    Formats and writes events on a background thread.
+    
+    put() only enqueues the event. The writer drains up to batch_size
+    events at a time and writes them with one write and one flush, to
+    stdout or to a file rotated at max_bytes (path.1 ... path.N backups).
+    The file is opened per batch, so worker processes sharing the path
+    keep appending to the live file after another process rotates it.
+    Rotation happens under a lock file (path.lock) and re-checks the size
+    once the lock is held, so two processes never rotate the same file.
+    """
+    
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        batch_size: int = 256,
+        max_pending: int = 10000
+    ):
+        """
+        Args:
+            path: Log file, or None for stdout
+            max_bytes: Rotate before the file grows past this (0 = never)
+            backup_count: Rotated files kept
+            batch_size: Most events per write
+            max_pending: Events queued before put() blocks (backpressure)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._start_thread()
+    
+    def _start_thread(self):
+        self._queue: "queue.Queue[Optional[Event]]" = queue.Queue(self.max_pending)
+        self.put = self._queue.put
+        self._thread = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
+        self._thread.start()
+    
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            lines = []
+            for event in batch:
+                if event is None:
+                    continue
+                try:
+                    lines.append(format_event(event))
+                except Exception as e:
+                    lines.append(format_event((event[0], ERROR, "log_format_error", {"event_name": event[2], "error": str(e)})))
+            if lines:
+                try:
+                    self._write("\n".join(lines) + "\n")
+                except OSError as e:
+                    sys.stderr.write(f"structured_log: dropped {len(lines)} events: {e}\n")
+            
+            for _ in batch:
+                self._queue.task_done()
+            if None in batch:
+                return
+    
+    def _write(self, text: str):
+        if self.path is None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            return
+        
+        f = open(self.path, "a", encoding="utf-8")
+        if self.max_bytes and f.tell() and f.tell() + len(text) > self.max_bytes:
+            f.close()
+            self._rotate(len(text))
+            f = open(self.path, "a", encoding="utf-8")
+        with f:
+            f.write(text)
+    
+    def _rotate(self, incoming: int):
+        with open(f"{self.path}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # released when the file closes
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                return
+            if not size or size + incoming <= self.max_bytes:
+                return  # another process rotated it while we waited
+            
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            if self.backup_count:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+    
+    def flush(self):
+        """Block until every event queued so far is written"""
+        if self._thread.is_alive():
+            self._queue.join()
+    
+    def close(self):
+        """Write out queued events and stop the writer thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+    
+    def after_fork(self):
+        """The writer thread doesn't survive fork(); give the child its own"""
+        self._start_thread()
+
+
+def setup_logging(
+    path: Optional[str] = None,
+    level: str = "info",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5
+) -> AsyncJsonWriter:
+    """
+    Start writing events at `level` and above, replacing any earlier setup.
+    
+    Args:
+        path: Log file, or None for stdout
+        level: "debug", "info", "warning" or "error"
+        max_bytes: Rotate the file before it grows past this (0 = never)
+        backup_count: Rotated files kept
+    """
+    global _writer, _min_level
+    if level.lower() not in LEVELS:
+        raise ValueError(f"Unknown log level {level!r} (expected one of {', '.join(LEVELS)})")
+    
+    shutdown_logging()
+    _writer = AsyncJsonWriter(path, max_bytes=max_bytes, backup_count=backup_count)
+    _min_level = LEVELS[level.lower()]
+    return _writer
+
+
+def logging_config() -> Optional[Dict]:
+    """setup_logging() arguments for the current writer (e.g. to pass to spawned workers)"""
+    if _writer is None:
+        return None
+    return {
+        "path": _writer.path,
+        "level": LEVEL_NAMES[_min_level],
+        "max_bytes": _writer.max_bytes,
+        "backup_count": _writer.backup_count
+    }
+
+
+def flush_logging():
+    """Block until every event logged so far is written"""
+    if _writer is not None:
+        _writer.flush()
+
+
+def shutdown_logging():
+    """Write out queued events and go back to warnings and errors on stderr"""
+    global _writer, _min_level
+    _min_level = _DEFAULT_LEVEL
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+def _after_fork_in_child():
+    if _writer is not None:
+        _writer.after_fork()
+
+
+atexit.register(shutdown_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _log_in_child(n: int):
+    for i in range(n):
+        log_event("child", i=i, pid=os.getpid())
+    shutdown_logging()
+
+
+def _log_rotating_in_child(path: str, n: int):
+    setup_logging(path, level="info", max_bytes=8 * 1024, backup_count=1000)
+    for i in range(n):
+        log_event("rotating", i=i, pid=os.getpid())
+        if i % 10 == 0:
+            flush_logging()  # small batches: rotations in every process overlap
+    shutdown_logging()
+
+
+def test_structured_log():
+    """Test JSON lines, level filtering, rotation, fork safety and hot-path cost"""
+    import io
+    import multiprocessing
+    import tempfile
+    
+    print("Testing Structured Log")
+    print("=" * 60)
+    print()
+    
+    shutdown_logging()
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        log_event("startup")
+        log_event("poll_failed", level=ERROR, error="timeout")
+        captured = sys.stderr.getvalue()
+    finally:
+        sys.stderr = stderr
+    assert '"event":"poll_failed"' in captured and "startup" not in captured, captured
+    print("✅ Warnings and errors reach stderr before setup_logging()")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "monitor.log")
+        setup_logging(path, level="info", max_bytes=64 * 1024, backup_count=20)
+        
+        n = 5000
+        for i in range(n):
+            log_event("message", message_id=f"m{i}", action="marked_spam", triage={"intent": "spam"})
+            log_event("triage", level=DEBUG, message_id=f"m{i}")
+        log_event("send_error", level=ERROR, to="jo@example.com", error="timeout")
+        flush_logging()
+        
+        files = sorted(name for name in os.listdir(tmp) if name.startswith("monitor.log"))
+        records = []
+        for name in files:
+            assert os.path.getsize(os.path.join(tmp, name)) <= 64 * 1024
+            with open(os.path.join(tmp, name), encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f)
+        events = [record["event"] for record in records]
+        assert events.count("message") == n and "triage" not in events, events[:5]
+        assert any(r["event"] == "send_error" and r["level"] == "error" for r in records)
+        assert {"ts", "level", "event", "message_id", "action", "triage"} <= set(records[0])
+        print(f"✅ {len(records)} JSON records across {len(files)} rotated files, debug events filtered")
+        
+        if "fork" in multiprocessing.get_all_start_methods():
+            child = multiprocessing.get_context("fork").Process(target=_log_in_child, args=(100,))
+            child.start()
+            child.join(10)
+            assert child.exitcode == 0
+            with open(path, encoding="utf-8") as f:
+                assert sum(1 for line in f if '"event":"child"' in line) == 100
+            print("✅ Forked worker logs through its own writer thread")
+            
+            rotating = os.path.join(tmp, "shared.log")
+            children = [
+                multiprocessing.get_context("fork").Process(target=_log_rotating_in_child, args=(rotating, 1000))
+                for _ in range(4)
+            ]
+            for child in children:
+                child.start()
+            for child in children:
+                child.join(30)
+                assert child.exitcode == 0
+            shared = [name for name in os.listdir(tmp) if name.startswith("shared.log") and not name.endswith(".lock")]
+            lines = 0
+            for name in shared:
+                with open(os.path.join(tmp, name), encoding="utf-8") as f:
+                    lines += sum(1 for line in f)
+            assert lines == 4000, f"{4000 - lines} events lost to overlapping rotations"
+            print(f"✅ 4 processes rotated one log into {len(shared)} files without losing events")
+        
+        calls = 50000
+        start = time.perf_counter()
+        for i in range(calls):
+            log_event("triage", level=DEBUG, message_id="m1", triage={"intent": "spam"})
+        disabled_us = (time.perf_counter() - start) / calls * 1e6
+        
+        start = time.perf_counter()
+        for i in range(calls):
+            log_event("message", message_id="m1", action="marked_spam")
+        enabled_us = (time.perf_counter() - start) / calls * 1e6
+        shutdown_logging()
+        print(f"✅ Disabled debug event: {disabled_us:.2f} µs; enabled event: {enabled_us:.2f} µs (writer thread's formatting included)")
+    print()
+
+
+if __name__ == "__main__":
+    test_structured_log()
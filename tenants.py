@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Multi-tenant runner - polls many business inboxes from one monitor.
+
+Businesses are loaded from a JSON file shaped like the planned
+`businesses` table (see ARCHITECTURE.md):
+    
+    [
+      {
+        "id": "brothers_hvac",
+        "name": "Brothers HVAC",
+        "email": "brothers-hvac@agentmail.to",
+        "calendar_id": null,
+        "config": {
+          "triage_mode": "tiered",
+          "triage_min_confidence": "high",
+          "triage_streaming": false,
+          "send_emails": false,
+          "workers": 1,
+          "sync_state": "state/brothers_hvac.json",
+          "triage_cache": "state/triage.db",
+          "send_ledger": "state/sends.db",
+          "conversation_db": "state/brothers_hvac.db",
+          "reservations": "state/brothers_hvac_reservations.db",
+          "api_key_env": "AGENTMAIL_API_KEY"
+        }
+      }
+    ]
+
+Each poll of one tenant is a "turn" run in a process pool, so triage
+work for different businesses spreads across cores. A turn handles at
+most `quantum` messages; a tenant with more waiting goes to the back of
+the line behind every other tenant that is due, so one noisy inbox
+cannot starve the rest. Each tenant has its own client, triage settings,
+calendar and sync state. Worker processes keep them between turns, so
+with more than one process every tenant needs a "reservations" database:
+it is how bookings made from different workers see each other.
+"""
+
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from poc_monitor import (
+    AgentmailClient,
+    ActionRouter,
+    CalendarManager,
+    InboxWatermark,
+    MessageTriage,
+    next_poll_interval,
+    poll_once,
+)
+from conversation_store import ConversationStore
+from send_ledger import SendLedger
+from send_pipeline import SendPipeline
+from structured_log import ERROR, WARNING, log_event, logging_config, setup_logging
+from triage_cache import TriageCache
+
+DEFAULT_TENANT_CONFIG = {
+    "triage_mode": "rules",
+    "triage_min_confidence": "high",
+    "triage_streaming": False,
+    "send_emails": False,
+    "workers": 1,
+    "sync_state": None,
+    "triage_cache": None,
+    "send_ledger": None,
+    "conversation_db": None,
+    "reservations": None,
+    "api_key_env": "AGENTMAIL_API_KEY",
+    "base_url": None
+}
+
+# Per-process tenant clients/engines, built on a tenant's first turn here
+_RUNTIMES: Dict[str, Dict] = {}
+
+
+def load_tenants(path: str) -> List[Dict]:
+    """
+    Load business configs from a JSON file.
+    
+    Returns:
+        Tenant dicts with id, name, email, calendar_id and a config dict
+        filled in with defaults
+    """
+    with open(path) as f:
+        rows = json.load(f)
+    
+    tenants = []
+    for row in rows:
+        if not row.get("id") or not row.get("email"):
+            raise ValueError(f"Tenant config needs id and email: {row}")
+        tenants.append({
+            "id": str(row["id"]),
+            "name": row.get("name", str(row["id"])),
+            "email": row["email"],
+            "calendar_id": row.get("calendar_id"),
+            "config": dict(DEFAULT_TENANT_CONFIG, **row.get("config", {}))
+        })
+    
+    ids = [tenant["id"] for tenant in tenants]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Tenant ids must be unique")
+    return tenants
+
+
+def _tenant_runtime(tenant: Dict) -> Dict:
+    """Get (or build) this process's client, triage engine and router for a tenant"""
+    runtime = _RUNTIMES.get(tenant["id"])
+    if runtime is not None:
+        return runtime
+    
+    config = tenant["config"]
+    client_kwargs = {"base_url": config["base_url"]} if config["base_url"] else {}
+    client = AgentmailClient(os.getenv(config["api_key_env"]), tenant["email"], **client_kwargs)
+    cache = TriageCache(config["triage_cache"]) if config["triage_cache"] else None
+    triage_engine = MessageTriage(
+        cache=cache,
+        mode=config["triage_mode"],
+        min_confidence=config["triage_min_confidence"],
+        stream_early=config["triage_streaming"]
+    )
+    ledger = SendLedger(config["send_ledger"]) if config["send_ledger"] else None
+    outbox = SendPipeline(client, ledger=ledger) if config["send_emails"] else None
+    store = ConversationStore(config["conversation_db"], business_id=tenant["id"]) if config["conversation_db"] else None
+    router = ActionRouter(
+        client, CalendarManager(tenant["calendar_id"], reservations_path=config["reservations"]),
+        ledger=ledger, outbox=outbox, store=store
+    )
+    router.send_emails_enabled = bool(config["send_emails"])
+    
+    runtime = {"client": client, "triage_engine": triage_engine, "router": router}
+    _RUNTIMES[tenant["id"]] = runtime
+    return runtime
+
+
+def _init_worker(log_config: Optional[Dict]):
+    """Pool initializer: spawned workers start without the parent's log writer"""
+    if log_config is not None and logging_config() is None:
+        setup_logging(**log_config)
+
+
+def poll_tenant(tenant: Dict, state: Optional[Dict], quantum: int) -> Dict:
+    """
+    One turn for one tenant: fetch and handle up to `quantum` new messages.
+    
+    Runs in a pool worker. Sync state travels with the turn (and is also
+    saved to the tenant's sync_state file), so any worker can take the
+    next turn.
+    
+    Args:
+        tenant: Tenant dict from load_tenants()
+        state: Watermark state returned by the previous turn (None at first)
+        quantum: Most messages handled in this turn
+    
+    Returns:
+        Dict with tenant id, handled count, backlog flag, new state and error
+    """
+    runtime = _tenant_runtime(tenant)
+    watermark = InboxWatermark(tenant["config"]["sync_state"])
+    if state is not None:
+        watermark.restore(state)
+    elif watermark.timestamp is None:
+        # Fresh tenant without a state file: start from now, like the daemon
+        watermark.timestamp = datetime.now(timezone.utc).replace(tzinfo=None)
+    
+    error = None
+    handled = 0
+    try:
+        handled = poll_once(
+            runtime["client"], runtime["triage_engine"], runtime["router"], watermark,
+            workers=tenant["config"]["workers"], max_messages=quantum
+        )
+        outbox = runtime["router"].outbox
+        if outbox is not None:
+            outbox.flush()
+        store = runtime["router"].store
+        if store is not None:
+            store.flush()
+    except Exception as e:
+        error = str(e)
+    
+    return {
+        "tenant": tenant["id"],
+        "handled": handled,
+        "backlog": handled >= quantum,
+        "state": watermark.state(),
+        "error": error
+    }
+
+
+def run_tenants(
+    tenants: List[Dict],
+    processes: Optional[int] = None,
+    quantum: int = 20,
+    min_interval: float = 15,
+    max_interval: float = 120,
+    once: bool = False,
+    stop_event: Optional[threading.Event] = None,
+    poll_func: Callable = poll_tenant
+) -> List[Dict]:
+    """
+    Poll every tenant's inbox concurrently with fair round-robin turns.
+    
+    At most one turn per tenant is in flight. Tenants that are due wait in
+    a FIFO; a tenant whose turn used its whole quantum rejoins the back of
+    it straight away, one that came up short waits for its adaptive poll
+    interval (same back-off as the single-inbox daemon).
+    
+    Args:
+        tenants: Tenant dicts from load_tenants()
+        processes: Pool size (default: CPU count, capped at tenant count)
+        quantum: Most messages per tenant turn
+        once: Stop when every tenant has caught up once (cron-style run)
+        stop_event: Set to stop after in-flight turns finish
+        poll_func: Turn function (must be picklable; poll_tenant in production)
+    
+    Returns:
+        Turn results in completion order
+    
+    Raises:
+        ValueError: A tenant has no shared reservations database but its
+            turns may run in different processes
+    """
+    stop_event = stop_event or threading.Event()
+    
+    def request_stop(signum, frame):
+        log_event("stop_requested", level=WARNING, signal=signum)
+        stop_event.set()
+    
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+    
+    by_id = {tenant["id"]: tenant for tenant in tenants}
+    processes = max(1, min(processes or os.cpu_count() or 1, len(tenants)))
+    if processes > 1 and poll_func is poll_tenant:
+        # Each worker has its own in-memory calendar: without a shared
+        # reservations table two workers could book the same slot
+        unshared = [tenant["id"] for tenant in tenants if not tenant["config"]["reservations"]]
+        if unshared:
+            raise ValueError(f"Tenants need a \"reservations\" database with {processes} processes: {unshared}")
+    state: Dict[str, Optional[Dict]] = {tenant_id: None for tenant_id in by_id}
+    interval = {tenant_id: min_interval for tenant_id in by_id}
+    due_at = {tenant_id: 0.0 for tenant_id in by_id}
+    caught_up = set()
+    ready = deque(by_id)
+    running = {}
+    results = []
+    
+    def until_next_due() -> Optional[float]:
+        pending = [t for t in due_at.values() if t]
+        return max(0.0, min(pending) - time.monotonic()) if pending else None
+    
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(logging_config(),)) as pool:
+        while running or not stop_event.is_set():
+            # Wake idle tenants whose poll interval has passed
+            now = time.monotonic()
+            for tenant_id in by_id:
+                if due_at[tenant_id] and due_at[tenant_id] <= now:
+                    due_at[tenant_id] = 0.0
+                    ready.append(tenant_id)
+            
+            while ready and len(running) < processes and not stop_event.is_set():
+                tenant_id = ready.popleft()
+                future = pool.submit(poll_func, by_id[tenant_id], state[tenant_id], quantum)
+                running[future] = tenant_id
+            
+            if not running:
+                if once and len(caught_up) == len(by_id):
+                    break
+                stop_event.wait(until_next_due())
+                continue
+            
+            done, _ = wait(running, timeout=until_next_due(), return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                tenant_id = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"tenant": tenant_id, "handled": 0, "backlog": False,
+                              "state": state[tenant_id], "error": str(e)}
+                results.append(result)
+                state[tenant_id] = result["state"]
+                
+                if result["error"]:
+                    log_event("tenant_turn_failed", level=ERROR, tenant=tenant_id, error=result["error"])
+                
+                if result["backlog"]:
+                    interval[tenant_id] = min_interval
+                    ready.append(tenant_id)
+                    continue
+                
+                caught_up.add(tenant_id)
+                if once:
+                    continue
+                interval[tenant_id] = next_poll_interval(
+                    interval[tenant_id], result["handled"], min_interval, max_interval
+                )
+                due_at[tenant_id] = time.monotonic() + interval[tenant_id]
+    
+    return results
+
+
+def _fake_poll_tenant(tenant: Dict, state: Optional[Dict], quantum: int) -> Dict:
+    """Test turn: tenant config "backlog" messages, each costing 5 ms of CPU-ish work"""
+    remaining = tenant["config"]["backlog"] if state is None else state["remaining"]
+    handled = min(quantum, remaining)
+    time.sleep(0.005 * handled)
+    return {
+        "tenant": tenant["id"],
+        "handled": handled,
+        "backlog": handled >= quantum and remaining > handled,
+        "state": {"remaining": remaining - handled},
+        "error": None
+    }
+
+
+def test_fair_scheduling():
+    """A noisy tenant must not delay quiet tenants' first turns"""
+    
+    print("Testing Multi-Tenant Fair Scheduling")
+    print("=" * 60)
+    print()
+    
+    tenants = [
+        {"id": "noisy", "email": "noisy@example.com", "config": {"backlog": 200}},
+        *({"id": f"quiet{i}", "email": f"q{i}@example.com", "config": {"backlog": 3}} for i in range(5))
+    ]
+    
+    start = time.perf_counter()
+    results = run_tenants(tenants, processes=2, quantum=10, once=True, poll_func=_fake_poll_tenant)
+    elapsed = time.perf_counter() - start
+    
+    order = [result["tenant"] for result in results]
+    handled = {}
+    for result in results:
+        handled[result["tenant"]] = handled.get(result["tenant"], 0) + result["handled"]
+    
+    assert handled == {"noisy": 200, **{f"quiet{i}": 3 for i in range(5)}}, handled
+    assert order.count("noisy") == 20
+    last_quiet = max(i for i, tenant_id in enumerate(order) if tenant_id != "noisy")
+    assert last_quiet < 8, f"quiet tenants waited behind the noisy one: {order}"
+    print(f"✅ All 5 quiet tenants served within the first {last_quiet + 1} turns")
+    print(f"✅ Noisy tenant drained in {order.count('noisy')} turns of 10")
+    print(f"   {len(results)} turns in {elapsed:.2f}s on 2 processes")
+    
+    unshared = [dict(tenant, config=dict(DEFAULT_TENANT_CONFIG)) for tenant in tenants]
+    try:
+        run_tenants(unshared, processes=2, once=True)
+    except ValueError:
+        print("✅ Process pool refused for tenants without a shared reservations database")
+    else:
+        raise AssertionError("tenants without reservations were run on 2 processes")
+    print()
+
+
+if __name__ == "__main__":
+    test_fair_scheduling()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Persistent cache for triage results.
+
+Each cron run re-fetches the most recent messages, so without a cache the
+same emails are triaged (and, with ClaudeTriage, paid for) over and over.
+Results are stored in a local SQLite file keyed by message id plus a hash
+of the message content, and versioned by triage backend + prompts, rule
+table and model so that changing any of them invalidates old entries
+automatically.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+def message_fingerprint(message: Dict) -> str:
+    """
+    Hash the fields triage actually looks at.
+    
+    Args:
+        message: Dict with keys: from, subject, text/preview
+    
+    Returns:
+        Hex SHA-256 of sender, subject and body
+    """
+    sender = message.get("from", "Unknown")
+    subject = message.get("subject", "(no subject)")
+    body = message.get("text") or message.get("preview", "")
+    
+    digest = hashlib.sha256()
+    for part in (sender, subject, body):
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def engine_version(engine) -> str:
+    """
+    Build a cache version string for a triage engine.
+    
+    Combines the backend class name with a hash of what decides its
+    answers: prompts (TRIAGE_PROMPT_TEMPLATE, SYSTEM_PROMPT), rule table
+    (KEYWORD_GROUPS) and model (MODEL), whichever the engine has. Editing
+    any of them or switching backends never serves stale results.
+    """
+    definition = {
+        name: getattr(engine, name, None)
+        for name in ("TRIAGE_PROMPT_TEMPLATE", "SYSTEM_PROMPT", "KEYWORD_GROUPS", "MODEL")
+    }
+    encoded = json.dumps(definition, sort_keys=True).encode("utf-8")
+    return f"{type(engine).__name__}:{hashlib.sha256(encoded).hexdigest()[:16]}"
+
+
+class TriageCache:
+    """
+    SQLite-backed triage result cache with TTL and LRU eviction.
+    
+    Safe to share between worker threads.
+    """
+    
+    def __init__(self, path: str, ttl_seconds: int = 7 * 24 * 3600, max_entries: int = 10000):
+        """
+        Open (or create) the cache.
+        
+        Args:
+            path: SQLite file path (":memory:" for a throwaway cache)
+            ttl_seconds: Entries older than this are treated as misses
+            max_entries: Least recently used entries beyond this are evicted
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS triage_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_triage_cache_last_used ON triage_cache(last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM triage_cache").fetchone()[0]
+    
+    def _key(self, message: Dict, version: str) -> str:
+        message_id = message.get("message_id") or message.get("id") or ""
+        return f"{version}|{message_id}|{message_fingerprint(message)}"
+    
+    def get(self, message: Dict, version: str) -> Optional[Dict]:
+        """
+        Look up a cached triage result.
+        
+        Args:
+            message: The message being triaged
+            version: Engine version from engine_version()
+        
+        Returns:
+            Cached triage dict, or None on a miss
+        """
+        key = self._key(message, version)
+        now = time.time()
+        
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, created_at FROM triage_cache WHERE key = ?", (key,)
+            ).fetchone()
+            
+            if row is None:
+                self.misses += 1
+                return None
+            
+            result, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM triage_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._size -= 1
+                self.misses += 1
+                return None
+            
+            self._conn.execute("UPDATE triage_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(result)
+    
+    def put(self, message: Dict, version: str, triage: Dict):
+        """
+        Store a triage result, evicting least recently used entries if full.
+        
+        Stand-in results (marked "fallback" or "partial" by the LLM engine)
+        are not stored, so a failed call is retried instead of served for
+        the whole TTL.
+        
+        Args:
+            message: The message that was triaged
+            version: Engine version from engine_version()
+            triage: Triage result dict
+        """
+        if triage.get("fallback") or triage.get("partial"):
+            return
+        key = self._key(message, version)
+        now = time.time()
+        
+        with self._lock:
+            existed = self._conn.execute(
+                "SELECT 1 FROM triage_cache WHERE key = ?", (key,)
+            ).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO triage_cache (key, result, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(triage, default=str), now, now)
+            )
+            if not existed:
+                self._size += 1
+            
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM triage_cache WHERE key IN "
+                    "(SELECT key FROM triage_cache ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._size -= overflow
+                self.evictions += overflow
+            
+            self._conn.commit()
+    
+    def stats(self) -> Dict:
+        """Return hit/miss counters and current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self._size
+        }
+    
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def test_cache():
+    """Test cache hits, versioning, TTL and eviction"""
+    
+    print("Testing Triage Cache")
+    print("=" * 60)
+    print()
+    
+    cache = TriageCache(":memory:", ttl_seconds=60, max_entries=2)
+    message = {"id": "msg_1", "from": "a@example.com", "subject": "AC broken", "text": "Please fix"}
+    triage = {"intent": "booking", "urgency": "today"}
+    
+    assert cache.get(message, "v1") is None
+    cache.put(message, "v1", triage)
+    assert cache.get(message, "v1") == triage
+    print("✅ Hit after put")
+    
+    assert cache.get(message, "v2") is None
+    assert cache.get(dict(message, text="Please fix ASAP"), "v1") is None
+    print("✅ Version and content changes miss")
+    
+    other = {"id": "msg_9", "subject": "Odd"}
+    cache.put(other, "v1", dict(triage, fallback=True))
+    cache.put(other, "v1", dict(triage, partial=True))
+    assert cache.get(other, "v1") is None
+    print("✅ Fallback and partial LLM results not cached")
+    
+    cache.put({"id": "msg_2"}, "v1", triage)
+    cache.get(message, "v1")  # msg_1 becomes most recently used
+    cache.put({"id": "msg_3"}, "v1", triage)
+    assert cache.get({"id": "msg_2"}, "v1") is None
+    assert cache.get(message, "v1") == triage
+    print("✅ Least recently used entry evicted")
+    
+    cache.ttl_seconds = -1
+    assert cache.get(message, "v1") is None
+    print("✅ Expired entry misses")
+    
+    from openclaw_triage import OpenClawTriage
+    
+    class EditedRules(OpenClawTriage):
+        KEYWORD_GROUPS = dict(OpenClawTriage.KEYWORD_GROUPS, spam=["unsubscribe"])
+    
+    class OtherModel(OpenClawTriage):
+        MODEL = "another-model"
+    
+    versions = {engine_version(engine)[-16:] for engine in (OpenClawTriage(), EditedRules(), OtherModel())}
+    assert len(versions) == 3, versions
+    assert engine_version(OpenClawTriage()) == engine_version(OpenClawTriage())
+    print("✅ Rule table and model changes give a new engine version")
+    
+    print(f"Stats: {cache.stats()}")
+    print()
+
+
+if __name__ == "__main__":
+    test_cache()
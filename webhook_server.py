@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Webhook ingestion server - push alternative to inbox polling.
+
+Accepts message events over HTTP and feeds them into the same
+triage -> route pipeline as poc_monitor's poller, giving sub-second
+reaction time without polling the API harder. Messages seen by both the
+webhook and the poller are handled once (shared SeenMessages set).
+
+Accepted request bodies (POST /webhook, JSON):
+    {"event_type": "message.received", "message": {...}}   (Agentmail style)
+    {...}                                                  (bare message dict)
+
+GET /health reports queue depth; GET /metrics serves the process's
+Prometheus metrics (see metrics.py).
+
+The server binds to loopback by default. Binding any other interface
+requires a shared secret (X-Webhook-Secret), since a pushed message can
+make the monitor email whatever "from" address it carries. A message
+that fails is retried here with backoff; the poller may already be past
+it, so handing it back would lose it.
+
+With a WorkQueue, a pushed message is staged there (deduped by id, as
+poll_once does) before the 202 reply, and a worker drains the queue
+straight away. Retries then belong to the queue, so a crash or restart
+can't lose a message the poller has already skipped.
+
+The message dict has the shape MessageTriage.triage_message consumes:
+message_id, from, subject, text/preview, timestamp.
+"""
+
+import hmac
+import ipaddress
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from metrics import METRICS
+from structured_log import DEBUG, ERROR, WARNING, log_event
+from poc_monitor import (
+    ActionRouter, MessageTriage, SeenMessages, _message_key, drain_work_queue, enqueue_messages,
+    process_message, report_results
+)
+from work_queue import WorkQueue
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WebhookIngestServer:
+    """HTTP endpoint + worker threads that triage and route pushed messages"""
+    
+    MAX_BODY_BYTES = 1024 * 1024
+    MAX_ATTEMPTS = 5
+    
+    def __init__(
+        self,
+        triage_engine: MessageTriage,
+        router: ActionRouter,
+        seen: Optional[SeenMessages] = None,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        secret: Optional[str] = None,
+        workers: int = 1,
+        retry_delay: float = 2.0,
+        work_queue: Optional[WorkQueue] = None
+    ):
+        """
+        Args:
+            triage_engine: Triage engine (shared with the poller)
+            router: Action router (shared with the poller)
+            seen: Dedupe set shared with the poller
+            host: Interface to bind
+            port: Port to bind (0 picks a free one)
+            secret: If set, requests must carry it in X-Webhook-Secret
+                (required unless host is loopback)
+            workers: Threads draining the ingest queue
+            retry_delay: Seconds before retrying a failed message, doubled per attempt
+            work_queue: Durable queue to stage pushed messages in (shared with the poller)
+        
+        Raises:
+            ValueError: host is not loopback and no secret is set
+        """
+        if not secret and not _is_loopback(host):
+            raise ValueError(f"A webhook secret is required to listen on {host}")
+        
+        self.triage_engine = triage_engine
+        self.router = router
+        self.seen = seen or SeenMessages()
+        self.secret = secret
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.work_queue = work_queue
+        self.queue: "queue.Queue[Optional[Dict]]" = queue.Queue()
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.abandoned = 0
+        self._attempts: Dict[str, int] = {}
+        self._retry_timers: Dict[str, threading.Timer] = {}
+        self._retry_lock = threading.Lock()
+        
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.port = self.httpd.server_address[1]
+        self._threads = []
+    
+    def _handler_class(self):
+        server = self
+        
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def _reply(self, status: int, payload: Dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self):
+                if self.path == "/health":
+                    self._reply(200, {"status": "ok", "queue_depth": server.queue.qsize()})
+                elif self.path == "/metrics":
+                    body = METRICS.prometheus_text().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self._reply(404, {"error": "not found"})
+            
+            def do_POST(self):
+                if self.path != "/webhook":
+                    self._reply(404, {"error": "not found"})
+                    return
+                if server.secret and not hmac.compare_digest(
+                    self.headers.get("X-Webhook-Secret", "").encode("utf-8"), server.secret.encode("utf-8")
+                ):
+                    self._reply(401, {"error": "bad secret"})
+                    return
+                
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= server.MAX_BODY_BYTES:
+                    self.close_connection = True
+                    self._reply(413, {"error": f"body must be 0-{server.MAX_BODY_BYTES} bytes"})
+                    return
+                
+                try:
+                    event = json.loads(self.rfile.read(length))
+                except (ValueError, json.JSONDecodeError):
+                    self._reply(400, {"error": "invalid JSON"})
+                    return
+                
+                message = event.get("message", event) if isinstance(event, dict) else None
+                if not isinstance(message, dict):
+                    self._reply(400, {"error": "expected a message object"})
+                    return
+                
+                try:
+                    queued = server.submit(message)
+                except Exception as e:
+                    log_event("webhook_enqueue_failed", level=ERROR, message_id=message.get("message_id"), error=str(e))
+                    self._reply(503, {"error": "could not queue message"})
+                    return
+                self._reply(202, {"queued": queued, "message_id": message.get("message_id")})
+        
+        return WebhookHandler
+    
+    def submit(self, message: Dict) -> bool:
+        """
+        Queue a message for processing unless it has already been handled.
+        
+        With a work queue the message is durable once this returns True.
+        """
+        self.received += 1
+        if not self.seen.add(message):
+            self.duplicates += 1
+            return False
+        if self.work_queue is not None:
+            try:
+                queued = enqueue_messages(self.work_queue, [message])
+            except Exception:
+                self.seen.discard(message)  # let the sender's retry through
+                raise
+            if not queued:
+                self.duplicates += 1
+                return False
+        self.queue.put(message)
+        return True
+    
+    def _work(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                self.queue.task_done()
+                return
+            
+            log_event("webhook_message", level=DEBUG, message_id=message.get("message_id"), subject=message.get("subject"))
+            if self.work_queue is not None:
+                # Already staged: drain it (and anything else due) now; the queue retries failures
+                try:
+                    self.processed += drain_work_queue(self.work_queue, self.triage_engine, self.router)
+                except Exception as e:
+                    log_event("webhook_drain_failed", level=ERROR, message_id=message.get("message_id"), error=str(e))
+                self.queue.task_done()
+                continue
+            
+            result = process_message(message, self.triage_engine, self.router)
+            report_results([message], [result])
+            if result["error"]:
+                self._retry_later(message)
+            else:
+                with self._retry_lock:
+                    self._attempts.pop(_message_key(message), None)
+            self.processed += 1
+            self.queue.task_done()
+    
+    def _retry_later(self, message: Dict):
+        """Queue a failed message again after a backoff, or give up after MAX_ATTEMPTS"""
+        key = _message_key(message)
+        with self._retry_lock:
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= self.MAX_ATTEMPTS:
+                self._attempts.pop(key, None)
+                self.abandoned += 1
+                log_event("message_abandoned", level=ERROR, message_id=message.get("message_id"), attempts=attempts, source="webhook")
+                return
+            self._attempts[key] = attempts
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            timer = threading.Timer(delay, self._requeue, (key, message))
+            timer.daemon = True
+            self._retry_timers[key] = timer
+        log_event("webhook_retry", level=WARNING, message_id=message.get("message_id"), attempt=attempts, delay=delay)
+        timer.start()
+    
+    def _requeue(self, key: str, message: Dict):
+        with self._retry_lock:
+            if self._retry_timers.pop(key, None) is None:
+                return  # stopped meanwhile
+        self.queue.put(message)
+    
+    def start(self):
+        """Start serving and processing in background threads"""
+        for _ in range(self.workers):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._threads.append(worker)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        log_event("webhook_listening", port=self.port)
+    
+    def stop(self):
+        """Stop accepting requests, drain the queue and stop workers"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        with self._retry_lock:
+            for timer in self._retry_timers.values():
+                timer.cancel()
+            self._retry_timers.clear()
+        for _ in self._threads:
+            self.queue.put(None)
+        for worker in self._threads:
+            worker.join()
+    
+    def stats(self) -> Dict:
+        """Ingest counters"""
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "retrying": len(self._retry_timers),
+            "abandoned": self.abandoned,
+            "queue_depth": self.queue.qsize()
+        }
+
+
+def test_webhook_server():
+    """POST messages to a local server and check processing + dedupe"""
+    import urllib.request
+    from calendar_manager import CalendarManager
+    
+    print("Testing Webhook Ingestion Server")
+    print("=" * 60)
+    print()
+    
+    class FlakyRouter(ActionRouter):
+        failures = 2
+        
+        def route(self, message, triage):
+            if message.get("message_id") == "flaky" and FlakyRouter.failures:
+                FlakyRouter.failures -= 1
+                raise RuntimeError("calendar unavailable")
+            return super().route(message, triage)
+    
+    seen = SeenMessages()
+    router = FlakyRouter(client=None, calendar=CalendarManager())
+    server = WebhookIngestServer(MessageTriage(), router, seen=seen, port=0, secret="s3cret", retry_delay=0.05)
+    server.start()
+    
+    def post(payload, secret="s3cret", headers=None):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{server.port}/webhook",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json", "X-Webhook-Secret": secret, **(headers or {})}
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+    
+    message = {"message_id": "m1", "from": "a@example.com", "subject": "Spam", "text": "click here"}
+    
+    start = time.perf_counter()
+    assert post({"event_type": "message.received", "message": message}) == (202, {"queued": True, "message_id": "m1"})
+    server.queue.join()
+    print(f"✅ Pushed message processed in {(time.perf_counter() - start) * 1000:.1f} ms")
+    
+    assert post(message)[1]["queued"] is False
+    assert not seen.add(message), "poller should see m1 as already handled"
+    print("✅ Duplicate push and later poll are both skipped")
+    
+    assert post(message, secret="wrong")[0] == 401
+    print("✅ Bad secret rejected")
+    
+    assert post({}, headers={"Content-Length": str(server.MAX_BODY_BYTES + 1)})[0] == 413
+    try:
+        WebhookIngestServer(MessageTriage(), router, host="0.0.0.0", port=0)
+        raise AssertionError("listening on all interfaces without a secret")
+    except ValueError:
+        pass
+    print("✅ Oversized body rejected; public bind needs a secret")
+    
+    processed = server.processed
+    post(dict(message, message_id="flaky"))
+    deadline = time.time() + 5
+    while server.processed < processed + 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert server.processed == processed + 3 and not server._attempts and not seen.add({"message_id": "flaky"})
+    print("✅ Failed message retried by the webhook until it went through")
+    
+    server.stop()
+    print(f"Stats: {server.stats()}")
+    
+    # With a work queue the push is durable before the 202, and a failure stays queued for retry
+    import tempfile
+    FlakyRouter.failures = 1
+    with tempfile.TemporaryDirectory() as tmp:
+        work_queue = WorkQueue(os.path.join(tmp, "queue.db"))
+        server = WebhookIngestServer(MessageTriage(), router, port=0, secret="s3cret", work_queue=work_queue)
+        server.start()
+        assert post(dict(message, message_id="queued"))[1]["queued"] is True
+        assert post(dict(message, message_id="flaky"))[1]["queued"] is True
+        server.queue.join()
+        assert work_queue.depth("triage") == {"done": 2}, work_queue.depth("triage")
+        assert work_queue.depth("route") == {"done": 1, "ready": 1}, work_queue.depth("route")
+        assert not enqueue_messages(work_queue, [dict(message, message_id="queued")]), "poller must not requeue it"
+        server.stop()
+        work_queue.close()
+    print("✅ Work-queue mode: pushes staged durably, failed route left queued for retry")
+    print()
+
+
+if __name__ == "__main__":
+    test_webhook_server()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Durable on-disk work queue (SQLite, WAL mode).
+
+Decouples the fetch -> triage -> route stages: each stage leases jobs
+from its own named queue, acks them when done, and fails them for a
+retry with exponential backoff. Jobs survive restarts, leases that are
+never acked (crashed worker) expire and are handed out again, and a
+dedupe key per queue stops a re-fetched message from being enqueued a
+second time. Every lease carries a token, so a worker whose lease has
+expired cannot ack or fail a job that another worker has since claimed.
+"""
+
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+
+class Job:
+    """A leased unit of work"""
+    
+    def __init__(self, job_id: int, queue: str, payload: Dict, attempts: int, lease_token: Optional[str] = None):
+        self.id = job_id
+        self.queue = queue
+        self.payload = payload
+        self.attempts = attempts
+        self.lease_token = lease_token
+    
+    def __repr__(self):
+        return f"Job(id={self.id}, queue={self.queue!r}, attempts={self.attempts})"
+
+
+class WorkQueue:
+    """
+    SQLite-backed job queue with enqueue / lease / ack / fail semantics.
+    
+    Safe to share between threads; separate processes can open the same file.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = 5,
+        backoff_base: float = 30.0,
+        backoff_max: float = 3600.0
+    ):
+        """
+        Open (or create) the queue.
+        
+        Args:
+            path: SQLite file path (":memory:" for a throwaway queue)
+            max_attempts: Failures after which a job is parked as "dead"
+            backoff_base: First retry delay in seconds, doubled per attempt
+            backoff_max: Cap on any single retry delay
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                queue TEXT NOT NULL,
+                dedupe_key TEXT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'ready',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_expires REAL,
+                lease_token TEXT,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                UNIQUE (queue, dedupe_key)
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "lease_token" not in columns:
+            # Queue files created before lease tokens existed
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_token TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(queue, status, available_at)")
+    
+    def enqueue(self, queue: str, payload: Dict, dedupe_key: Optional[str] = None) -> Optional[int]:
+        """
+        Add a job.
+        
+        Args:
+            queue: Stage name (e.g. "triage", "route")
+            payload: JSON-serialisable job data
+            dedupe_key: If a job with this key was ever enqueued on this queue,
+                nothing is added
+        
+        Returns:
+            New job id, or None if it was a duplicate
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (queue, dedupe_key, payload, available_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (queue, dedupe_key, json.dumps(payload, default=str), now, now)
+            )
+            return cursor.lastrowid if cursor.rowcount else None
+    
+    def lease(self, queue: str, limit: int = 1, lease_seconds: float = 300) -> List[Job]:
+        """
+        Claim up to `limit` runnable jobs for `lease_seconds`.
+        
+        Runnable means ready and due, or leased by a worker whose lease has
+        expired. Jobs come back oldest first, each holding a fresh lease token.
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT id, payload, attempts FROM jobs
+                    WHERE queue = ?
+                      AND ((status = 'ready' AND available_at <= ?)
+                           OR (status = 'leased' AND lease_expires <= ?))
+                    ORDER BY id
+                    LIMIT ?
+                    """,
+                    (queue, now, now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE jobs SET status = 'leased', lease_expires = ?, lease_token = ? WHERE id = ?",
+                    [(now + lease_seconds, token, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        
+        return [Job(job_id, queue, json.loads(payload), attempts, token) for job_id, payload, attempts in rows]
+    
+    def ack(self, job: Job) -> bool:
+        """
+        Mark a job as done.
+        
+        Returns:
+            False if the lease was lost (expired and re-leased), in which
+            case the job is left to its current holder
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'done', lease_expires = NULL, lease_token = NULL "
+                "WHERE id = ? AND status = 'leased' AND lease_token = ?",
+                (job.id, job.lease_token)
+            )
+            return cursor.rowcount == 1
+    
+    def complete_and_enqueue(self, job: Job, queue: str, payload: Dict, dedupe_key: Optional[str] = None) -> bool:
+        """
+        Ack `job` and enqueue its follow-up in one transaction (stage hand-off).
+        
+        Returns:
+            False if the lease was lost; nothing is enqueued in that case
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = 'done', lease_expires = NULL, lease_token = NULL "
+                    "WHERE id = ? AND status = 'leased' AND lease_token = ?",
+                    (job.id, job.lease_token)
+                )
+                if cursor.rowcount != 1:
+                    self._conn.execute("ROLLBACK")
+                    return False
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO jobs (queue, dedupe_key, payload, available_at, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (queue, dedupe_key, json.dumps(payload, default=str), now, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+    
+    def fail(self, job: Job, error: str) -> bool:
+        """
+        Record a failed attempt. The job is retried after an exponential,
+        jittered delay, or parked as "dead" after max_attempts.
+        
+        Returns:
+            False if the lease was lost, in which case nothing is recorded
+        """
+        attempts = job.attempts + 1
+        if attempts >= self.max_attempts:
+            status, available_at = "dead", time.time()
+        else:
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+            status, available_at = "ready", time.time() + random.uniform(delay / 2, delay)
+        
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, available_at = ?, lease_expires = NULL, "
+                "lease_token = NULL, last_error = ? WHERE id = ? AND status = 'leased' AND lease_token = ?",
+                (status, attempts, available_at, error[:1000], job.id, job.lease_token)
+            )
+            return cursor.rowcount == 1
+    
+    def depth(self, queue: Optional[str] = None) -> Dict[str, int]:
+        """Job counts by status (for one queue, or all)"""
+        with self._lock:
+            if queue is None:
+                rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT status, COUNT(*) FROM jobs WHERE queue = ? GROUP BY status", (queue,)
+                ).fetchall()
+        return dict(rows)
+    
+    def purge_done(self, older_than_seconds: float = 30 * 24 * 3600) -> int:
+        """Delete finished jobs older than the cutoff (their dedupe keys go with them)"""
+        cutoff = time.time() - older_than_seconds
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status = 'done' AND created_at < ?", (cutoff,)
+            )
+            return cursor.rowcount
+    
+    def close(self):
+        """Close the underlying database connection"""
+        with self._lock:
+            self._conn.close()
+
+
+def test_work_queue():
+    """Test enqueue/lease/ack/fail, dedupe, lease expiry and restart"""
+    import os
+    import tempfile
+    
+    print("Testing Work Queue")
+    print("=" * 60)
+    print()
+    
+    path = os.path.join(tempfile.mkdtemp(), "queue.db")
+    queue = WorkQueue(path, max_attempts=2, backoff_base=0)
+    
+    assert queue.enqueue("triage", {"n": 1}, dedupe_key="m1") is not None
+    assert queue.enqueue("triage", {"n": 1}, dedupe_key="m1") is None
+    print("✅ Duplicate enqueue ignored")
+    
+    job = queue.lease("triage")[0]
+    assert queue.lease("triage") == []
+    queue.fail(job, "boom")
+    job = queue.lease("triage")[0]
+    assert job.attempts == 1
+    queue.fail(job, "boom again")
+    assert queue.depth("triage") == {"dead": 1}
+    print("✅ Failed job retried, then parked as dead")
+    
+    queue.enqueue("triage", {"n": 2}, dedupe_key="m2")
+    stale = queue.lease("triage", lease_seconds=0)[0]  # worker "crashes" holding it
+    job = queue.lease("triage")[0]
+    assert job.id == stale.id
+    print("✅ Expired lease handed out again")
+    
+    assert not queue.ack(stale)
+    assert not queue.fail(stale, "late")
+    assert not queue.complete_and_enqueue(stale, "route", {"n": 2}, dedupe_key="m2")
+    assert queue.depth("triage") == {"dead": 1, "leased": 1}
+    assert queue.depth("route") == {}
+    print("✅ Stale worker cannot ack or fail a re-leased job")
+    
+    assert queue.complete_and_enqueue(job, "route", {"n": 2}, dedupe_key="m2")
+    queue.close()
+    
+    reopened = WorkQueue(path)
+    assert [j.payload for j in reopened.lease("route")] == [{"n": 2}]
+    assert reopened.enqueue("triage", {"n": 2}, dedupe_key="m2") is None
+    print("✅ Jobs and dedupe keys survive a restart")
+    
+    assert reopened.purge_done(older_than_seconds=-1) == 1
+    assert reopened.depth("triage") == {"dead": 1}
+    print("✅ Finished jobs purged")
+    print(f"Depth: {reopened.depth()}")
+    print()
+
+
+if __name__ == "__main__":
+    test_work_queue()